@@ -0,0 +1,124 @@
+"""
+Throughput and accuracy of the confidence-gated cascade against the full
+classifier alone, on a held-out folder of images.
+
+Images in sub-folders named after a class (e.g. Tomato___Late_blight or
+stem_borer) are scored against that label; otherwise accuracy is reported
+as top-1 agreement with the full model. Each threshold reports images/s of
+batched inference, the share of images escalated to the full model, and
+the accuracy change relative to the full model.
+
+Usage (from the repository root):
+    python Backend/benchmarks/cascade_accuracy.py --model disease --images path/to/holdout --thresholds 80,90,95
+    python Backend/benchmarks/cascade_accuracy.py --model pest --images path/to/holdout --fast-model Backend/models/pest_classifier.fast.keras
+"""
+import argparse
+import json
+import os
+import time
+from typing import List, Optional, Tuple
+
+import common
+import numpy as np
+
+from src.cascade import fast_model_path, load_cascade
+from src.disease_model import CLASS_DICT, DiseaseModel
+from src.pest_model import CLASS_NAMES, PestModel
+from src.preprocessing import preprocess_batch
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".webp")
+
+
+def load_holdout(model, directory: str, limit: int) -> Tuple[np.ndarray, List[Optional[int]]]:
+    """Preprocessed images and their class index (None when the folder is not a class name)"""
+    if isinstance(model, DiseaseModel):
+        class_index = {name: index for index, name in CLASS_DICT.items()}
+    else:
+        class_index = {name: index for index, name in enumerate(CLASS_NAMES)}
+
+    paths, labels = [], []
+    for root, _, files in os.walk(directory):
+        label = class_index.get(os.path.basename(root))
+        for name in sorted(files):
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                paths.append(os.path.join(root, name))
+                labels.append(label)
+    paths, labels = paths[:limit], labels[:limit]
+
+    batch, errors = preprocess_batch(paths, model.input_spec)
+    keep = [error is None for error in errors]
+    return batch[keep], [label for label, ok in zip(labels, keep) if ok]
+
+
+def run(model, inputs: np.ndarray, batch_size: int, repeats: int) -> Tuple[np.ndarray, List[str], float]:
+    """Predicted classes, answering stages and best images/s over `repeats` passes"""
+    model.predict_batch(inputs[:batch_size])
+    best = 0.0
+    for _ in range(repeats):
+        predicted, stages = [], []
+        start = time.perf_counter()
+        for i in range(0, len(inputs), batch_size):
+            for result in model.predict_batch(inputs[i:i + batch_size]):
+                predicted.append(result["predicted_class"] if "predicted_class" in result else result["predicted_pest"])
+                stages.append(result.get("stage", "full"))
+        best = max(best, len(inputs) / (time.perf_counter() - start))
+    return np.array(predicted), stages, best
+
+
+def accuracy(predicted: np.ndarray, reference: np.ndarray) -> float:
+    return round(float(np.mean(predicted == reference)), 4)
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", choices=["disease", "pest"], default="disease")
+    parser.add_argument("--images", required=True, help="Held-out images, optionally in class-name sub-folders")
+    parser.add_argument("--fast-model", help="Fast model (default: <model>.fast.keras next to the classifier)")
+    parser.add_argument("--thresholds", default="80,90,95", help="Comma-separated confidence thresholds (%)")
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--limit", type=int, default=1000, help="Maximum images used")
+    parser.add_argument("--report", help="Also write the results as JSON to this file")
+    args = parser.parse_args()
+
+    model = DiseaseModel() if args.model == "disease" else PestModel()
+    model.cascade = None
+    inputs, labels = load_holdout(model, args.images, args.limit)
+    if not len(inputs):
+        parser.error(f"No readable images in {args.images}")
+
+    names = list(CLASS_DICT.values()) if args.model == "disease" else CLASS_NAMES
+    labelled = all(label is not None for label in labels)
+    full_predicted, _, full_rate = run(model, inputs, args.batch_size, args.repeats)
+    reference = np.array([names[label] for label in labels]) if labelled else full_predicted
+    full_accuracy = accuracy(full_predicted, reference)
+
+    results = {
+        "full_model": {
+            "images_per_s": round(full_rate, 2),
+            "accuracy": full_accuracy
+        }
+    }
+    cascade = load_cascade(args.fast_model or fast_model_path(model.model_path), threshold=0, name=args.model)
+    model.cascade = cascade
+    for threshold in (float(value) for value in args.thresholds.split(",")):
+        cascade.threshold = threshold
+        predicted, stages, rate = run(model, inputs, args.batch_size, args.repeats)
+        cascade_accuracy = accuracy(predicted, reference)
+        results[f"cascade@{threshold:g}"] = {
+            "images_per_s": round(rate, 2),
+            "speedup": round(rate / full_rate, 2),
+            "escalated": round(stages.count("full") / len(stages), 4),
+            "accuracy": cascade_accuracy,
+            "accuracy_delta": round(cascade_accuracy - full_accuracy, 4)
+        }
+
+    print(f"{len(inputs)} images, accuracy {'against folder labels' if labelled else 'as agreement with the full model'}")
+    common.print_table(results)
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump({"model": args.model, "images": len(inputs), "labelled": labelled, "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,94 @@
+"""
+Time-to-first-token of /chatbot/stream/ compared with the full /chatbot/ response.
+
+The API is served by uvicorn on a local port with KrishiMitra backed by a
+fake chat model that emits tokens with a fixed delay, so the numbers reflect
+server overhead plus the configured LLM timing, not network conditions.
+
+Usage (from the repository root):
+    python Backend/benchmarks/chat_stream_ttft.py --requests 10 --first-token-delay 0.5 --token-delay 0.05
+"""
+import argparse
+import socket
+import threading
+import time
+
+import common
+import fakes
+import httpx
+import uvicorn
+
+import main
+from src.chatbot import KrishiMitra
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _serve(port: int) -> uvicorn.Server:
+    config = uvicorn.Config(main.app, host="127.0.0.1", port=port, log_level="warning", lifespan="off")
+    server = uvicorn.Server(config)
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.01)
+    return server
+
+
+def measure_full(client: httpx.Client, requests: int):
+    latencies = []
+    for i in range(requests):
+        start = time.perf_counter()
+        client.post("/chatbot/", json={"query": f"When should I sow wheat? ({i})", "session_id": "bench-full"})
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def measure_stream(client: httpx.Client, requests: int):
+    first_token, complete = [], []
+    for i in range(requests):
+        start = time.perf_counter()
+        seen_token = False
+        payload = {"query": f"When should I sow wheat? ({i})", "session_id": "bench-stream"}
+        with client.stream("POST", "/chatbot/stream/", json=payload) as response:
+            for line in response.iter_lines():
+                if line.startswith("event: token") and not seen_token:
+                    first_token.append(time.perf_counter() - start)
+                    seen_token = True
+        complete.append(time.perf_counter() - start)
+    return first_token, complete
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=10)
+    parser.add_argument("--first-token-delay", type=float, default=0.5, help="Seconds before the fake LLM's first token")
+    parser.add_argument("--token-delay", type=float, default=0.05, help="Seconds between tokens")
+    args = parser.parse_args()
+
+    chat_model = fakes.FakeStreamingChatModel(
+        first_token_delay=args.first_token_delay,
+        token_delay=args.token_delay
+    )
+    main.chatbot = KrishiMitra(embeddings=fakes.fake_embeddings(), chat_model=chat_model)
+
+    port = _free_port()
+    server = _serve(port)
+    try:
+        with httpx.Client(base_url=f"http://127.0.0.1:{port}", timeout=None) as client:
+            full = measure_full(client, args.requests)
+            first_token, complete = measure_stream(client, args.requests)
+    finally:
+        server.should_exit = True
+
+    common.print_table({
+        "chatbot_full_response": common.summarize(full),
+        "stream_first_token": common.summarize(first_token),
+        "stream_complete": common.summarize(complete)
+    })
+
+
+if __name__ == "__main__":
+    main_cli()
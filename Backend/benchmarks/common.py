@@ -0,0 +1,35 @@
+import os
+import sys
+from typing import Dict, List
+
+# Make `main` and `src` importable when a benchmark is run as a script
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+
+def percentile(values: List[float], q: float) -> float:
+    """Nearest-rank percentile of a list of values (q in 0-100)"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(q / 100.0 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def summarize(latencies_s: List[float]) -> Dict:
+    """Latency summary in milliseconds"""
+    return {
+        "count": len(latencies_s),
+        "p50_ms": round(percentile(latencies_s, 50) * 1000, 2),
+        "p95_ms": round(percentile(latencies_s, 95) * 1000, 2),
+        "p99_ms": round(percentile(latencies_s, 99) * 1000, 2),
+        "max_ms": round(max(latencies_s) * 1000, 2) if latencies_s else 0.0
+    }
+
+
+def print_table(rows: Dict[str, Dict]):
+    """Print one summary line per benchmark case"""
+    for name, stats in rows.items():
+        fields = "  ".join(f"{key}={value}" for key, value in stats.items())
+        print(f"{name:<24} {fields}")
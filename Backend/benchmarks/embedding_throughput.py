@@ -0,0 +1,87 @@
+"""
+Embeddings per second with and without the embedding cache.
+
+Several threads embed farmer questions drawn from a small pool with
+repeats, as the chatbot does for query retrieval and saved turns. The
+encoder is a stand-in with a fixed cost per call and per text; pass
+--minilm to use the real all-MiniLM-L6-v2 model instead.
+
+Usage (from the repository root):
+    python Backend/benchmarks/embedding_throughput.py --texts 2000 --threads 8 --distinct 200
+"""
+import argparse
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import common
+import fakes
+
+from src.embeddings import CachedEmbeddings
+
+CROPS = ["wheat", "rice", "cotton", "sugarcane", "soybean", "tomato", "onion", "maize"]
+TOPICS = [
+    "When should I sow {crop}?",
+    "How much water does {crop} need this week?",
+    "Which fertilizer is best for {crop}?",
+    "How do I control pests on {crop}?",
+    "Is it safe to spray {crop} before rain?"
+]
+
+
+def make_workload(texts: int, distinct: int, seed: int = 0):
+    rng = random.Random(seed)
+    pool = [
+        rng.choice(TOPICS).format(crop=rng.choice(CROPS)) + f" (field {i})"
+        for i in range(distinct)
+    ]
+    # Popular questions repeat far more often than rare ones
+    weights = [1.0 / (rank + 1) for rank in range(distinct)]
+    workload = rng.choices(pool, weights=weights, k=texts)
+    # Farmers type the same question with different casing and spacing
+    return [text.upper() if rng.random() < 0.2 else "  " + text for text in workload]
+
+
+def run(embeddings, workload, threads: int) -> float:
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        list(pool.map(embeddings.embed_query, workload))
+    return len(workload) / (time.perf_counter() - start)
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--texts", type=int, default=2000)
+    parser.add_argument("--distinct", type=int, default=200, help="Distinct questions in the pool")
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--call-overhead", type=float, default=0.01, help="Stand-in encoder seconds per call")
+    parser.add_argument("--per-text", type=float, default=0.002, help="Stand-in encoder seconds per text")
+    parser.add_argument("--minilm", action="store_true", help="Use the real all-MiniLM-L6-v2 encoder")
+    args = parser.parse_args()
+
+    if args.minilm:
+        from langchain_huggingface import HuggingFaceEmbeddings
+        encoder = HuggingFaceEmbeddings(model_name="sentence-transformers/all-MiniLM-L6-v2")
+    else:
+        encoder = fakes.SlowEmbeddings(call_overhead=args.call_overhead, per_text=args.per_text)
+    workload = make_workload(args.texts, args.distinct)
+
+    uncached = run(encoder, workload, args.threads)
+    cached_embeddings = CachedEmbeddings(encoder)
+    cached = run(cached_embeddings, workload, args.threads)
+    stats = cached_embeddings.stats()
+
+    common.print_table({
+        "uncached": {"embeddings_per_s": round(uncached, 1)},
+        "cached_batched": {
+            "embeddings_per_s": round(cached, 1),
+            "hit_rate": stats["hit_rate"],
+            "encoder_batches": stats["batches"],
+            "mean_batch_size": stats["mean_batch_size"],
+            "cache_bytes": stats["cache_bytes"]
+        }
+    })
+
+
+if __name__ == "__main__":
+    main_cli()
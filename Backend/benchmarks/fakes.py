@@ -0,0 +1,377 @@
+"""
+Local stand-ins for external services used by the benchmarks.
+"""
+import asyncio
+import json
+import os
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+import common  # noqa: F401  (puts Backend/ on sys.path)
+from langchain_core.callbacks import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+DEFAULT_RESPONSE = (
+    "<h3>Wheat Sowing Advice</h3>"
+    "<p>Sow wheat between <strong>1 and 25 November</strong> when the soil is moist "
+    "and day temperatures stay below 25°C.</p>"
+    "<ul><li>Use 100 kg seed per hectare.</li><li>Apply a light irrigation 20 days after sowing.</li>"
+    "<li>Watch for rust during cool, humid spells.</li></ul>"
+)
+
+
+class FakeStreamingChatModel(BaseChatModel):
+    """
+    Chat model that returns a fixed answer token by token with a delay,
+    so time-to-first-token can be measured without a remote LLM.
+    """
+
+    response: str = DEFAULT_RESPONSE
+    first_token_delay: float = 0.5
+    token_delay: float = 0.05
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-streaming-chat"
+
+    def _tokens(self) -> List[str]:
+        return re.findall(r"\S+\s*", self.response)
+
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any
+    ) -> ChatResult:
+        time.sleep(self.first_token_delay + self.token_delay * len(self._tokens()))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=self.response))])
+
+    def _stream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any
+    ) -> Iterator[ChatGenerationChunk]:
+        time.sleep(self.first_token_delay)
+        for token in self._tokens():
+            time.sleep(self.token_delay)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=token))
+
+    async def _astream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        await asyncio.sleep(self.first_token_delay)
+        for token in self._tokens():
+            await asyncio.sleep(self.token_delay)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=token))
+
+
+def fake_embeddings(size: int = 384):
+    """Deterministic hash-based embeddings with MiniLM's dimensionality"""
+    from langchain_community.embeddings import DeterministicFakeEmbedding
+    return DeterministicFakeEmbedding(size=size)
+
+
+class SlowEmbeddings:
+    """
+    Deterministic embeddings with encoder-like cost: a fixed overhead per
+    call plus a smaller cost per text, so batching and caching show up.
+    """
+
+    def __init__(self, size: int = 384, call_overhead: float = 0.01, per_text: float = 0.002):
+        self.inner = fake_embeddings(size)
+        self.call_overhead = call_overhead
+        self.per_text = per_text
+        self.calls = 0
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        self.calls += 1
+        time.sleep(self.call_overhead + self.per_text * len(texts))
+        return self.inner.embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+
+class _LocalServer:
+    """
+    Threaded HTTP server on a free localhost port, run in a daemon thread.
+
+    Subclasses implement `handle(handler)` for every request.
+    """
+
+    def __init__(self):
+        outer = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                outer._dispatch(self)
+
+            def do_POST(self):
+                outer._dispatch(self)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.calls = 0
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _dispatch(self, handler: BaseHTTPRequestHandler):
+        with self._lock:
+            self.calls += 1
+        try:
+            self.handle(handler)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def handle(self, handler: BaseHTTPRequestHandler):
+        raise NotImplementedError
+
+    @staticmethod
+    def send_json(handler: BaseHTTPRequestHandler, status: int, body: Dict):
+        data = json.dumps(body).encode()
+        handler.send_response(status)
+        handler.send_header("Content-Type", "application/json")
+        handler.send_header("Content-Length", str(len(data)))
+        handler.end_headers()
+        handler.wfile.write(data)
+
+
+class FakeWeatherServer(_LocalServer):
+    """
+    weatherapi.com stand-in serving /current.json and /forecast.json.
+
+    Every location exists and gets the same mild weather; each response
+    takes `latency` seconds. Point the app at it with WEATHER_API_URL.
+    """
+
+    def __init__(self, latency: float = 0.05):
+        super().__init__()
+        self.latency = latency
+
+    def handle(self, handler: BaseHTTPRequestHandler):
+        url = urlparse(handler.path)
+        params = parse_qs(url.query)
+        time.sleep(self.latency)
+        if "key" not in params or "q" not in params:
+            self.send_json(handler, 400, {"error": {"code": 1003, "message": "Parameter q is missing."}})
+            return
+
+        location = params["q"][0]
+        if url.path.endswith("/current.json"):
+            self.send_json(handler, 200, self.current(location))
+        elif url.path.endswith("/forecast.json"):
+            days = int(params.get("days", ["7"])[0])
+            self.send_json(handler, 200, {**self.current(location), "forecast": self.forecast(days)})
+        else:
+            self.send_json(handler, 404, {"error": {"code": 1005, "message": "API request url is invalid."}})
+
+    @staticmethod
+    def current(location: str) -> Dict:
+        return {
+            "location": {"name": location.title(), "region": "Maharashtra", "country": "India"},
+            "current": {
+                "temp_c": 27.5,
+                "feelslike_c": 29.1,
+                "condition": {"text": "Partly cloudy"},
+                "humidity": 62,
+                "wind_kph": 11.2,
+                "wind_dir": "WSW",
+                "precip_mm": 0.4,
+                "cloud": 40,
+                "uv": 6.0
+            }
+        }
+
+    @staticmethod
+    def forecast(days: int) -> Dict:
+        return {"forecastday": [
+            {
+                "date": f"2025-01-{day + 1:02d}",
+                "day": {
+                    "maxtemp_c": 30.0 + day % 3,
+                    "mintemp_c": 18.0 + day % 2,
+                    "totalprecip_mm": 2.5 if day % 3 == 0 else 0.0,
+                    "daily_chance_of_rain": 60 if day % 3 == 0 else 10,
+                    "condition": {"text": "Patchy rain possible" if day % 3 == 0 else "Sunny"}
+                }
+            }
+            for day in range(days)
+        ]}
+
+
+class FakeHFEndpoint(_LocalServer):
+    """
+    Hugging Face endpoint stand-in speaking the OpenAI-style
+    /v1/chat/completions protocol that ChatHuggingFace uses.
+
+    Answers with `response` after `first_token_delay` seconds, then emits
+    tokens at `tokens_per_second` (streamed as server-sent events when the
+    request asks for it). Point the app at it with HUGGINGFACE_ENDPOINT_URL.
+
+    For testing the LLM client, a `tail_fraction` of requests waits an extra
+    `tail_delay` seconds before answering, and a `failure_rate` of requests
+    gets a 503 instead. With `prefill_tokens_per_second`, the first token is
+    further delayed in proportion to the prompt length, as prompt processing
+    on a real server is.
+    """
+
+    def __init__(
+        self,
+        response: str = DEFAULT_RESPONSE,
+        first_token_delay: float = 0.3,
+        tokens_per_second: float = 50.0,
+        tail_fraction: float = 0.0,
+        tail_delay: float = 0.0,
+        failure_rate: float = 0.0,
+        prefill_tokens_per_second: float = 0.0,
+        seed: int = 0
+    ):
+        super().__init__()
+        self.response = response
+        self.first_token_delay = first_token_delay
+        self.tokens_per_second = tokens_per_second
+        self.tail_fraction = tail_fraction
+        self.tail_delay = tail_delay
+        self.failure_rate = failure_rate
+        self.prefill_tokens_per_second = prefill_tokens_per_second
+        self.prompt_chars = 0
+        self.prompt_tokens = 0
+        self.failures = 0
+        self._random = random.Random(seed)
+
+    def _tokens(self) -> List[str]:
+        return re.findall(r"\S+\s*", self.response)
+
+    def handle(self, handler: BaseHTTPRequestHandler):
+        if handler.command != "POST" or not urlparse(handler.path).path.endswith("/chat/completions"):
+            self.send_json(handler, 404, {"error": "Not Found"})
+            return
+        body = json.loads(handler.rfile.read(int(handler.headers.get("Content-Length", 0))) or b"{}")
+        prompt = "\n".join(str(message.get("content", "")) for message in body.get("messages", []))
+        prompt_tokens = len(re.findall(r"\w+|[^\w\s]", prompt))
+        with self._lock:
+            self.prompt_chars += len(prompt)
+            self.prompt_tokens += prompt_tokens
+            fail = self._random.random() < self.failure_rate
+            slow = self._random.random() < self.tail_fraction
+            self.failures += fail
+
+        tokens = self._tokens()
+        token_delay = 1.0 / self.tokens_per_second if self.tokens_per_second > 0 else 0.0
+        if fail:
+            self.send_json(handler, 503, {"error": "Service Unavailable"})
+            return
+        prefill = prompt_tokens / self.prefill_tokens_per_second if self.prefill_tokens_per_second > 0 else 0.0
+        time.sleep(self.first_token_delay + prefill + (self.tail_delay if slow else 0.0))
+        if not body.get("stream"):
+            time.sleep(token_delay * len(tokens))
+            self.send_json(handler, 200, self._completion(len(tokens)))
+            return
+
+        handler.send_response(200)
+        handler.send_header("Content-Type", "text/event-stream")
+        handler.send_header("Connection", "close")
+        handler.end_headers()
+        for i, token in enumerate(tokens):
+            if i:
+                time.sleep(token_delay)
+            self._send_event(handler, self._chunk({"role": "assistant", "content": token}, None))
+        self._send_event(handler, self._chunk({}, "stop"))
+        handler.wfile.write(b"data: [DONE]\n\n")
+        handler.wfile.flush()
+        handler.close_connection = True
+
+    @staticmethod
+    def _send_event(handler: BaseHTTPRequestHandler, payload: Dict):
+        handler.wfile.write(f"data: {json.dumps(payload)}\n\n".encode())
+        handler.wfile.flush()
+
+    @staticmethod
+    def _chunk(delta: Dict, finish_reason: Optional[str]) -> Dict:
+        return {
+            "id": "bench", "object": "chat.completion.chunk", "created": int(time.time()), "model": "bench",
+            "system_fingerprint": "bench",
+            "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason, "logprobs": None}]
+        }
+
+    def _completion(self, completion_tokens: int) -> Dict:
+        return {
+            "id": "bench", "object": "chat.completion", "created": int(time.time()), "model": "bench",
+            "system_fingerprint": "bench",
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": self.response},
+                "finish_reason": "stop",
+                "logprobs": None
+            }],
+            "usage": {"prompt_tokens": 0, "completion_tokens": completion_tokens, "total_tokens": completion_tokens}
+        }
+
+
+def build_tiny_models(directory: str, seed: int = 0) -> Tuple[str, str]:
+    """
+    Save randomly initialised classifiers with the real input shapes and
+    class counts, so the image endpoints run end to end without the trained
+    weights. Predictions are meaningless; the forward pass is a few
+    milliseconds, so timings show serving overhead rather than model cost.
+
+    Returns: (disease model path, pest model path)
+    """
+    import keras
+    from src.disease_model import CLASS_DICT
+    from src.pest_model import CLASS_NAMES
+
+    keras.utils.set_random_seed(seed)
+    paths = []
+    for name, size, classes, extension in (
+        ("disease", 256, len(CLASS_DICT), "h5"),
+        ("pest", 224, len(CLASS_NAMES), "keras")
+    ):
+        model = keras.Sequential([
+            keras.Input((size, size, 3)),
+            keras.layers.Conv2D(8, 3, strides=4, activation="relu"),
+            keras.layers.GlobalAveragePooling2D(),
+            keras.layers.Dense(classes, activation="softmax")
+        ], name=f"tiny_{name}")
+        path = os.path.join(directory, f"tiny_{name}_classifier.{extension}")
+        model.save(path)
+        paths.append(path)
+    return paths[0], paths[1]
@@ -0,0 +1,96 @@
+"""
+/health/ latency while slow /chatbot/ calls are in flight.
+
+The real chatbot is replaced by a stand-in whose `ask` blocks for a fixed
+time, like a remote LLM call. The benchmark runs twice: once with the
+blocking call made directly on the event loop (the old behaviour), and once
+through the executor layer.
+
+Usage (from the repository root):
+    python Backend/benchmarks/health_latency.py --chat-calls 8 --chat-latency 2.0
+"""
+import argparse
+import asyncio
+import time
+
+import common
+import httpx
+
+import main
+
+
+class SlowChatbot:
+    """Chatbot stand-in whose answers take a fixed amount of wall time"""
+
+    def __init__(self, latency_s: float):
+        self.latency_s = latency_s
+
+    def ask(self, query: str) -> str:
+        time.sleep(self.latency_s)
+        return f"<p>Answer to: {query}</p>"
+
+
+async def _blocking_run_io(endpoint, func, *args, **kwargs):
+    """Call the function directly on the event loop, as the handlers used to"""
+    return func(*args, **kwargs)
+
+
+async def measure(args, offload: bool):
+    main.chatbot = SlowChatbot(args.chat_latency)
+    original_run_io = main.executors.run_io
+    if not offload:
+        main.executors.run_io = _blocking_run_io
+
+    latencies = []
+    transport = httpx.ASGITransport(app=main.app)
+    try:
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+            chats_done = asyncio.Event()
+
+            async def probe_once(scheduled: float):
+                await client.get("/health/")
+                latencies.append(time.perf_counter() - scheduled)
+
+            async def probe():
+                # Open-loop probes: latency counts from the scheduled send time,
+                # so time spent waiting on a blocked event loop is included.
+                probes = []
+                scheduled = time.perf_counter()
+                while not chats_done.is_set():
+                    probes.append(asyncio.create_task(probe_once(scheduled)))
+                    scheduled += args.interval
+                    await asyncio.sleep(max(0.0, scheduled - time.perf_counter()))
+                await asyncio.gather(*probes)
+
+            probe_task = asyncio.create_task(probe())
+            chat_tasks = []
+            for i in range(args.chat_calls):
+                chat_tasks.append(asyncio.create_task(client.post("/chatbot/", json={"query": f"question {i}"})))
+                # Spread arrivals so probes land while chat calls are running
+                await asyncio.sleep(args.stagger)
+            await asyncio.gather(*chat_tasks)
+            chats_done.set()
+            await probe_task
+    finally:
+        main.executors.run_io = original_run_io
+
+    return common.summarize(latencies)
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chat-calls", type=int, default=8, help="Concurrent /chatbot/ requests")
+    parser.add_argument("--chat-latency", type=float, default=2.0, help="Seconds each chatbot call blocks")
+    parser.add_argument("--stagger", type=float, default=0.1, help="Seconds between starting chatbot calls")
+    parser.add_argument("--interval", type=float, default=0.01, help="Seconds between /health/ probes")
+    args = parser.parse_args()
+
+    results = {
+        "blocking_handlers": asyncio.run(measure(args, offload=False)),
+        "executor_offload": asyncio.run(measure(args, offload=True))
+    }
+    common.print_table(results)
+
+
+if __name__ == "__main__":
+    main_cli()
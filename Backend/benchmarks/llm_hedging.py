@@ -0,0 +1,144 @@
+"""
+Tail latency of LLM calls through src.llm_client, with and without hedging.
+
+ChatHuggingFace talks to FakeHFEndpoint, which makes a fraction of requests
+slow (--tail-fraction, --tail-delay) and fails others with a 503
+(--failure-rate). Closed-loop clients send distinct prompts:
+
+- direct: the chat model alone (failures reach the caller)
+- client: LLMClient with retries, no hedging
+- hedged: LLMClient hedging after the --hedge-percentile latency
+
+With --stream, the latency is the time to the first chunk and hedges are
+placed on it. A final run sends identical prompts concurrently to show
+how many upstream calls coalescing saves.
+
+Usage (from the repository root):
+    python Backend/benchmarks/llm_hedging.py
+    python Backend/benchmarks/llm_hedging.py --stream --requests 400 --tail-fraction 0.1 --hedge-percentile 90
+"""
+import argparse
+import asyncio
+import json
+import time
+from typing import Dict
+
+import common
+import fakes
+from langchain_huggingface import ChatHuggingFace, HuggingFaceEndpoint
+
+from src.llm_client import LLMClient
+
+
+def _chat_model(url: str) -> ChatHuggingFace:
+    llm = HuggingFaceEndpoint(endpoint_url=url, task="text-generation", max_new_tokens=512, huggingfacehub_api_token="bench")
+    return ChatHuggingFace(llm=llm)
+
+
+async def _call(model, prompt: str, stream: bool) -> float:
+    """Seconds until the answer (or its first chunk) arrived"""
+    start = time.perf_counter()
+    if not stream:
+        await model.ainvoke(prompt)
+        return time.perf_counter() - start
+    latency = None
+    async for _ in model.astream(prompt):
+        if latency is None:
+            latency = time.perf_counter() - start
+    return latency
+
+
+async def drive(model, requests: int, concurrency: int, warmup: int, stream: bool, prefix: str) -> Dict:
+    """`concurrency` closed-loop clients sending `requests` distinct prompts"""
+    for i in range(warmup):
+        try:
+            await _call(model, f"{prefix} warmup {i}", stream)
+        except Exception:
+            pass
+
+    latencies, errors = [], 0
+    next_index = 0
+
+    async def worker():
+        nonlocal next_index, errors
+        while next_index < requests:
+            i = next_index
+            next_index += 1
+            try:
+                latencies.append(await _call(model, f"{prefix} question {i}", stream))
+            except Exception:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    return {"errors": errors, "throughput_rps": round(requests / elapsed, 2), **common.summarize(latencies)}
+
+
+async def coalescing(client: LLMClient, callers: int, stream: bool) -> Dict:
+    """Identical prompts sent at once; returns upstream attempts used"""
+    before = client.events["call"] - client.events["coalesced"]
+    await asyncio.gather(*(_call(client, "When should I sow wheat in Pune?", stream) for _ in range(callers)))
+    return {"callers": callers, "upstream_calls": client.events["call"] - client.events["coalesced"] - before}
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--modes", default="direct,client,hedged", help="Modes to compare")
+    parser.add_argument("--requests", type=int, default=300, help="Measured calls per mode")
+    parser.add_argument("--concurrency", type=int, default=8, help="Concurrent callers")
+    parser.add_argument("--warmup", type=int, default=30, help="Unmeasured calls per mode (fills the latency window)")
+    parser.add_argument("--stream", action="store_true", help="Measure time to first chunk of streamed answers")
+    parser.add_argument("--max-concurrency", type=int, default=16, help="LLMClient concurrency cap")
+    parser.add_argument("--hedge-percentile", type=float, default=95.0)
+    parser.add_argument("--retries", type=int, default=2)
+    parser.add_argument("--timeout", type=float, default=30.0, help="LLMClient per-call deadline in seconds")
+    parser.add_argument("--first-token-delay", type=float, default=0.1, help="Seconds before the fake LLM answers")
+    parser.add_argument("--tokens-per-second", type=float, default=400.0, help="Fake LLM token rate")
+    parser.add_argument("--tail-fraction", type=float, default=0.05, help="Share of slow upstream responses")
+    parser.add_argument("--tail-delay", type=float, default=2.0, help="Extra seconds of a slow response")
+    parser.add_argument("--failure-rate", type=float, default=0.02, help="Share of upstream 503s")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--report", help="Also write the results as JSON to this file")
+    args = parser.parse_args()
+
+    endpoint = fakes.FakeHFEndpoint(
+        first_token_delay=args.first_token_delay, tokens_per_second=args.tokens_per_second,
+        tail_fraction=args.tail_fraction, tail_delay=args.tail_delay, failure_rate=args.failure_rate, seed=args.seed
+    ).start()
+    results = {}
+    try:
+        for mode in args.modes.split(","):
+            model = _chat_model(endpoint.url)
+            client = None
+            if mode != "direct":
+                model = client = LLMClient(
+                    model, max_concurrency=args.max_concurrency, timeout=args.timeout, retries=args.retries,
+                    backoff_base=0.05, hedge_percentile=args.hedge_percentile if mode == "hedged" else None
+                )
+            calls = endpoint.calls
+            results[mode] = asyncio.run(drive(model, args.requests, args.concurrency, args.warmup, args.stream, mode))
+            results[mode]["upstream_calls"] = endpoint.calls - calls
+            if client is not None:
+                events = client.events
+                results[mode].update({key: events[key] for key in ("retry", "hedge", "hedge_win", "failure")})
+                if mode == "hedged":
+                    delay = client.stats()["hedge_delay_ms"]["stream" if args.stream else "invoke"]
+                    results[mode]["hedge_delay_ms"] = delay
+                client.close()
+            common.print_table({mode: results[mode]})
+
+        client = LLMClient(_chat_model(endpoint.url), max_concurrency=args.max_concurrency, timeout=args.timeout)
+        results["coalescing"] = asyncio.run(coalescing(client, args.concurrency * 4, args.stream))
+        client.close()
+        common.print_table({"coalescing": results["coalescing"]})
+    finally:
+        endpoint.stop()
+
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump({"args": vars(args), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,374 @@
+"""
+Load test of every HTTP endpoint of the API with concurrent clients.
+
+The app is served by uvicorn on a local port with startup enabled, so models
+load through the normal slots. External services are replaced by local
+stand-ins from fakes.py:
+
+- weatherapi.com by FakeWeatherServer (WEATHER_API_URL)
+- the Hugging Face endpoint by FakeHFEndpoint (HUGGINGFACE_ENDPOINT_URL),
+  with configurable time to first token and token rate
+- the trained classifiers by tiny randomly initialised Keras models with
+  the same input shapes (DISEASE_MODEL_PATH / PEST_MODEL_PATH)
+- MiniLM by deterministic hash embeddings
+
+Everything runs offline on CPU. Each endpoint is driven by --concurrency
+closed-loop clients, one endpoint at a time, and reports throughput and
+p50/p95/p99 latency (plus time to first token for streaming). Uploads are
+distinct images and the semantic answer cache is off, so the inference and
+chat paths are measured rather than the caches. Results are written as JSON
+and can be compared with an earlier run.
+
+The GET aliases of the chat endpoints and the WebSocket share handlers with
+the endpoints measured here and are not run separately.
+
+Usage (from the repository root):
+    python Backend/benchmarks/load_test.py
+    python Backend/benchmarks/load_test.py --endpoints disease,crop_health,chatbot --requests 500 --concurrency 32
+    python Backend/benchmarks/load_test.py --compare Backend/benchmarks/results/load_test-abc1234.json --max-regression 0.2
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import platform
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+import common
+import fakes
+import httpx
+import numpy as np
+import uvicorn
+from PIL import Image
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+CHAT_ERROR_MARKER = "Sorry, I encountered an error"
+IMAGE_SIZE = (640, 480)
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, cwd=common.BACKEND_DIR, check=True
+        ).stdout.strip()
+        dirty = subprocess.run(
+            ["git", "status", "--porcelain", "--untracked-files=no"], capture_output=True, text=True, cwd=common.BACKEND_DIR
+        ).stdout.strip()
+        return f"{commit}-dirty" if dirty else commit
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class ImageFactory:
+    """Distinct JPEG uploads, so the prediction cache never short-circuits the model"""
+
+    def __init__(self, seed: int = 0):
+        rng = np.random.default_rng(seed)
+        width, height = IMAGE_SIZE
+        x = np.linspace(0, 1, width, dtype=np.float32)[np.newaxis, :]
+        y = np.linspace(0, 1, height, dtype=np.float32)[:, np.newaxis]
+        channels = [np.sin((x * rng.uniform(2, 6) + y * rng.uniform(2, 6)) * np.pi) * 70 + 120 for _ in range(3)]
+        self.base = np.clip(np.stack(channels, axis=-1), 0, 255).astype(np.uint8)
+
+    def make(self, index: int) -> bytes:
+        pixels = self.base.copy()
+        # A unique stamp per index changes the bytes (and the content hash)
+        stamp = np.random.default_rng(index).integers(0, 256, (16, 16, 3), dtype=np.uint8)
+        pixels[:16, :16] = stamp
+        buffer = io.BytesIO()
+        Image.fromarray(pixels).save(buffer, format="JPEG", quality=85)
+        return buffer.getvalue()
+
+
+def _upload(images: ImageFactory, offset: int) -> Callable[[int], Dict]:
+    return lambda i: {"files": {"file": (f"leaf_{i}.jpg", images.make(offset + i), "image/jpeg")}}
+
+
+def _batch_upload(images: ImageFactory, offset: int, files: int) -> Callable[[int], Dict]:
+    return lambda i: {"files": [
+        ("files", (f"leaf_{i}_{j}.jpg", images.make(offset + i * files + j), "image/jpeg"))
+        for j in range(files)
+    ]}
+
+
+def build_scenarios(args) -> Dict[str, Dict]:
+    """
+    Endpoint name -> method, path, request factory and request count
+
+    Request factories get the request index, so every request of a run is
+    reproducible and uploads/queries differ between requests.
+    """
+    images = ImageFactory(args.seed)
+    chat = {"requests": args.chat_requests}
+    return {
+        "root": {"method": "GET", "path": lambda i: "/"},
+        "health": {"method": "GET", "path": lambda i: "/health/"},
+        "models_info": {"method": "GET", "path": lambda i: "/models/info/"},
+        "metrics": {"method": "GET", "path": lambda i: "/metrics"},
+        "chatbot_stats": {"method": "GET", "path": lambda i: "/chatbot/stats/"},
+        "disease": {"method": "POST", "path": lambda i: "/disease-prediction/", "request": _upload(images, 0)},
+        "disease_tta": {
+            "method": "POST", "path": lambda i: f"/disease-prediction/?tta={args.tta_views}",
+            "request": _upload(images, 5 * 10 ** 6)
+        },
+        "pest": {"method": "POST", "path": lambda i: "/pest-prediction/", "request": _upload(images, 10 ** 6)},
+        "disease_batch": {
+            "method": "POST", "path": lambda i: "/disease-prediction/batch/",
+            "request": _batch_upload(images, 2 * 10 ** 6, args.batch_files)
+        },
+        "pest_batch": {
+            "method": "POST", "path": lambda i: "/pest-prediction/batch/",
+            "request": _batch_upload(images, 3 * 10 ** 6, args.batch_files)
+        },
+        "crop_health": {"method": "POST", "path": lambda i: "/crop-health/", "request": _upload(images, 4 * 10 ** 6)},
+        "chatbot": {
+            "method": "POST", "path": lambda i: "/chatbot/",
+            "request": lambda i: {"json": {"query": f"How do I protect my wheat from rust? ({i})", "session_id": f"bench-{i % 32}"}},
+            **chat
+        },
+        "chatbot_stream": {
+            "method": "POST", "path": lambda i: "/chatbot/stream/", "stream": True,
+            "request": lambda i: {"json": {"query": f"When should I irrigate cotton? ({i})", "session_id": f"bench-stream-{i % 32}"}},
+            **chat
+        },
+        "weather": {"method": "GET", "path": lambda i: f"/weather/?session_id=bench-{i % 32}"},
+        "weather_location": {"method": "GET", "path": lambda i: f"/weather/Village {i % args.locations}"},
+        "set_location": {
+            "method": "PUT", "path": lambda i: "/set-location/",
+            "request": lambda i: {"json": {"location": f"Village {i % args.locations}", "session_id": f"bench-location-{i}"}}
+        },
+        "clear_memory": {"method": "POST", "path": lambda i: f"/clear-memory/?session_id=bench-{i % 32}"}
+    }
+
+
+async def _send(client: httpx.AsyncClient, scenario: Dict, i: int) -> Dict:
+    """One request; returns latency, time to first token (streams) and whether it failed"""
+    kwargs = scenario.get("request", lambda i: {})(i)
+    start = time.perf_counter()
+    if not scenario.get("stream"):
+        response = await client.request(scenario["method"], scenario["path"](i), **kwargs)
+        failed = response.status_code >= 400 or CHAT_ERROR_MARKER in response.text
+        return {"latency": time.perf_counter() - start, "failed": failed}
+
+    first_token = None
+    failed = False
+    async with client.stream(scenario["method"], scenario["path"](i), **kwargs) as response:
+        failed = response.status_code >= 400
+        async for line in response.aiter_lines():
+            if line.startswith("event: token") and first_token is None:
+                first_token = time.perf_counter() - start
+            elif line.startswith("event: error"):
+                failed = True
+    return {"latency": time.perf_counter() - start, "first_token": first_token, "failed": failed or first_token is None}
+
+
+async def run_scenario(base_url: str, scenario: Dict, requests: int, concurrency: int, warmup: int) -> Dict:
+    """Drive one endpoint with `concurrency` closed-loop clients until `requests` complete"""
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, timeout=None, limits=limits) as client:
+        for i in range(warmup):
+            await _send(client, scenario, requests + i)
+
+        results: List[Dict] = []
+        next_index = 0
+
+        async def worker():
+            nonlocal next_index
+            while next_index < requests:
+                i = next_index
+                next_index += 1
+                results.append(await _send(client, scenario, i))
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(min(concurrency, requests))))
+        elapsed = time.perf_counter() - start
+
+    summary = {
+        "requests": requests,
+        "errors": sum(result["failed"] for result in results),
+        "throughput_rps": round(requests / elapsed, 2),
+        **common.summarize([result["latency"] for result in results])
+    }
+    first_tokens = [result["first_token"] for result in results if result.get("first_token") is not None]
+    if scenario.get("stream"):
+        summary["first_token"] = common.summarize(first_tokens)
+    return summary
+
+
+def _serve(app, port: int):
+    """Run the app with startup/shutdown events in a background thread"""
+    config = uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning", lifespan="on")
+    server = uvicorn.Server(config)
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        if not thread.is_alive():
+            raise RuntimeError("API server failed to start")
+        time.sleep(0.01)
+    return server, thread
+
+
+def _wait_ready(base_url: str, timeout: float):
+    deadline = time.monotonic() + timeout
+    with httpx.Client(base_url=base_url) as client:
+        while time.monotonic() < deadline:
+            health = client.get("/health/").json()
+            if health["ready"]:
+                return health
+            failed = [name for name, status in health["models"].items() if status.get("error")]
+            if failed:
+                raise RuntimeError(f"Models failed to load: {failed} ({health['models']})")
+            time.sleep(0.1)
+    raise TimeoutError(f"Models not ready after {timeout}s")
+
+
+def launch(args):
+    """
+    Serve the app on a free local port with every external service faked
+
+    Args: args: Parsed arguments with seed, weather_latency, first_token_delay and tokens_per_second
+    Returns: (the imported main module, base URL, function stopping everything, (weather, llm) fakes)
+    """
+    models_dir = tempfile.mkdtemp(prefix="krishimitra-bench-")
+    disease_path, pest_path = fakes.build_tiny_models(models_dir, seed=args.seed)
+    weather = fakes.FakeWeatherServer(latency=args.weather_latency).start()
+    llm = fakes.FakeHFEndpoint(first_token_delay=args.first_token_delay, tokens_per_second=args.tokens_per_second).start()
+
+    # Configured before main is imported, since it reads them at import time
+    os.environ.update({
+        "WEATHER_API_URL": weather.url,
+        "WEATHER_API_KEY": "bench",
+        "HUGGINGFACE_ENDPOINT_URL": llm.url,
+        "HUGGINGFACE_API_TOKEN": "bench",
+        "DISEASE_MODEL_PATH": disease_path,
+        "PEST_MODEL_PATH": pest_path,
+        "MODEL_REGISTRY_PATH": "",
+        "CHAT_MEMORY_INDEX_DIR": "",
+        "ANSWER_CACHE_ENABLED": "false",
+        "LAZY_MODELS": ""
+    })
+    import main
+    from src.chatbot import KrishiMitra
+    main.chatbot_slot.loader = lambda: KrishiMitra(embeddings=fakes.fake_embeddings())
+
+    port = _free_port()
+    server, thread = _serve(main.app, port)
+
+    def stop():
+        server.should_exit = True
+        thread.join(timeout=30)
+        weather.stop()
+        llm.stop()
+        shutil.rmtree(models_dir, ignore_errors=True)
+
+    return main, f"http://127.0.0.1:{port}", stop, (weather, llm)
+
+
+def compare(results: Dict, baseline_path: str, max_regression: float) -> List[str]:
+    """
+    Print p95 and throughput changes against an earlier run
+
+    Returns: Endpoints whose p95 grew, or throughput fell, by more than max_regression
+    """
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    print(f"\nCompared with {baseline_path} (commit {baseline['meta'].get('commit')})")
+    regressions = []
+    for name, current in results["endpoints"].items():
+        previous = baseline["endpoints"].get(name)
+        if previous is None:
+            continue
+        p95_change = current["p95_ms"] / previous["p95_ms"] - 1 if previous["p95_ms"] else 0.0
+        rps_change = current["throughput_rps"] / previous["throughput_rps"] - 1 if previous["throughput_rps"] else 0.0
+        flag = ""
+        if p95_change > max_regression or rps_change < -max_regression:
+            regressions.append(name)
+            flag = "  REGRESSION"
+        print(f"{name:<24} p95 {p95_change:+.1%}  throughput {rps_change:+.1%}{flag}")
+    return regressions
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--endpoints", help="Comma-separated subset of endpoints (default: all)")
+    parser.add_argument("--requests", type=int, default=200, help="Measured requests per endpoint")
+    parser.add_argument("--chat-requests", type=int, default=48, help="Measured requests per chat endpoint")
+    parser.add_argument("--concurrency", type=int, default=16, help="Concurrent clients")
+    parser.add_argument("--warmup", type=int, default=3, help="Unmeasured requests per endpoint")
+    parser.add_argument("--batch-files", type=int, default=4, help="Images per batch upload")
+    parser.add_argument("--tta-views", type=int, default=8, help="Views requested by the disease_tta endpoint")
+    parser.add_argument("--locations", type=int, default=20, help="Distinct locations for weather requests")
+    parser.add_argument("--weather-latency", type=float, default=0.05, help="Seconds per fake weatherapi.com response")
+    parser.add_argument("--first-token-delay", type=float, default=0.3, help="Seconds before the fake LLM's first token")
+    parser.add_argument("--tokens-per-second", type=float, default=100.0, help="Fake LLM token rate")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Results JSON (default: Backend/benchmarks/results/load_test-<commit>.json)")
+    parser.add_argument("--compare", help="Earlier results JSON to compare against")
+    parser.add_argument("--max-regression", type=float, default=0.2, help="Allowed relative p95/throughput change")
+    args = parser.parse_args()
+
+    scenarios = build_scenarios(args)
+    names = args.endpoints.split(",") if args.endpoints else list(scenarios)
+    unknown = [name for name in names if name not in scenarios]
+    if unknown:
+        parser.error(f"Unknown endpoints: {', '.join(unknown)}. Expected some of {', '.join(scenarios)}")
+
+    _, base_url, stop, (weather, llm) = launch(args)
+    try:
+        startup_start = time.perf_counter()
+        _wait_ready(base_url, timeout=300)
+        startup_s = time.perf_counter() - startup_start
+
+        endpoints = {}
+        for name in names:
+            scenario = scenarios[name]
+            requests = scenario.get("requests", args.requests)
+            endpoints[name] = asyncio.run(run_scenario(base_url, scenario, requests, args.concurrency, args.warmup))
+            common.print_table({name: {key: value for key, value in endpoints[name].items() if key != "first_token"}})
+            if "first_token" in endpoints[name]:
+                common.print_table({f"{name}:first_token": endpoints[name]["first_token"]})
+    finally:
+        stop()
+
+    results = {
+        "meta": {
+            "commit": _git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "startup_s": round(startup_s, 3),
+            "upstream_calls": {"weather": weather.calls, "llm": llm.calls},
+            "args": vars(args)
+        },
+        "endpoints": endpoints
+    }
+
+    output = args.output or os.path.join(RESULTS_DIR, f"load_test-{results['meta']['commit'] or 'unknown'}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"\nResults written to {output}")
+
+    if args.compare:
+        regressions = compare(results, args.compare, args.max_regression)
+        if regressions:
+            raise SystemExit(f"Regressions beyond {args.max_regression:.0%}: {', '.join(regressions)}")
+
+
+if __name__ == "__main__":
+    main_cli()
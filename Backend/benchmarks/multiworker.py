@@ -0,0 +1,203 @@
+"""
+Memory and throughput of N uvicorn workers that each load the models,
+against N workers sharing one model server (Backend/model_server.py).
+
+Each mode runs the real app under `uvicorn --workers N` in a subprocess,
+with tiny randomly initialised classifiers (see fakes.build_tiny_models)
+standing in for the trained ones; the chatbot stays lazy, since MiniLM and
+the LLM need the network. Memory is summed over the uvicorn processes and,
+in shared mode, the model server:
+
+- rss_mb: resident memory; pages of the shared-memory rings are counted
+  once per process that touched them
+- pss_mb: proportional set size, which splits shared pages between the
+  processes using them, so it is the fair total
+
+Throughput comes from closed-loop clients on the image endpoints, as in
+load_test.py.
+
+Usage (from the repository root):
+    python Backend/benchmarks/multiworker.py
+    python Backend/benchmarks/multiworker.py --workers 4 --endpoint pest --requests 400 --concurrency 32
+"""
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List
+
+import common
+import fakes
+import httpx
+
+from load_test import ImageFactory, _free_port, _upload, run_scenario
+
+REPO_ROOT = os.path.dirname(common.BACKEND_DIR)
+ENDPOINTS = {
+    "disease": ("/disease-prediction/", 0),
+    "pest": ("/pest-prediction/", 10 ** 6)
+}
+
+
+def _children(pid: int) -> List[int]:
+    """All descendants of a process"""
+    parents = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                # The command name may contain spaces; the parent pid follows it
+                parents[int(entry)] = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+    found, frontier = [], [pid]
+    while frontier:
+        parent = frontier.pop()
+        for child, ppid in parents.items():
+            if ppid == parent:
+                found.append(child)
+                frontier.append(child)
+    return found
+
+
+def _memory(pid: int) -> Dict:
+    """Resident and proportional set size of a process in MB"""
+    def field(path: str, name: str) -> float:
+        try:
+            with open(path) as f:
+                for line in f:
+                    if line.startswith(name + ":"):
+                        return int(line.split()[1]) / 1024
+        except OSError:
+            pass
+        return 0.0
+    return {"rss_mb": field(f"/proc/{pid}/status", "VmRSS"), "pss_mb": field(f"/proc/{pid}/smaps_rollup", "Pss")}
+
+
+def _wait_ready(base_url: str, workers: int, timeout: float):
+    """Wait until every worker reports ready; each check uses a new connection, so it may land on any worker"""
+    deadline = time.monotonic() + timeout
+    streak = 0
+    while time.monotonic() < deadline:
+        try:
+            ready = httpx.get(f"{base_url}/health/").json()["ready"]
+        except httpx.HTTPError:
+            ready = False
+        streak = streak + 1 if ready else 0
+        if streak >= 4 * workers:
+            return
+        time.sleep(0.05 if ready else 0.5)
+    raise TimeoutError(f"Workers not ready after {timeout}s")
+
+
+def run_mode(mode: str, args, env: Dict[str, str], workdir: str) -> Dict:
+    """
+    Start the app in `mode` ("independent" or "shared"), load it and measure memory
+
+    Returns: Throughput and latency per endpoint, and memory per process group
+    """
+    processes = []
+    env = dict(env)
+    try:
+        if mode == "shared":
+            socket_path = os.path.join(workdir, "models.sock")
+            server = subprocess.Popen(
+                [sys.executable, "Backend/model_server.py", "--socket", socket_path,
+                 "--inference-workers", str(args.inference_workers), "--no-embeddings"],
+                cwd=REPO_ROOT, env=env
+            )
+            processes.append(server)
+            env["MODEL_SERVER_SOCKET"] = socket_path
+        port = _free_port()
+        api = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "main:app", "--app-dir", "Backend", "--host", "127.0.0.1",
+             "--port", str(port), "--workers", str(args.workers), "--log-level", "warning"],
+            cwd=REPO_ROOT, env=env
+        )
+        processes.append(api)
+        base_url = f"http://127.0.0.1:{port}"
+        startup_start = time.perf_counter()
+        _wait_ready(base_url, args.workers, timeout=600)
+        startup_s = time.perf_counter() - startup_start
+
+        images = ImageFactory(args.seed)
+        endpoints = {}
+        for name in (list(ENDPOINTS) if args.endpoint == "both" else [args.endpoint]):
+            path, offset = ENDPOINTS[name]
+            scenario = {"method": "POST", "path": lambda i, path=path: path, "request": _upload(images, offset)}
+            endpoints[name] = asyncio.run(run_scenario(base_url, scenario, args.requests, args.concurrency, args.warmup))
+
+        groups = {"api": [api.pid] + _children(api.pid)}
+        if mode == "shared":
+            groups["model_server"] = [server.pid] + _children(server.pid)
+        memory = {}
+        for group, pids in groups.items():
+            usage = [_memory(pid) for pid in pids]
+            memory[group] = {
+                "processes": len(pids),
+                "rss_mb": round(sum(item["rss_mb"] for item in usage), 1),
+                "pss_mb": round(sum(item["pss_mb"] for item in usage), 1)
+            }
+        memory["total"] = {
+            key: round(sum(group[key] for group in memory.values()), 1)
+            for key in ("processes", "rss_mb", "pss_mb")
+        }
+        return {"startup_s": round(startup_s, 2), "memory": memory, "endpoints": endpoints}
+    finally:
+        for process in reversed(processes):
+            process.terminate()
+            try:
+                process.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=4, help="uvicorn worker processes")
+    parser.add_argument("--modes", default="independent,shared", help="Modes to compare")
+    parser.add_argument("--endpoint", choices=[*ENDPOINTS, "both"], default="both")
+    parser.add_argument("--requests", type=int, default=200, help="Measured requests per endpoint")
+    parser.add_argument("--concurrency", type=int, default=16, help="Concurrent clients")
+    parser.add_argument("--warmup", type=int, default=8, help="Unmeasured requests per endpoint")
+    parser.add_argument("--inference-workers", type=int, default=1, help="Forward passes run at once by the model server")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--report", help="Also write the results as JSON to this file")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="krishimitra-multiworker-")
+    disease_path, pest_path = fakes.build_tiny_models(workdir, seed=args.seed)
+    env = {
+        **os.environ,
+        "DISEASE_MODEL_PATH": disease_path,
+        "PEST_MODEL_PATH": pest_path,
+        "MODEL_REGISTRY_PATH": "",
+        "LAZY_MODELS": "chatbot",
+        "METRICS_ENABLED": "false"
+    }
+    results = {}
+    try:
+        for mode in args.modes.split(","):
+            results[mode] = run_mode(mode, args, env, workdir)
+            print(f"\n{mode} ({args.workers} workers, ready in {results[mode]['startup_s']}s)")
+            common.print_table({f"memory:{group}": usage for group, usage in results[mode]["memory"].items()})
+            common.print_table({
+                name: {key: stats[key] for key in ("errors", "throughput_rps", "p50_ms", "p99_ms")}
+                for name, stats in results[mode]["endpoints"].items()
+            })
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump({"workers": args.workers, "args": vars(args), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main_cli()
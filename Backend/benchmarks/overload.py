@@ -0,0 +1,185 @@
+"""
+Goodput of an inference endpoint under overload, with admission control
+on and off.
+
+The app runs with the same offline stand-ins as load_test.py. First the
+endpoint's capacity is measured with closed-loop clients. Then open-loop
+(Poisson) traffic is offered at multiples of that capacity, each request
+carrying a client deadline (X-Request-Timeout-Ms, and the client gives up
+at the same time). Goodput counts responses that succeed within their
+deadline. Meanwhile /health/ and /weather/ are probed to show that the
+priority lane stays responsive.
+
+With admission control, goodput should stay close to capacity as the load
+grows, with the excess shed as fast 503s; without it, requests queue until
+most of them miss their deadline.
+
+Usage (from the repository root):
+    python Backend/benchmarks/overload.py
+    python Backend/benchmarks/overload.py --endpoint pest --loads 1,2,4,8 --duration 20 --deadline 2
+"""
+import argparse
+import asyncio
+import json
+import math
+import threading
+import time
+from typing import Dict, List
+
+import common
+import httpx
+import numpy as np
+
+from load_test import ImageFactory, _upload, _wait_ready, launch, run_scenario
+
+ENDPOINTS = {
+    "disease": ("/disease-prediction/", 0),
+    "pest": ("/pest-prediction/", 10 ** 6),
+    "crop_health": ("/crop-health/", 2 * 10 ** 6)
+}
+
+
+def _probe(base_url: str, path: str, interval: float, stop: threading.Event, latencies: List[float]):
+    """Poll a cheap endpoint every `interval` seconds from its own thread, so
+    the load generator's backlog does not count towards its latency"""
+    with httpx.Client(base_url=base_url) as client:
+        while not stop.is_set():
+            start = time.perf_counter()
+            client.get(path)
+            latencies.append(time.perf_counter() - start)
+            stop.wait(interval)
+
+
+async def offer_load(base_url: str, path: str, uploads: List[bytes], rate: float, duration: float, deadline: float, seed: int) -> Dict:
+    """
+    Open-loop Poisson arrivals at `rate` requests/s for `duration` seconds
+
+    Args: uploads: Encoded images, prepared up front so encoding does not slow the load generator
+    Returns: Offered rate, goodput, shed and late shares, latency of good
+        responses, and /health/ and /weather/ latency during the run
+    """
+    rng = np.random.default_rng(seed)
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=256)
+    headers = {"X-Request-Timeout-Ms": str(int(deadline * 1000))}
+    outcomes: List[Dict] = []
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=None, limits=limits) as client:
+        async def one(i: int):
+            start = time.perf_counter()
+            try:
+                files = {"file": (f"leaf_{i}.jpg", uploads[i % len(uploads)], "image/jpeg")}
+                response = await asyncio.wait_for(client.post(path, headers=headers, files=files), deadline)
+                status = response.status_code
+                if status == 200 and not response.json().get("success", True):
+                    # e.g. dropped by the batch scheduler after its deadline passed
+                    status = "failed"
+            except asyncio.TimeoutError:
+                status = None
+            except httpx.TransportError:
+                # Refused or dropped connections: the server is too busy to even answer
+                status = "error"
+            outcomes.append({"status": status, "latency": time.perf_counter() - start})
+
+        stop = threading.Event()
+        health, weather = [], []
+        probes = [
+            threading.Thread(target=_probe, args=(base_url, "/health/", 0.1, stop, health)),
+            threading.Thread(target=_probe, args=(base_url, "/weather/Village 1", 0.1, stop, weather))
+        ]
+        for probe in probes:
+            probe.start()
+        tasks = []
+        start = time.perf_counter()
+        next_arrival = start
+        i = 0
+        while next_arrival - start < duration:
+            await asyncio.sleep(max(0.0, next_arrival - time.perf_counter()))
+            tasks.append(asyncio.create_task(one(i)))
+            i += 1
+            next_arrival += rng.exponential(1 / rate)
+        await asyncio.gather(*tasks)
+        stop.set()
+        for probe in probes:
+            probe.join()
+
+    good = [outcome["latency"] for outcome in outcomes if outcome["status"] == 200]
+    return {
+        "offered_rps": round(len(outcomes) / duration, 2),
+        "goodput_rps": round(len(good) / duration, 2),
+        "shed": round(sum(outcome["status"] == 503 for outcome in outcomes) / len(outcomes), 4),
+        "late": round(sum(outcome["status"] is None for outcome in outcomes) / len(outcomes), 4),
+        "failed": round(sum(outcome["status"] == "failed" for outcome in outcomes) / len(outcomes), 4),
+        "errors": round(sum(outcome["status"] == "error" for outcome in outcomes) / len(outcomes), 4),
+        "good_p50_ms": common.summarize(good)["p50_ms"] if good else None,
+        "good_p99_ms": common.summarize(good)["p99_ms"] if good else None,
+        "health_p99_ms": common.summarize(health)["p99_ms"],
+        "weather_p99_ms": common.summarize(weather)["p99_ms"]
+    }
+
+
+def _drain(main, timeout: float = 120):
+    """Wait until work left over from the previous run has finished"""
+    end = time.monotonic() + timeout
+    while time.monotonic() < end:
+        busy = sum(stats["in_flight"] for stats in main.executors.stats().values())
+        if not busy and all(scheduler.queue_depth == 0 for scheduler in (main.disease_scheduler, main.pest_scheduler)):
+            return
+        time.sleep(0.2)
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--endpoint", choices=list(ENDPOINTS), default="disease")
+    parser.add_argument("--loads", default="0.5,1,2,4", help="Offered load as multiples of the measured capacity")
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds of traffic per load level")
+    parser.add_argument("--deadline", type=float, default=1.0, help="Client deadline per request in seconds")
+    parser.add_argument("--modes", default="on,off", help="Admission control settings to compare")
+    parser.add_argument("--capacity-requests", type=int, default=200, help="Requests used to measure capacity")
+    parser.add_argument("--concurrency", type=int, default=32, help="Closed-loop clients when measuring capacity")
+    parser.add_argument("--weather-latency", type=float, default=0.05, help="Seconds per fake weatherapi.com response")
+    parser.add_argument("--first-token-delay", type=float, default=0.3, help="Seconds before the fake LLM's first token")
+    parser.add_argument("--tokens-per-second", type=float, default=100.0, help="Fake LLM token rate")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--report", help="Also write the results as JSON to this file")
+    args = parser.parse_args()
+
+    path, offset = ENDPOINTS[args.endpoint]
+    images = ImageFactory(args.seed)
+    main, base_url, stop, _ = launch(args)
+    try:
+        _wait_ready(base_url, timeout=300)
+        scenario = {"method": "POST", "path": lambda i: path, "request": _upload(images, offset)}
+        capacity = asyncio.run(run_scenario(base_url, scenario, args.capacity_requests, args.concurrency, warmup=3))
+        capacity_rps = capacity["throughput_rps"]
+        print(f"{args.endpoint} capacity: {capacity_rps} requests/s (closed loop, {args.concurrency} clients)")
+
+        results = {}
+        run = 0
+        for mode in args.modes.split(","):
+            main.admission.enabled = mode == "on"
+            for load in (float(value) for value in args.loads.split(",")):
+                run += 1
+                _drain(main)
+                rate = capacity_rps * load
+                uploads = [images.make(offset + run * 10 ** 5 + i) for i in range(math.ceil(rate * args.duration * 1.2))]
+                results[f"admission_{mode}@{load:g}x"] = asyncio.run(
+                    offer_load(base_url, path, uploads, rate, args.duration, args.deadline, args.seed + run)
+                )
+                common.print_table({f"admission_{mode}@{load:g}x": results[f"admission_{mode}@{load:g}x"]})
+        admission_stats = main.admission.stats()
+    finally:
+        stop()
+
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump({
+                "endpoint": args.endpoint,
+                "capacity_rps": capacity_rps,
+                "deadline_s": args.deadline,
+                "results": results,
+                "admission": admission_stats
+            }, f, indent=2)
+
+
+if __name__ == "__main__":
+    main_cli()
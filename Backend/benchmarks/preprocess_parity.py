@@ -0,0 +1,106 @@
+"""
+Top-1 parity of src.preprocessing against the original per-model pipelines,
+on a folder of real photos, with the real classifiers.
+
+Each image is preprocessed the original way (PIL for the disease model,
+cv2.imdecode for the pest model) and with src.preprocessing at every draft
+factor (0 = full-resolution decode). Both inputs go through the same model;
+the table reports the share of images with the same top-1 class, the mean
+absolute input difference, and how many images carry an EXIF rotation
+(which cv2.imdecode applied and the original disease pipeline did not).
+
+Raise PREPROCESS_DRAFT_FACTOR only if its top-1 agreement holds up on
+photos like the ones farmers upload (phone JPEGs, several megapixels).
+
+Usage (from the repository root):
+    python Backend/benchmarks/preprocess_parity.py --images path/to/photos
+    python Backend/benchmarks/preprocess_parity.py --images path/to/photos --model pest --draft-factors 0,2,4
+"""
+import argparse
+import io
+import json
+import os
+from typing import Dict, List
+
+import common
+import numpy as np
+from PIL import Image
+
+from preprocess_throughput import legacy_disease, legacy_pest
+from src.disease_model import DiseaseModel
+from src.pest_model import PestModel
+from src.preprocessing import preprocess
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg")
+
+
+def load_photos(directory: str, limit: int) -> List[bytes]:
+    paths = []
+    for root, _, files in os.walk(directory):
+        paths.extend(os.path.join(root, name) for name in sorted(files) if name.lower().endswith(IMAGE_EXTENSIONS))
+    photos = []
+    for path in paths[:limit]:
+        with open(path, "rb") as f:
+            photos.append(f.read())
+    return photos
+
+
+def top1(model, inputs: np.ndarray, batch_size: int) -> List[str]:
+    predicted = []
+    for i in range(0, len(inputs), batch_size):
+        for result in model.predict_batch(inputs[i:i + batch_size]):
+            predicted.append(result["predicted_class"] if "predicted_class" in result else result["predicted_pest"])
+    return predicted
+
+
+def compare(name: str, photos: List[bytes], draft_factors: List[float], batch_size: int) -> Dict:
+    model = DiseaseModel() if name == "disease" else PestModel()
+    model.cascade = None
+    legacy = legacy_disease if name == "disease" else legacy_pest
+    reference_inputs = np.concatenate([legacy(data) for data in photos])
+    reference = top1(model, reference_inputs, batch_size)
+
+    rows = {}
+    for draft_factor in draft_factors:
+        inputs = np.concatenate([preprocess(data, model.input_spec, draft_factor) for data in photos])
+        predicted = top1(model, inputs, batch_size)
+        rows[f"{name}@draft{draft_factor:g}"] = {
+            "top1_agreement": round(float(np.mean([a == b for a, b in zip(predicted, reference)])), 4),
+            "mean_abs_diff": round(float(np.mean(np.abs(inputs - reference_inputs))), 4)
+        }
+    return rows
+
+
+def exif_rotated(photos: List[bytes]) -> int:
+    return sum(Image.open(io.BytesIO(data)).getexif().get(0x0112, 1) != 1 for data in photos)
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", required=True, help="Folder of real JPEG photos (searched recursively)")
+    parser.add_argument("--model", choices=["disease", "pest", "both"], default="both")
+    parser.add_argument("--draft-factors", default="0,2", help="Comma-separated draft factors to compare")
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--limit", type=int, default=500, help="Maximum images used")
+    parser.add_argument("--report", help="Also write the results as JSON to this file")
+    args = parser.parse_args()
+
+    photos = load_photos(args.images, args.limit)
+    if not photos:
+        parser.error(f"No JPEG images in {args.images}")
+    draft_factors = [float(value) for value in args.draft_factors.split(",")]
+    names = ["disease", "pest"] if args.model == "both" else [args.model]
+
+    results = {}
+    for name in names:
+        results.update(compare(name, photos, draft_factors, args.batch_size))
+
+    print(f"{len(photos)} images, {exif_rotated(photos)} with an EXIF rotation")
+    common.print_table(results)
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump({"images": len(photos), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main_cli()
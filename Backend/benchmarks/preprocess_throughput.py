@@ -0,0 +1,114 @@
+"""
+Image preprocessing cost for large phone photos: the original per-model
+pipelines compared with src.preprocessing.
+
+Synthetic 12 MP and 20 MP JPEGs are preprocessed for the disease model,
+the pest model, and both models from one upload. The mean absolute
+difference from the original pipeline's output is reported as a sanity check
+(reduced-resolution decoding changes pixels slightly).
+
+Usage (from the repository root):
+    python Backend/benchmarks/preprocess_throughput.py --images 5
+"""
+import argparse
+import io
+import time
+
+import common
+import cv2
+import numpy as np
+from PIL import Image
+
+from src.preprocessing import DISEASE_INPUT, PEST_INPUT, preprocess, preprocess_multi
+
+PHOTO_SIZES = {"12MP": (4000, 3000), "20MP": (5472, 3648)}
+
+
+def make_photo(size, seed: int) -> bytes:
+    """Smooth gradients plus sensor-like noise, compressed like a phone camera JPEG"""
+    width, height = size
+    rng = np.random.default_rng(seed)
+    x = np.linspace(0, 1, width, dtype=np.float32)[np.newaxis, :]
+    y = np.linspace(0, 1, height, dtype=np.float32)[:, np.newaxis]
+    channels = [
+        np.sin((x * rng.uniform(2, 8) + y * rng.uniform(2, 8)) * np.pi) * 80 + 128
+        for _ in range(3)
+    ]
+    pixels = np.stack(channels, axis=-1) + rng.normal(0, 6, (height, width, 3))
+    buffer = io.BytesIO()
+    Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8)).save(buffer, format="JPEG", quality=90)
+    return buffer.getvalue()
+
+
+def legacy_disease(data: bytes) -> np.ndarray:
+    """The original DiseaseModel.preprocess_image"""
+    img = Image.open(io.BytesIO(data))
+    if img.mode != "RGB":
+        img = img.convert("RGB")
+    img = img.resize((256, 256))
+    img_array = np.array(img, dtype=np.float32)
+    img_array = img_array / 255.0
+    return np.expand_dims(img_array, axis=0)
+
+
+def legacy_pest(data: bytes) -> np.ndarray:
+    """The original PestModel.preprocess_image (MobileNet preprocess_input is x / 127.5 - 1)"""
+    img = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+    img_rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+    img_resized = cv2.resize(img_rgb, (224, 224))
+    img_array = np.expand_dims(img_resized, axis=0).astype(np.float32)
+    return img_array / 127.5 - 1.0
+
+
+def legacy_both(data: bytes):
+    return {"disease": legacy_disease(data), "pest": legacy_pest(data)}
+
+
+def new_both(data: bytes):
+    return preprocess_multi(data, (DISEASE_INPUT, PEST_INPUT))
+
+
+def _as_dict(name: str, output):
+    return output if isinstance(output, dict) else {name: output}
+
+
+def time_case(func, photos, name: str, reference=None):
+    latencies, diffs = [], []
+    for i, data in enumerate(photos):
+        start = time.perf_counter()
+        output = func(data)
+        latencies.append(time.perf_counter() - start)
+        if reference is not None:
+            expected = _as_dict(name, reference[i])
+            for key, value in _as_dict(name, output).items():
+                diffs.append(float(np.mean(np.abs(value - expected[key]))))
+    summary = common.summarize(latencies)
+    summary["images_per_s"] = round(len(photos) / sum(latencies), 2)
+    if diffs:
+        summary["mean_abs_diff"] = round(float(np.mean(diffs)), 4)
+    return summary
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", type=int, default=5, help="Photos per size")
+    args = parser.parse_args()
+
+    rows = {}
+    for label, size in PHOTO_SIZES.items():
+        photos = [make_photo(size, seed) for seed in range(args.images)]
+        cases = {
+            "disease": (legacy_disease, lambda data: preprocess(data, DISEASE_INPUT)),
+            "pest": (legacy_pest, lambda data: preprocess(data, PEST_INPUT)),
+            "both": (legacy_both, new_both)
+        }
+        for case, (legacy, new) in cases.items():
+            reference = [legacy(data) for data in photos]
+            rows[f"{label}_{case}_legacy"] = time_case(legacy, photos, case)
+            rows[f"{label}_{case}_new"] = time_case(new, photos, case, reference)
+
+    common.print_table(rows)
+
+
+if __name__ == "__main__":
+    main_cli()
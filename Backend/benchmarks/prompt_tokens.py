@@ -0,0 +1,179 @@
+"""
+Prompt size and chatbot latency of the compact prompt (src/prompt_builder.py)
+against the previous HTML prompt.
+
+KrishiMitra runs in-process against FakeWeatherServer and FakeHFEndpoint,
+with the answer cache off. Each round asks a fixed set of farming questions
+in one new session, so history grows the same way in both modes:
+
+- legacy: the HTML formatting instructions and the styled weather <div>
+- compact: the static system message and the key/value weather summary,
+  which also carries the forecast days
+
+Token counts are the per-section means recorded by the prompt builder, and
+the tokens the fake endpoint received per call. The fake endpoint spends
+1 / --prefill-tokens-per-second seconds per prompt token before answering,
+so latency follows prompt length as on a real server.
+
+Usage (from the repository root):
+    python Backend/benchmarks/prompt_tokens.py
+    python Backend/benchmarks/prompt_tokens.py --rounds 5 --prefill-tokens-per-second 1000 --forecast-days 7
+"""
+import argparse
+import json
+import logging
+import os
+import time
+from typing import Dict, Optional
+
+import common
+import fakes
+from langchain_core.prompt_values import StringPromptValue
+
+from src.memory import count_tokens
+from src.prompt_builder import PromptBuilder
+
+QUERIES = [
+    "When should I sow wheat?",
+    "How much water does my tomato crop need this week?",
+    "Is it a good time to spray pesticide on cotton?",
+    "What fertilizer should I use for rice at the tillering stage?",
+    "How do I protect my onion harvest from rain?",
+    "Which vegetables can I plant now?",
+    "My maize leaves are turning yellow. What should I do?",
+    "Should I irrigate my sugarcane field tomorrow?",
+    "How can I control aphids on mustard without chemicals?",
+    "When is the best time to harvest soybean?"
+]
+
+LEGACY_TEMPLATE = """
+You are Krishi Mitra, an advanced AI agricultural assistant specialized in helping farmers.
+
+Return responses in clean, structured HTML format with proper formatting:
+- Use <h3>, <h4> for headings
+- Use <p> for paragraphs
+- Use <ul>, <li> for lists
+- Use <strong> for emphasis
+- Use <br> for line breaks when needed
+
+Current Weather Information:
+{weather_context}
+
+Conversation History (use if relevant):
+{history}
+
+User Query: {query}
+
+Provide practical, actionable advice based on the weather conditions and farming best practices.
+Your response:
+"""
+
+
+class LegacyPromptBuilder(PromptBuilder):
+    """The single-string HTML prompt the chatbot used before the prompt builder"""
+
+    def __init__(self, stats=None):
+        super().__init__(stats=stats)
+        self.prefix_tokens = count_tokens(LEGACY_TEMPLATE.format(weather_context="", history="", query=""))
+
+    def weather_summary(self, weather: Optional[Dict]) -> str:
+        if not weather:
+            return "<p>Weather data not available.</p>"
+        return f"""
+<div style="background-color: #f0f8ff; padding: 10px; border-radius: 5px;">
+    <h4>🌤 Current Weather in {weather['location']}, {weather['region']}</h4>
+    <p><strong>Temperature:</strong> {weather['temperature']}°C (Feels like: {weather['feels_like']}°C)</p>
+    <p><strong>Conditions:</strong> {weather['conditions']}</p>
+    <p><strong>Humidity:</strong> {weather['humidity']}%</p>
+    <p><strong>Wind:</strong> {weather['wind_speed']} kph {weather['wind_direction']}</p>
+    <p><strong>Rainfall:</strong> {weather['rainfall']} mm</p>
+    <p><strong>Cloud Cover:</strong> {weather['cloud_cover']}%</p>
+    <p><strong>UV Index:</strong> {weather['uv_index']}</p>
+</div>
+"""
+
+    def build(self, sections: Dict[str, str]) -> StringPromptValue:
+        counts = {name: count_tokens(sections[name]) for name in ("weather_context", "history", "query")}
+        counts["template"] = self.prefix_tokens
+        counts["total"] = sum(counts.values())
+        self.stats.record(counts)
+        return StringPromptValue(text=LEGACY_TEMPLATE.format(**sections))
+
+
+def run_mode(mode: str, args, endpoint: fakes.FakeHFEndpoint) -> Dict:
+    """Ask every query `rounds` times with one prompt style; returns token means and latency"""
+    from src.chatbot import KrishiMitra
+
+    bot = KrishiMitra(embeddings=fakes.fake_embeddings())
+    if mode == "legacy":
+        bot.prompt_builder = LegacyPromptBuilder(stats=bot.token_stats)
+    try:
+        calls, prompt_tokens = endpoint.calls, endpoint.prompt_tokens
+        latencies = []
+        for round_index in range(args.rounds):
+            session_id = f"{mode}-{round_index}"
+            for query in QUERIES:
+                start = time.perf_counter()
+                bot.ask(query, session_id=session_id)
+                latencies.append(time.perf_counter() - start)
+        sections = bot.token_stats.stats()["sections"]
+        upstream_calls = endpoint.calls - calls
+        return {
+            "tokens": {name: section["mean"] for name, section in sections.items()},
+            "upstream_tokens_per_call": round((endpoint.prompt_tokens - prompt_tokens) / max(upstream_calls, 1), 1),
+            "latency": common.summarize(latencies)
+        }
+    finally:
+        bot.close()
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--modes", default="legacy,compact", help="Prompt styles to compare")
+    parser.add_argument("--rounds", type=int, default=3, help="Sessions asking the full query set")
+    parser.add_argument("--forecast-days", type=int, default=3, help="PROMPT_FORECAST_DAYS of the compact prompt")
+    parser.add_argument("--weather-tokens", type=int, default=120, help="PROMPT_WEATHER_TOKENS of the compact prompt")
+    parser.add_argument("--first-token-delay", type=float, default=0.05, help="Seconds before the fake LLM answers")
+    parser.add_argument("--tokens-per-second", type=float, default=2000.0, help="Fake LLM output token rate")
+    parser.add_argument("--prefill-tokens-per-second", type=float, default=2000.0, help="Fake LLM prompt token rate")
+    parser.add_argument("--report", help="Also write the results as JSON to this file")
+    args = parser.parse_args()
+
+    # One line per prompt would drown the tables
+    logging.getLogger("src.prompt_builder").setLevel(logging.WARNING)
+    weather = fakes.FakeWeatherServer(latency=0.0).start()
+    endpoint = fakes.FakeHFEndpoint(
+        first_token_delay=args.first_token_delay, tokens_per_second=args.tokens_per_second,
+        prefill_tokens_per_second=args.prefill_tokens_per_second
+    ).start()
+    os.environ.update({
+        "WEATHER_API_URL": weather.url,
+        "WEATHER_API_KEY": "bench",
+        "HUGGINGFACE_ENDPOINT_URL": endpoint.url,
+        "HUGGINGFACE_API_TOKEN": "bench",
+        "CHAT_MEMORY_INDEX_DIR": "",
+        "ANSWER_CACHE_ENABLED": "false",
+        "PROMPT_FORECAST_DAYS": str(args.forecast_days),
+        "PROMPT_WEATHER_TOKENS": str(args.weather_tokens)
+    })
+    results = {}
+    try:
+        for mode in args.modes.split(","):
+            results[mode] = run_mode(mode, args, endpoint)
+    finally:
+        weather.stop()
+        endpoint.stop()
+
+    common.print_table({f"tokens:{mode}": result["tokens"] for mode, result in results.items()})
+    common.print_table({
+        f"latency:{mode}": {"upstream_tokens_per_call": result["upstream_tokens_per_call"], **result["latency"]}
+        for mode, result in results.items()
+    })
+
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump({"queries": QUERIES, "args": vars(args), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main_cli()
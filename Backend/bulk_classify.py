@@ -0,0 +1,356 @@
+"""
+Classify a large archive of images offline and stream the results to
+JSONL or Parquet.
+
+Paths come from walking a directory (in a stable, sorted order) or from a
+manifest (.txt with one path per line, .csv with a "path" column, or .jsonl
+with a "path" field). A pool of decode workers prefetches and preprocesses
+images ahead of the model, the batches run through DiseaseModel / PestModel
+(or both, decoding each photo once) and results are written as they
+arrive. Memory stays bounded by --batch-size, --prefetch and the Parquet
+part size, whatever the archive size.
+
+Progress is checkpointed next to the output. After an interruption, run the
+same command with --resume to continue after the last checkpoint. The
+checkpoint records the model identity, so resuming with a different model
+file is refused.
+
+Usage (from the repository root):
+    python Backend/bulk_classify.py --input /data/field-photos --model disease --output disease.jsonl
+    python Backend/bulk_classify.py --manifest photos.csv --model both --output scores/ --format parquet   # needs pyarrow
+    python Backend/bulk_classify.py --input /data/field-photos --model pest --output pest.jsonl --resume
+"""
+import argparse
+import csv
+import json
+import os
+import queue
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from src.prediction_cache import model_identity
+from src.preprocessing import BufferPool, decode_image, draft_size, prepare_into
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".webp")
+
+
+def walk_images(directory: str) -> Iterator[str]:
+    """Image paths under a directory, depth first in sorted order, without listing the whole tree"""
+    entries = sorted(os.scandir(directory), key=lambda entry: entry.name)
+    for entry in entries:
+        if entry.is_dir(follow_symlinks=False):
+            yield from walk_images(entry.path)
+        elif entry.name.lower().endswith(IMAGE_EXTENSIONS):
+            yield entry.path
+
+
+def read_manifest(path: str) -> Iterator[str]:
+    """Image paths from a .txt, .csv ("path" column) or .jsonl ("path" field) manifest"""
+    base = os.path.dirname(os.path.abspath(path))
+    with open(path, newline="") as f:
+        if path.endswith(".csv"):
+            rows = (row["path"] for row in csv.DictReader(f))
+        elif path.endswith(".jsonl"):
+            rows = (json.loads(line)["path"] for line in f if line.strip())
+        else:
+            rows = (line.strip() for line in f if line.strip() and not line.startswith("#"))
+        for row in rows:
+            # Relative manifest entries are relative to the manifest itself
+            yield row if os.path.isabs(row) else os.path.join(base, row)
+
+
+class Pipeline:
+    """
+    Prefetching decode pipeline: decode workers fill pooled batch buffers
+    while the model runs on the previous batch.
+
+    Up to `prefetch` finished batches wait in a queue, and at most
+    `workers * 2` images are being decoded at once, so memory does not grow
+    with the number of input paths. Batches keep the input order, which is
+    what makes resuming by position possible.
+    """
+
+    def __init__(self, models: Dict[str, object], batch_size: int, workers: int, prefetch: int):
+        self.models = models
+        self.specs = [model.input_spec for model in models.values()]
+        self.min_size = draft_size(self.specs)
+        self.batch_size = batch_size
+        self.workers = workers
+        self._buffers = BufferPool(max_buffers=(prefetch + 2) * len(self.specs))
+        self._batches: "queue.Queue" = queue.Queue(maxsize=prefetch)
+        self._stop = threading.Event()
+
+    def _decode(self, path: str, rows: List[np.ndarray]) -> Optional[str]:
+        """Decode one image into its row of every model's batch; returns the error, if any"""
+        try:
+            img = decode_image(path, self.min_size)
+            for spec, row in zip(self.specs, rows):
+                prepare_into(img, spec, row)
+            return None
+        except Exception as e:
+            return str(e)
+
+    def _produce(self, paths: Iterator[str]):
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="bulk-decode") as pool:
+                while not self._stop.is_set():
+                    chunk = list(islice(paths, self.batch_size))
+                    if not chunk:
+                        break
+                    buffers = [self._buffers.acquire(len(chunk), spec.shape) for spec in self.specs]
+                    pending = deque()
+                    errors = []
+                    for i, path in enumerate(chunk):
+                        if len(pending) >= self.workers * 2:
+                            errors.append(pending.popleft().result())
+                        pending.append(pool.submit(self._decode, path, [buffer[i] for buffer in buffers]))
+                    errors.extend(future.result() for future in pending)
+                    self._put((chunk, buffers, errors))
+        except Exception as e:
+            self._put(e)
+        finally:
+            self._put(None)
+
+    def _put(self, item):
+        while not self._stop.is_set():
+            try:
+                self._batches.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def run(self, paths: Iterator[str]) -> Iterator[Tuple[List[str], List[Dict]]]:
+        """Yield (paths, one record per path) for each batch, in input order"""
+        producer = threading.Thread(target=self._produce, args=(paths,), daemon=True)
+        producer.start()
+        try:
+            while True:
+                item = self._batches.get()
+                if item is None:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                chunk, buffers, errors = item
+                try:
+                    yield chunk, self._predict(chunk, buffers, errors)
+                finally:
+                    for buffer in buffers:
+                        self._buffers.release(buffer)
+        finally:
+            self._stop.set()
+            producer.join()
+
+    def _predict(self, chunk: List[str], buffers: List[np.ndarray], errors: List[Optional[str]]) -> List[Dict]:
+        ok = [i for i, error in enumerate(errors) if error is None]
+        records = [{"path": path} for path in chunk]
+        for (name, model), buffer in zip(self.models.items(), buffers):
+            results = model.predict_batch(buffer[ok]) if ok else []
+            for i, result in zip(ok, results):
+                records[i][name] = result
+        for i, error in enumerate(errors):
+            if error is not None:
+                for name in self.models:
+                    records[i][name] = {"success": False, "error": f"Failed to preprocess image: {error}"}
+        return records
+
+
+class JSONLWriter:
+    """One JSON record per line, appended; resumes by truncating to the checkpointed size"""
+
+    def __init__(self, path: str, resume_state: Optional[Dict]):
+        if resume_state is not None:
+            with open(path, "r+b") as f:
+                f.truncate(resume_state["bytes"])
+        self._file = open(path, "ab" if resume_state is not None else "wb")
+
+    def write(self, records: List[Dict]):
+        self._file.write("".join(json.dumps(record) + "\n" for record in records).encode())
+
+    def flush(self) -> Dict:
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        return {"bytes": self._file.tell()}
+
+    def close(self):
+        self._file.close()
+
+
+class ParquetWriter:
+    """
+    Parquet part files in an output directory (needs `pyarrow`).
+
+    Nested results are flattened to one row per image and model: path,
+    model, success, error, prediction, confidence, stage, and the top-3 list
+    as JSON. A part file is written every `rows_per_file` images, and a
+    checkpoint always falls on a part boundary.
+    """
+
+    def __init__(self, path: str, resume_state: Optional[Dict], rows_per_file: int = 100000):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise ImportError("Parquet output needs pyarrow: pip install pyarrow")
+        self._pa = pyarrow
+        self._pq = pyarrow.parquet
+        self.path = path
+        self.rows_per_file = rows_per_file
+        self.part = resume_state["parts"] if resume_state is not None else 0
+        self._rows: List[Dict] = []
+        os.makedirs(path, exist_ok=True)
+        # Parts after the checkpoint belong to the interrupted run
+        for name in os.listdir(path):
+            if name.startswith("part-") and int(name[5:10]) >= self.part:
+                os.remove(os.path.join(path, name))
+
+    @staticmethod
+    def _rows_for(record: Dict) -> Iterator[Dict]:
+        for name, result in record.items():
+            if name == "path":
+                continue
+            yield {
+                "path": record["path"],
+                "model": name,
+                "success": bool(result.get("success")),
+                "error": result.get("error"),
+                "prediction": result.get("predicted_class", result.get("predicted_pest")),
+                "confidence": result.get("confidence"),
+                "stage": result.get("stage"),
+                "top_3_predictions": json.dumps(result["top_3_predictions"]) if "top_3_predictions" in result else None
+            }
+
+    def write(self, records: List[Dict]):
+        for record in records:
+            self._rows.extend(self._rows_for(record))
+
+    def ready(self) -> bool:
+        """True when enough rows are buffered for a part file (checkpoint only then)"""
+        return len(self._rows) >= self.rows_per_file
+
+    def flush(self) -> Dict:
+        if self._rows:
+            table = self._pa.Table.from_pylist(self._rows)
+            self._pq.write_table(table, os.path.join(self.path, f"part-{self.part:05d}.parquet"))
+            self.part += 1
+            self._rows = []
+        return {"parts": self.part}
+
+    def close(self):
+        self.flush()
+
+
+def _checkpoint_path(output: str) -> str:
+    return output.rstrip("/\\") + ".checkpoint.json"
+
+
+def load_checkpoint(output: str, identity: Dict) -> Dict:
+    with open(_checkpoint_path(output)) as f:
+        checkpoint = json.load(f)
+    if checkpoint["models"] != identity:
+        raise SystemExit(
+            f"Checkpoint was written by different models ({checkpoint['models']}); "
+            "start again without --resume to re-score everything"
+        )
+    return checkpoint
+
+
+def save_checkpoint(output: str, checkpoint: Dict):
+    """Write the checkpoint atomically, so an interruption leaves the previous one intact"""
+    path = _checkpoint_path(output)
+    with open(f"{path}.tmp", "w") as f:
+        json.dump(checkpoint, f)
+    os.replace(f"{path}.tmp", path)
+
+
+def load_models(names: Sequence[str], runner: Optional[str]) -> Dict[str, object]:
+    models = {}
+    if "disease" in names:
+        from src.disease_model import DiseaseModel
+        models["disease"] = DiseaseModel(runner=runner)
+    if "pest" in names:
+        from src.pest_model import PestModel
+        models["pest"] = PestModel(runner=runner)
+    return models
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--input", help="Directory of images (searched recursively)")
+    source.add_argument("--manifest", help=".txt, .csv or .jsonl list of image paths")
+    parser.add_argument("--model", choices=["disease", "pest", "both"], default="disease")
+    parser.add_argument("--output", required=True, help="JSONL file, or a directory of part files for Parquet")
+    parser.add_argument("--format", choices=["jsonl", "parquet"], default="jsonl")
+    parser.add_argument("--runner", help="Inference backend (default: DISEASE_RUNNER / PEST_RUNNER / MODEL_RUNNER)")
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 4, help="Decode threads")
+    parser.add_argument("--prefetch", type=int, default=2, help="Decoded batches kept ready ahead of the model")
+    parser.add_argument("--checkpoint-every", type=int, default=20, help="Batches between JSONL checkpoints")
+    parser.add_argument("--rows-per-file", type=int, default=100000, help="Rows per Parquet part file")
+    parser.add_argument("--resume", action="store_true", help="Continue after the last checkpoint")
+    args = parser.parse_args()
+
+    names = ["disease", "pest"] if args.model == "both" else [args.model]
+    models = load_models(names, args.runner)
+    identity = {name: model_identity(model) for name, model in models.items()}
+
+    checkpoint = None
+    if args.resume and os.path.exists(_checkpoint_path(args.output)):
+        checkpoint = load_checkpoint(args.output, identity)
+        print(f"Resuming after {checkpoint['processed']} images")
+
+    if args.format == "parquet":
+        writer = ParquetWriter(args.output, checkpoint and checkpoint["writer"], args.rows_per_file)
+    else:
+        writer = JSONLWriter(args.output, checkpoint and checkpoint["writer"])
+
+    paths = walk_images(args.input) if args.input else read_manifest(args.manifest)
+    processed = checkpoint["processed"] if checkpoint else 0
+    failed = checkpoint["failed"] if checkpoint else 0
+    paths = islice(paths, processed, None)
+
+    pipeline = Pipeline(models, args.batch_size, args.workers, args.prefetch)
+    start = last_report = time.perf_counter()
+    done_this_run = 0
+    batches = 0
+    try:
+        for chunk, records in pipeline.run(paths):
+            writer.write(records)
+            processed += len(chunk)
+            done_this_run += len(chunk)
+            failed += sum(not all(record[name].get("success") for name in models) for record in records)
+            batches += 1
+
+            due = writer.ready() if args.format == "parquet" else batches % args.checkpoint_every == 0
+            if due:
+                save_checkpoint(args.output, {
+                    "models": identity, "processed": processed, "failed": failed, "writer": writer.flush()
+                })
+
+            now = time.perf_counter()
+            if now - last_report >= 5:
+                rate = done_this_run / (now - start)
+                print(f"  {processed} images ({failed} failed), {rate:.1f} images/s", file=sys.stderr)
+                last_report = now
+
+        save_checkpoint(args.output, {"models": identity, "processed": processed, "failed": failed, "writer": writer.flush()})
+    finally:
+        writer.close()
+
+    elapsed = time.perf_counter() - start
+    print(
+        f"Classified {done_this_run} images in {elapsed:.1f}s "
+        f"({done_this_run / elapsed if elapsed else 0:.1f} images/s); "
+        f"{processed} total, {failed} failed -> {args.output}"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+"""
+Export the disease and pest classifiers to TFLite or ONNX and check that
+the exported model agrees with Keras.
+
+For each backend (keras, tf_function, and the export) the parity check
+reports top-1 agreement and maximum probability difference against Keras,
+plus single-image and batched latency.
+
+Usage (from the repository root):
+    python Backend/convert_models.py --model all --format tflite --quantize float16
+    python Backend/convert_models.py --model disease --format tflite --quantize int8 --samples path/to/leaf/images
+    python Backend/convert_models.py --model pest --format onnx          # needs tf2onnx and onnxruntime
+
+Serve the export with MODEL_RUNNER=tflite (or DISEASE_RUNNER / PEST_RUNNER,
+plus DISEASE_RUNNER_PATH / PEST_RUNNER_PATH for a quantised file).
+"""
+import argparse
+import io
+import json
+import os
+import time
+from typing import Dict, List
+
+import numpy as np
+from PIL import Image
+
+from src.disease_model import DiseaseModel
+from src.pest_model import PestModel
+from src.runners import QUANTIZATIONS, create_runner, export_onnx, export_tflite, exported_model_path
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".webp")
+
+
+def sample_inputs(model, samples_dir: str = None, count: int = 32, seed: int = 0) -> np.ndarray:
+    """
+    Preprocessed inputs for calibration and parity checks
+
+    Uses images from `samples_dir` when given; otherwise random images,
+    which still exercise the full preprocessing path but are less
+    representative for int8 calibration.
+    """
+    images: List[bytes] = []
+    if samples_dir:
+        for name in sorted(os.listdir(samples_dir)):
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                with open(os.path.join(samples_dir, name), "rb") as f:
+                    images.append(f.read())
+            if len(images) >= count:
+                break
+    if not images:
+        rng = np.random.default_rng(seed)
+        for _ in range(count):
+            buffer = io.BytesIO()
+            Image.fromarray(rng.integers(0, 256, (300, 300, 3), dtype=np.uint8)).save(buffer, format="PNG")
+            images.append(buffer.getvalue())
+    return np.concatenate([model.preprocess_image(image) for image in images])
+
+
+def measure(runner, inputs: np.ndarray, batch_size: int, repeats: int = 3) -> Dict:
+    """Outputs plus single-image and batched latency of a runner"""
+    runner.predict(inputs[:1])
+    runner.predict(inputs[:batch_size])
+
+    single = []
+    for sample in inputs:
+        start = time.perf_counter()
+        runner.predict(sample[np.newaxis])
+        single.append(time.perf_counter() - start)
+
+    batched = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        outputs = np.concatenate([
+            runner.predict(inputs[i:i + batch_size]) for i in range(0, len(inputs), batch_size)
+        ])
+        batched.append((time.perf_counter() - start) / len(inputs))
+
+    return {
+        "outputs": outputs,
+        "single_p50_ms": round(float(np.percentile(single, 50)) * 1000, 3),
+        "single_p95_ms": round(float(np.percentile(single, 95)) * 1000, 3),
+        "batched_ms_per_image": round(min(batched) * 1000, 3)
+    }
+
+
+def convert(name: str, args) -> Dict:
+    model = DiseaseModel(runner="keras") if name == "disease" else PestModel(runner="keras")
+    input_shape = (*model.target_size, 3)
+    inputs = sample_inputs(model, args.samples, args.count)
+    path = args.output or exported_model_path(model.model_path, args.format, args.quantize)
+
+    if args.format == "tflite":
+        export_tflite(model.model, path, args.quantize, representative_data=lambda: (x[np.newaxis] for x in inputs))
+    else:
+        export_onnx(model.model, path, input_shape, args.quantize)
+
+    runners = {
+        "keras": model.runner,
+        "tf_function": create_runner("tf_function", model=model.model, input_shape=input_shape),
+        f"{args.format}:{args.quantize}": create_runner(args.format, path=path, num_threads=args.threads)
+    }
+    results = {name: measure(runner, inputs, args.batch_size) for name, runner in runners.items()}
+
+    reference = results["keras"]["outputs"]
+    report = {"model": name, "export": path, "size_bytes": os.path.getsize(path), "samples": len(inputs), "backends": {}}
+    for backend, result in results.items():
+        outputs = result.pop("outputs")
+        result["top1_agreement"] = round(float(np.mean(outputs.argmax(axis=1) == reference.argmax(axis=1))), 4)
+        result["max_abs_diff"] = round(float(np.max(np.abs(outputs - reference))), 6)
+        report["backends"][backend] = result
+    return report
+
+
+def print_report(report: Dict):
+    print(f"\n{report['model']}: {report['export']} ({report['size_bytes']} bytes, {report['samples']} samples)")
+    for backend, result in report["backends"].items():
+        fields = "  ".join(f"{key}={value}" for key, value in result.items())
+        print(f"  {backend:<18} {fields}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", choices=["disease", "pest", "all"], default="all")
+    parser.add_argument("--format", choices=["tflite", "onnx"], default="tflite")
+    parser.add_argument("--quantize", choices=QUANTIZATIONS, default="none")
+    parser.add_argument("--samples", help="Directory of real images for calibration and parity")
+    parser.add_argument("--count", type=int, default=32, help="Images used for calibration and parity")
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--threads", type=int, default=None, help="CPU threads for the exported runner")
+    parser.add_argument("--output", help="Export path (single model only)")
+    parser.add_argument("--min-agreement", type=float, default=0.99, help="Fail if top-1 agreement is lower")
+    parser.add_argument("--report", help="Also write the report as JSON to this file")
+    args = parser.parse_args()
+
+    names = ["disease", "pest"] if args.model == "all" else [args.model]
+    if args.output and len(names) > 1:
+        parser.error("--output needs a single --model")
+
+    reports = [convert(name, args) for name in names]
+    for report in reports:
+        print_report(report)
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump(reports, f, indent=2)
+
+    failed = [
+        f"{report['model']} ({backend})"
+        for report in reports
+        for backend, result in report["backends"].items()
+        if result["top1_agreement"] < args.min_agreement
+    ]
+    if failed:
+        raise SystemExit(f"Top-1 agreement below {args.min_agreement}: {', '.join(failed)}")
+
+
+if __name__ == "__main__":
+    main()
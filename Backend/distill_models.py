@@ -0,0 +1,180 @@
+"""
+Distil a small, low-resolution fast model from the disease or pest
+classifier for the confidence-gated cascade (src/cascade.py).
+
+The student sees the classifier's input shrunk to --size (with the same
+src.cascade.downsample used when serving) and learns the classifier's
+softened probabilities, so no labels are needed: any folder of leaf or
+pest photos works. A held-out share of the images reports top-1 agreement
+with the full model, and how many images the cascade would answer at each
+confidence threshold.
+
+Usage (from the repository root):
+    python Backend/distill_models.py --model disease --images path/to/leaf/photos --size 128 --epochs 15
+    python Backend/distill_models.py --model pest --images path/to/pest/photos --size 112 --report pest_fast.json
+
+Serve it with MODEL_CASCADE=true (or DISEASE_CASCADE_PATH / PEST_CASCADE_PATH),
+and tune DISEASE_CASCADE_THRESHOLD / PEST_CASCADE_THRESHOLD from the report.
+"""
+import argparse
+import json
+import os
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from src.cascade import downsample, fast_model_path
+from src.disease_model import DiseaseModel
+from src.pest_model import PestModel
+from src.preprocessing import preprocess_batch
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".webp")
+THRESHOLDS = (50, 70, 80, 90, 95)
+
+
+def list_images(directory: str) -> List[str]:
+    """Image files under a directory, recursively, in a stable order"""
+    paths = []
+    for root, _, files in os.walk(directory):
+        paths.extend(os.path.join(root, name) for name in files if name.lower().endswith(IMAGE_EXTENSIONS))
+    return sorted(paths)
+
+
+def teacher_targets(model, paths: List[str], size: int, chunk: int = 64) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Student inputs and full-model probabilities for a list of images
+
+    Images are processed in chunks so only the small student inputs are
+    kept; files that fail to decode are skipped.
+
+    Returns: (float16 inputs of shape (N, size, size, 3), probabilities of shape (N, classes))
+    """
+    inputs, targets = [], []
+    for start in range(0, len(paths), chunk):
+        batch, errors = preprocess_batch(paths[start:start + chunk], model.input_spec)
+        batch = batch[[error is None for error in errors]]
+        if not len(batch):
+            continue
+        targets.append(model.runner.predict(batch))
+        inputs.append(downsample(batch, (size, size)).astype(np.float16))
+        print(f"  labelled {min(start + chunk, len(paths))}/{len(paths)} images", end="\r")
+    print()
+    return np.concatenate(inputs), np.concatenate(targets)
+
+
+def build_student(size: int, classes: int):
+    """MobileNetV3-Small trunk with a logits head (the served model adds the softmax)"""
+    import keras
+
+    trunk = keras.applications.MobileNetV3Small(
+        input_shape=(size, size, 3),
+        include_top=False,
+        weights=None,
+        pooling="avg",
+        minimalistic=True,
+        include_preprocessing=False
+    )
+    inputs = keras.Input((size, size, 3))
+    features = keras.layers.Dropout(0.2)(trunk(inputs))
+    return keras.Model(inputs, keras.layers.Dense(classes)(features), name="fast_student")
+
+
+def soften(probs: np.ndarray, temperature: float) -> np.ndarray:
+    """Teacher probabilities at a higher softmax temperature"""
+    logits = np.log(np.clip(probs, 1e-7, 1.0)) / temperature
+    exp = np.exp(logits - logits.max(axis=1, keepdims=True))
+    return (exp / exp.sum(axis=1, keepdims=True)).astype(np.float32)
+
+
+def train(student, inputs: np.ndarray, targets: np.ndarray, args):
+    import keras
+    import tensorflow as tf
+
+    temperature = args.temperature
+
+    def distillation_loss(soft_targets, logits):
+        return keras.losses.kl_divergence(soft_targets, keras.ops.softmax(logits / temperature)) * temperature ** 2
+
+    dataset = (
+        tf.data.Dataset.from_tensor_slices((inputs, soften(targets, temperature)))
+        .shuffle(len(inputs), seed=args.seed)
+        .map(lambda x, y: (tf.image.random_flip_left_right(tf.cast(x, tf.float32)), y), num_parallel_calls=tf.data.AUTOTUNE)
+        .batch(args.batch_size)
+        .prefetch(tf.data.AUTOTUNE)
+    )
+    # Compile a wrapper sharing the student's layers, so the saved student
+    # does not reference the training-only loss function
+    trainer = keras.Model(student.inputs, student.outputs)
+    trainer.compile(optimizer=keras.optimizers.Adam(args.learning_rate), loss=distillation_loss)
+    trainer.fit(dataset, epochs=args.epochs, verbose=2)
+
+
+def evaluate(fast_probs: np.ndarray, full_probs: np.ndarray) -> Dict:
+    """Agreement with the full model, alone and as a cascade at each threshold"""
+    agree = fast_probs.argmax(axis=1) == full_probs.argmax(axis=1)
+    confidence = fast_probs.max(axis=1) * 100
+    report = {"samples": len(agree), "top1_agreement": round(float(agree.mean()), 4), "cascade": {}}
+    for threshold in THRESHOLDS:
+        answered = confidence >= threshold
+        # Escalated images get the full model's answer, so only answered ones can disagree
+        report["cascade"][str(threshold)] = {
+            "answered_by_fast": round(float(answered.mean()), 4),
+            "top1_agreement": round(float(1 - (answered & ~agree).mean()), 4)
+        }
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", choices=["disease", "pest"], required=True)
+    parser.add_argument("--images", required=True, help="Folder of unlabeled photos (searched recursively)")
+    parser.add_argument("--size", type=int, default=128, help="Fast model input resolution")
+    parser.add_argument("--epochs", type=int, default=15)
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--learning-rate", type=float, default=1e-3)
+    parser.add_argument("--temperature", type=float, default=2.0, help="Softmax temperature of the soft targets")
+    parser.add_argument("--holdout", type=float, default=0.1, help="Share of images kept for evaluation")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Fast model path (default: <model>.fast.keras next to the classifier)")
+    parser.add_argument("--report", help="Also write the evaluation as JSON to this file")
+    args = parser.parse_args()
+
+    import keras
+    keras.utils.set_random_seed(args.seed)
+
+    model = DiseaseModel(runner="keras") if args.model == "disease" else PestModel(runner="keras")
+    paths = list_images(args.images)
+    if len(paths) < 10:
+        parser.error(f"Found {len(paths)} images in {args.images}; distillation needs at least 10")
+
+    order = np.random.default_rng(args.seed).permutation(len(paths))
+    holdout = max(1, int(len(paths) * args.holdout))
+    train_paths = [paths[i] for i in order[holdout:]]
+    holdout_paths = [paths[i] for i in order[:holdout]]
+
+    print(f"Labelling {len(train_paths)} training images with the full {args.model} model")
+    inputs, targets = teacher_targets(model, train_paths, args.size)
+    student = build_student(args.size, targets.shape[1])
+    train(student, inputs, targets, args)
+
+    served = keras.Sequential([student, keras.layers.Softmax()], name=f"{args.model}_fast")
+    served.build((None, args.size, args.size, 3))
+    output = args.output or fast_model_path(model.model_path)
+    served.save(output)
+
+    holdout_inputs, holdout_targets = teacher_targets(model, holdout_paths, args.size)
+    report = {
+        "model": args.model,
+        "output": output,
+        "size": args.size,
+        "train_images": len(inputs),
+        **evaluate(served.predict(holdout_inputs.astype(np.float32), verbose=0), holdout_targets)
+    }
+    print(json.dumps(report, indent=2))
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,17 +1,32 @@
 import warnings
 warnings.filterwarnings("ignore")
 import os
-from fastapi import FastAPI, UploadFile, File, Query, HTTPException
+import json
+import asyncio
+from contextlib import aclosing, nullcontext
+from fastapi import FastAPI, UploadFile, File, Query, Header, HTTPException, Request, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
-from typing import Optional
+from typing import List, Optional
+import numpy as np
 import uvicorn
 import logging
 
-from src.disease_model import DiseaseModel
-from src.pest_model import PestModel
-from src.chatbot import KrishiMitra
+from src.sessions import SESSION_COOKIE, SessionCookieMiddleware, new_session_id, session_cookie
+from src.batching import BatchScheduler, DEADLINE_ERROR, ModelReleased
+from src.uploads import expand_uploads, read_upload, read_uploads, UploadLimitError
+from src.executors import ExecutorPool, parse_limits
+from src.prediction_cache import create_prediction_cache, model_identity
+from src.model_loader import ModelSlot
+from src.registry import ModelRegistry
+from src.model_server import ModelServerClient, RemoteEmbeddings, RemoteModel
+from src.preprocessing import preprocess_multi
+from src.tta import VIEWS as TTA_VIEWS
+from src.diagnosis import summarize_diagnosis
+from src.metrics import metrics, MetricsMiddleware
+from src.admission import AdmissionMiddleware, AdmissionRejected, create_admission
+from src.llm_client import LLMError, LLMTimeout
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -26,6 +41,45 @@ app = FastAPI(
     version="1.0.0"
 )
 
+# Per-endpoint concurrency limits, shared by the admission queues and the executors
+ENDPOINT_LIMITS = parse_limits(os.environ.get("CONCURRENCY_LIMITS", "chatbot=8,weather=16,disease=32,pest=32,crop_health=32"))
+
+# Admission control: bounded, deadline-ordered queues in front of the heavy
+# endpoints. Other routes (health, weather, stats) are never queued.
+# WebSocket chat is admitted per message, in the handler.
+ADMISSION_ROUTES = {
+    ("POST", "/disease-prediction/"): "disease",
+    ("POST", "/disease-prediction/batch/"): "disease",
+    ("POST", "/pest-prediction/"): "pest",
+    ("POST", "/pest-prediction/batch/"): "pest",
+    ("POST", "/crop-health/"): "crop_health",
+    ("POST", "/chatbot/"): "chatbot",
+    ("GET", "/chatbot/"): "chatbot",
+    ("POST", "/chatbot/stream/"): "chatbot",
+    ("GET", "/chatbot/stream/"): "chatbot",
+    ("WEBSOCKET", "/chatbot/ws/"): "chatbot"
+}
+# Batch uploads take one unit of their endpoint's concurrency per
+# ADMISSION_BATCH_IMAGE_KB of upload, i.e. roughly one per image
+ADMISSION_BATCH_IMAGE_BYTES = int(os.environ.get("ADMISSION_BATCH_IMAGE_KB", 256)) * 1024
+admission = create_admission(
+    ADMISSION_ROUTES,
+    concurrency=ENDPOINT_LIMITS,
+    queue_sizes=parse_limits(os.environ.get("ADMISSION_QUEUE_LIMITS", "chatbot=16,disease=64,pest=64,crop_health=32")),
+    timeouts=parse_limits(os.environ.get("ADMISSION_TIMEOUTS", "chatbot=60,disease=15,pest=15,crop_health=20")),
+    enabled=os.environ.get("ADMISSION_ENABLED", "true").lower() not in ("0", "false", "no"),
+    upload_costs={
+        ("POST", "/disease-prediction/batch/"): ADMISSION_BATCH_IMAGE_BYTES,
+        ("POST", "/pest-prediction/batch/"): ADMISSION_BATCH_IMAGE_BYTES
+    }
+)
+# Added first so it runs inside CORS, and rejections still carry CORS headers
+app.add_middleware(
+    AdmissionMiddleware,
+    control=admission,
+    drain_bytes=int(os.environ.get("ADMISSION_DRAIN_KB", 256)) * 1024
+)
+
 # CORS Configuration
 app.add_middleware(
     CORSMiddleware,
@@ -35,39 +89,270 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Gives clients that send no session id a session of their own, kept in a cookie
+app.add_middleware(SessionCookieMiddleware)
+
+# Request metrics (skipped entirely when METRICS_ENABLED=false)
+if metrics.enabled:
+    app.add_middleware(MetricsMiddleware, registry=metrics)
+
 # Models
 class LocationUpdate(BaseModel):
     location: str
+    session_id: Optional[str] = None
 
 class ChatQuery(BaseModel):
     query: str
+    session_id: Optional[str] = None
+
+class ModelDeployment(BaseModel):
+    path: str
+    version: Optional[str] = None
+    shadow_percent: Optional[float] = None
+
+def _session_id(request: Request, explicit: Optional[str], header: Optional[str]) -> str:
+    """
+    Pick the chat session from the request field, the X-Session-ID header or the session cookie.
+
+    A client with none of them gets a new id, which SessionCookieMiddleware
+    sets as its cookie so the client keeps its own session.
+    """
+    session_id = explicit or header or getattr(request.state, "session_cookie", None)
+    if not session_id:
+        session_id = request.state.new_session_id = new_session_id()
+    return session_id
+
+# Micro-batching configuration
+BATCH_MAX_SIZE = int(os.environ.get("BATCH_MAX_SIZE", 16))
+BATCH_MAX_WAIT_MS = float(os.environ.get("BATCH_MAX_WAIT_MS", 10))
+BATCH_UPLOAD_MAX_FILES = int(os.environ.get("BATCH_UPLOAD_MAX_FILES", 64))
+
+# Upload size limits (413 beyond them): each image, and all files of a batch together
+UPLOAD_MAX_FILE_BYTES = int(os.environ.get("UPLOAD_MAX_FILE_MB", 20)) * 1024 * 1024
+BATCH_UPLOAD_MAX_TOTAL_BYTES = int(os.environ.get("BATCH_UPLOAD_MAX_TOTAL_MB", 200)) * 1024 * 1024
+
+# Minimum confidences (%) for /crop-health/ to report a disease or pest
+DIAGNOSIS_DISEASE_THRESHOLD = float(os.environ.get("DIAGNOSIS_DISEASE_THRESHOLD", 50))
+DIAGNOSIS_PEST_THRESHOLD = float(os.environ.get("DIAGNOSIS_PEST_THRESHOLD", 60))
+
+# Executors for blocking work, with per-endpoint concurrency limits
+executors = ExecutorPool(
+    io_workers=int(os.environ.get("IO_WORKERS", 16)),
+    decode_workers=int(os.environ.get("DECODE_WORKERS", 4)),
+    inference_workers=int(os.environ.get("INFERENCE_WORKERS", 1)),
+    priority_workers=int(os.environ.get("PRIORITY_WORKERS", 4)),
+    shadow_workers=int(os.environ.get("SHADOW_INFERENCE_WORKERS", 1)),
+    endpoint_limits=ENDPOINT_LIMITS
+)
+
+# Content-hash cache of prediction results ("memory" or shared "disk" backend)
+prediction_cache = create_prediction_cache(
+    backend=os.environ.get("PREDICTION_CACHE_BACKEND", "memory"),
+    path=os.environ.get("PREDICTION_CACHE_PATH"),
+    max_entries=int(os.environ.get("PREDICTION_CACHE_SIZE", 2048)),
+    ttl_seconds=float(os.environ.get("PREDICTION_CACHE_TTL", 3600))
+)
+
+# Subsystems listed in LAZY_MODELS (e.g. "disease,pest" for a chatbot-only
+# worker) load on first use; the rest load in parallel after startup
+LAZY_MODELS = {name.strip() for name in os.environ.get("LAZY_MODELS", "").split(",") if name.strip()}
+MODEL_WARMUP = os.environ.get("MODEL_WARMUP", "true").lower() not in ("0", "false", "no")
+
+# Model versions: the last activated version of each model is recorded in
+# MODEL_REGISTRY_PATH ("" to disable); deploying new versions at runtime
+# needs the X-Admin-Token header to match MODEL_ADMIN_TOKEN
+MODEL_REGISTRY_PATH = os.environ.get("MODEL_REGISTRY_PATH", "Backend/models/registry.json")
+MODEL_ADMIN_TOKEN = os.environ.get("MODEL_ADMIN_TOKEN")
+
+# Multi-worker mode: with MODEL_SERVER_SOCKET set (comma-separated for several
+# servers started by Backend/model_server.py), the classifiers and MiniLM run
+# in the model server shared by every worker and this process never loads them
+MODEL_SERVER_SOCKET = os.environ.get("MODEL_SERVER_SOCKET", "")
+model_server = ModelServerClient(
+    MODEL_SERVER_SOCKET,
+    slots=int(os.environ.get("MODEL_SERVER_SLOTS", 4)),
+    slot_rows=int(os.environ.get("MODEL_SERVER_SLOT_ROWS", BATCH_MAX_SIZE)),
+    connect_timeout=float(os.environ.get("MODEL_SERVER_CONNECT_TIMEOUT", 60))
+) if MODEL_SERVER_SOCKET else None
 
 # Initialize models and chatbot
 disease_model = None
 pest_model = None
 chatbot = None
+disease_scheduler = None
+pest_scheduler = None
+
+def _build_disease_model(path: Optional[str] = None):
+    if model_server is not None:
+        return RemoteModel(model_server, "disease", path)
+    # Imported here so TensorFlow is only loaded by workers that serve images
+    from src.disease_model import DiseaseModel
+    return DiseaseModel(model_path=path)
+
+def _build_pest_model(path: Optional[str] = None):
+    if model_server is not None:
+        return RemoteModel(model_server, "pest", path)
+    from src.pest_model import PestModel
+    return PestModel(model_path=path)
+
+def _load_disease_model():
+    return _build_disease_model(disease_registry.saved_path())
+
+def _load_pest_model():
+    return _build_pest_model(pest_registry.saved_path())
+
+def _load_chatbot():
+    from src.chatbot import KrishiMitra
+    return KrishiMitra(embeddings=RemoteEmbeddings(model_server) if model_server is not None else None)
+
+def _warm_image_model(model):
+    """Trace the inference graph with a dummy batch"""
+    batch = np.zeros((1, *model.target_size, 3), dtype=np.float32)
+    model.predict_batch(batch)
+    if model.cascade is not None:
+        # Behind a cascade the full model only runs for escalated images
+        model.runner.predict(batch)
+
+def _make_scheduler(model, name: str) -> BatchScheduler:
+    return BatchScheduler(
+        model,
+        max_batch_size=BATCH_MAX_SIZE,
+        max_wait_ms=BATCH_MAX_WAIT_MS,
+        name=name,
+        executor=executors.inference_executor,
+        decode_executor=executors.decode_executor
+    )
+
+def _make_shadow_scheduler(model, name: str) -> BatchScheduler:
+    """Scheduler for a shadow version; its forward passes never queue behind (or ahead of) live ones"""
+    return BatchScheduler(
+        model,
+        max_batch_size=BATCH_MAX_SIZE,
+        max_wait_ms=BATCH_MAX_WAIT_MS,
+        name=name,
+        executor=executors.shadow_executor,
+        decode_executor=executors.decode_executor
+    )
+
+async def _disease_ready(model):
+    global disease_model, disease_scheduler
+    scheduler = _make_scheduler(model, "disease")
+    await scheduler.start()
+    disease_registry.attach(model, scheduler)
+    disease_model, disease_scheduler = model, scheduler
+
+async def _pest_ready(model):
+    global pest_model, pest_scheduler
+    scheduler = _make_scheduler(model, "pest")
+    await scheduler.start()
+    pest_registry.attach(model, scheduler)
+    pest_model, pest_scheduler = model, scheduler
+
+async def _disease_activated(model):
+    global disease_model
+    disease_model = model
+
+async def _pest_activated(model):
+    global pest_model
+    pest_model = model
+
+async def _chatbot_ready(bot):
+    global chatbot
+    chatbot = bot
+
+disease_registry = ModelRegistry(
+    "disease", _build_disease_model, _make_shadow_scheduler,
+    warmup=_warm_image_model if MODEL_WARMUP else None,
+    on_activate=_disease_activated, state_path=MODEL_REGISTRY_PATH or None
+)
+pest_registry = ModelRegistry(
+    "pest", _build_pest_model, _make_shadow_scheduler,
+    warmup=_warm_image_model if MODEL_WARMUP else None,
+    on_activate=_pest_activated, state_path=MODEL_REGISTRY_PATH or None
+)
+MODEL_REGISTRIES = {"disease": disease_registry, "pest": pest_registry}
+
+disease_slot = ModelSlot(
+    "disease_model", _load_disease_model,
+    warmup=_warm_image_model if MODEL_WARMUP else None,
+    on_ready=_disease_ready, lazy="disease" in LAZY_MODELS
+)
+pest_slot = ModelSlot(
+    "pest_model", _load_pest_model,
+    warmup=_warm_image_model if MODEL_WARMUP else None,
+    on_ready=_pest_ready, lazy="pest" in LAZY_MODELS
+)
+chatbot_slot = ModelSlot(
+    "chatbot", _load_chatbot,
+    warmup=(lambda bot: bot.warm_up()) if MODEL_WARMUP else None,
+    on_ready=_chatbot_ready, lazy="chatbot" in LAZY_MODELS
+)
+MODEL_SLOTS = (disease_slot, pest_slot, chatbot_slot)
+
+def _queue_depths():
+    for name, scheduler in (("disease", disease_scheduler), ("pest", pest_scheduler)):
+        if scheduler is not None:
+            yield {"model": name}, scheduler.queue_depth
+
+def _in_flight():
+    yield {"endpoint": "http"}, metrics.http_in_flight
+    for endpoint, stats in executors.stats().items():
+        yield {"endpoint": endpoint}, stats["in_flight"]
+
+def _cache_stats():
+    caches = {"prediction": prediction_cache.stats()}
+    if chatbot is not None:
+        caches["embedding"] = chatbot.embeddings.stats()
+        if chatbot.answer_cache is not None:
+            caches["answer"] = chatbot.answer_cache.stats()
+    return caches
+
+metrics.gauge_callback("krishimitra_queue_depth", "Images waiting to be batched", _queue_depths)
+metrics.gauge_callback("krishimitra_in_flight", "Requests in flight per endpoint", _in_flight)
+metrics.gauge_callback(
+    "krishimitra_cache_hit_ratio", "Hit rate per cache",
+    lambda: (({"cache": name}, stats["hit_rate"]) for name, stats in _cache_stats().items())
+)
+metrics.gauge_callback(
+    "krishimitra_cache_entries", "Entries held per cache",
+    lambda: (({"cache": name}, stats["entries"]) for name, stats in _cache_stats().items())
+)
+metrics.gauge_callback(
+    "krishimitra_admission_waiting", "Requests waiting in each admission queue",
+    lambda: (({"endpoint": name}, queue.waiting) for name, queue in admission.queues.items())
+)
+metrics.gauge_callback(
+    "krishimitra_model_ready", "1 once a model or the chatbot is loaded and warm",
+    lambda: (({"model": slot.name}, int(slot.ready)) for slot in MODEL_SLOTS)
+)
+metrics.gauge_callback(
+    "krishimitra_chat_sessions", "Chat sessions held in memory",
+    lambda: [({}, chatbot.sessions.stats()["sessions"])] if chatbot is not None else []
+)
+
+async def _loaded(current, slot: ModelSlot) -> bool:
+    """True once a subsystem is available, loading it first if it is lazy"""
+    return current is not None or await slot.get() is not None
 
 @app.on_event("startup")
 async def startup_event():
-    """Initialize models on startup"""
-    global disease_model, pest_model, chatbot
-    try:
-        disease_model = DiseaseModel()
-        logger.info("Disease model initialized")
-    except Exception as e:
-        logger.error(f"Failed to initialize disease model: {e}")
-    
-    try:
-        pest_model = PestModel()
-        logger.info("Pest model initialized")
-    except Exception as e:
-        logger.error(f"Failed to initialize pest model: {e}")
-    
-    try:
-        chatbot = KrishiMitra()
-        logger.info("Chatbot initialized")
-    except Exception as e:
-        logger.error(f"Failed to initialize chatbot: {e}")
+    """Start loading models in the background; /health/ reports when each is ready"""
+    for slot in MODEL_SLOTS:
+        slot.start()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Stop background batching tasks and executors, and persist chat memory"""
+    for registry in MODEL_REGISTRIES.values():
+        await registry.stop_shadow()
+    for scheduler in (disease_scheduler, pest_scheduler):
+        if scheduler is not None:
+            await scheduler.stop()
+    if chatbot is not None:
+        await asyncio.to_thread(chatbot.close)
+    if model_server is not None:
+        model_server.close()
+    executors.shutdown()
 
 @app.get("/")
 async def root():
@@ -78,85 +363,428 @@ async def root():
         "endpoints": {
             "disease_prediction": "/disease-prediction/",
             "pest_prediction": "/pest-prediction/",
+            "disease_prediction_batch": "/disease-prediction/batch/",
+            "pest_prediction_batch": "/pest-prediction/batch/",
+            "crop_health": "/crop-health/",
             "chatbot": "/chatbot/",
+            "chatbot_stream": "/chatbot/stream/",
+            "chatbot_websocket": "/chatbot/ws/",
             "weather": "/weather/",
             "set_location": "/set-location/",
+            "chatbot_stats": "/chatbot/stats/",
+            "admission_stats": "/admission/stats/",
+            "metrics": "/metrics",
             "health": "/health/"
         }
     }
 
 @app.get("/health/")
 async def health_check():
-    """Health check endpoint"""
+    """Health check endpoint with per-model readiness and load times"""
     return {
         "status": "healthy",
+        # A lazy slot counts as ready until it has been tried, but not once it failed
+        "ready": all(slot.ready or (slot.lazy and not slot.error) for slot in MODEL_SLOTS),
         "disease_model": disease_model is not None,
         "pest_model": pest_model is not None,
-        "chatbot": chatbot is not None
+        "chatbot": chatbot is not None,
+        "models": {slot.name: slot.status() for slot in MODEL_SLOTS}
     }
 
+async def _cached_submit(scheduler: BatchScheduler, contents: bytes) -> dict:
+    """
+    Return a cached result for identical upload bytes, otherwise run the
+    model (and mirror the image to a shadow version, if one is set)
+    """
+    loop = asyncio.get_running_loop()
+    # Held (and counted as outstanding) for the whole request, so a hot-swap
+    # neither mixes up cache entries nor releases the model before the submit
+    model = scheduler.model
+    model_id = model_identity(model)
+    with scheduler.hold(model):
+        result = await loop.run_in_executor(executors.decode_executor, prediction_cache.get, contents, model_id)
+        if result is not None:
+            return result
+        
+        result = await scheduler.submit(contents, model)
+        if result.get("error") == DEADLINE_ERROR:
+            return result
+        await loop.run_in_executor(executors.decode_executor, prediction_cache.set, contents, model_id, result)
+    MODEL_REGISTRIES[scheduler.name].mirror(contents, result)
+    return result
+
+async def _predict_upload(scheduler: BatchScheduler, contents: bytes, tta: Optional[int]) -> dict:
+    """
+    Single-crop prediction through the micro-batcher, or a test-time
+    augmentation prediction whose views run as one forward pass.
+
+    TTA falls back to fewer views (or one) when the batch queue is busy or
+    the measured per-view cost would exceed TTA_BUDGET_MS.
+    """
+    model = scheduler.model
+    requested = model.tta_views if tta is None else tta
+    views, fallback = model.tta.plan(requested, load=scheduler.queue_depth)
+    if views <= 1:
+        result = await _cached_submit(scheduler, contents)
+    else:
+        loop = asyncio.get_running_loop()
+        model_id = f"{model_identity(model)}:tta{views}"
+        # Held as outstanding from the cache lookup on, so a hot-swap does not release the model mid-pass
+        with scheduler.hold(model):
+            result = await loop.run_in_executor(executors.decode_executor, prediction_cache.get, contents, model_id)
+            if result is None:
+                try:
+                    with model.tta.track(views):
+                        views_array = await loop.run_in_executor(
+                            executors.decode_executor, model.preprocess_views, contents, views
+                        )
+                        result = await loop.run_in_executor(executors.inference_executor, model.predict_views, views_array)
+                except ModelReleased as e:
+                    if scheduler.model is model:
+                        logger.error(f"Prediction error: {e}")
+                        return {"success": False, "error": str(e)}
+                    # Released by a hot-swap during the pass: run again on the current version
+                    return await _predict_upload(scheduler, contents, tta)
+                except Exception as e:
+                    logger.error(f"Prediction error: {e}")
+                    return {"success": False, "error": str(e)}
+                await loop.run_in_executor(executors.decode_executor, prediction_cache.set, contents, model_id, result)
+    
+    if requested > 1:
+        # Copy, so the cached result is left untouched
+        result = {**result, "tta": {"requested": requested, "views": views, "fallback": fallback}}
+    return result
+
 @app.post("/disease-prediction/")
-async def disease_prediction(file: UploadFile = File(...)):
-    """Predict plant disease from uploaded image"""
-    if disease_model is None:
+async def disease_prediction(
+    file: UploadFile = File(...),
+    tta: Optional[int] = Query(None, ge=1, le=len(TTA_VIEWS), description="Test-time augmentation views (1 = single crop)")
+):
+    """Predict plant disease from uploaded image, optionally averaging several crops and flips"""
+    if not await _loaded(disease_scheduler, disease_slot):
         raise HTTPException(status_code=503, detail="Disease model not initialized")
     
     try:
-        contents = await file.read()
-        result = disease_model.predict(contents)
+        async with executors.limit("disease"):
+            with metrics.time("upload_read", component="disease"):
+                contents = await read_upload(file, UPLOAD_MAX_FILE_BYTES)
+            result = await _predict_upload(disease_scheduler, contents, tta)
         return JSONResponse(content=result)
+    except UploadLimitError as e:
+        raise HTTPException(status_code=413, detail=str(e))
     except Exception as e:
         logger.error(f"Disease prediction error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/pest-prediction/")
-async def pest_prediction(file: UploadFile = File(...)):
-    """Predict pest type from uploaded image"""
-    if pest_model is None:
+async def pest_prediction(
+    file: UploadFile = File(...),
+    tta: Optional[int] = Query(None, ge=1, le=len(TTA_VIEWS), description="Test-time augmentation views (1 = single crop)")
+):
+    """Predict pest type from uploaded image, optionally averaging several crops and flips"""
+    if not await _loaded(pest_scheduler, pest_slot):
         raise HTTPException(status_code=503, detail="Pest model not initialized")
     
     try:
-        contents = await file.read()
-        result = pest_model.predict(contents)
+        async with executors.limit("pest"):
+            with metrics.time("upload_read", component="pest"):
+                contents = await read_upload(file, UPLOAD_MAX_FILE_BYTES)
+            result = await _predict_upload(pest_scheduler, contents, tta)
         return JSONResponse(content=result)
+    except UploadLimitError as e:
+        raise HTTPException(status_code=413, detail=str(e))
     except Exception as e:
         logger.error(f"Pest prediction error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+async def _predict_uploads(scheduler: BatchScheduler, files: List[UploadFile]) -> JSONResponse:
+    """Run a multi-file (or zip) upload through a single batched forward pass"""
+    loop = asyncio.get_running_loop()
+    try:
+        with metrics.time("upload_read", component=f"{scheduler.name}_batch"):
+            uploads = await read_uploads(files, UPLOAD_MAX_FILE_BYTES, BATCH_UPLOAD_MAX_TOTAL_BYTES)
+        images = await loop.run_in_executor(
+            executors.decode_executor, expand_uploads, uploads,
+            BATCH_UPLOAD_MAX_FILES, BATCH_UPLOAD_MAX_TOTAL_BYTES, UPLOAD_MAX_FILE_BYTES
+        )
+    except UploadLimitError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    
+    model = scheduler.model
+    model_id = model_identity(model)
+    with scheduler.hold(model):
+        results = await loop.run_in_executor(
+            executors.decode_executor,
+            lambda: [prediction_cache.get(contents, model_id) for _, contents in images]
+        )
+        misses = [i for i, result in enumerate(results) if result is None]
+        if misses:
+            predictions = await scheduler.submit_many([images[i][1] for i in misses], model)
+            for i, result in zip(misses, predictions):
+                results[i] = result
+            await loop.run_in_executor(
+                executors.decode_executor,
+                lambda: [prediction_cache.set(images[i][1], model_id, results[i]) for i in misses]
+            )
+    
+    return JSONResponse(content={
+        "success": True,
+        "count": len(results),
+        "results": [
+            {"filename": filename, **result}
+            for (filename, _), result in zip(images, results)
+        ]
+    })
+
+@app.post("/disease-prediction/batch/")
+async def disease_prediction_batch(files: List[UploadFile] = File(...)):
+    """Predict plant diseases for many uploaded images or zip archives at once"""
+    if not await _loaded(disease_scheduler, disease_slot):
+        raise HTTPException(status_code=503, detail="Disease model not initialized")
+    
+    try:
+        async with executors.limit("disease"):
+            return await _predict_uploads(disease_scheduler, files)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Batch disease prediction error: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/pest-prediction/batch/")
+async def pest_prediction_batch(files: List[UploadFile] = File(...)):
+    """Predict pest types for many uploaded images or zip archives at once"""
+    if not await _loaded(pest_scheduler, pest_slot):
+        raise HTTPException(status_code=503, detail="Pest model not initialized")
+    
+    try:
+        async with executors.limit("pest"):
+            return await _predict_uploads(pest_scheduler, files)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Batch pest prediction error: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+async def _diagnose(contents: bytes) -> List[dict]:
+    """Disease and pest results for one image, decoding it once for both models"""
+    loop = asyncio.get_running_loop()
+    schedulers = (disease_scheduler, pest_scheduler)
+    models = [scheduler.model for scheduler in schedulers]
+    # Both models are held as outstanding until their results are cached
+    with schedulers[0].hold(models[0]), schedulers[1].hold(models[1]):
+        model_ids = [model_identity(model) for model in models]
+        results = await loop.run_in_executor(
+            executors.decode_executor,
+            lambda: [prediction_cache.get(contents, model_id) for model_id in model_ids]
+        )
+        misses = [i for i, result in enumerate(results) if result is None]
+        if not misses:
+            return results
+        
+        specs = [models[i].input_spec for i in misses]
+        try:
+            inputs = await loop.run_in_executor(executors.decode_executor, preprocess_multi, contents, specs)
+        except Exception as e:
+            logger.error(f"Error preprocessing image: {e}")
+            for i in misses:
+                results[i] = {"success": False, "error": f"Failed to preprocess image: {str(e)}"}
+            return results
+        
+        # Both models' inputs join their schedulers' next batches concurrently
+        predictions = await asyncio.gather(*[
+            schedulers[i].submit_array(inputs[spec.name], models[i]) for i, spec in zip(misses, specs)
+        ])
+        for i, result in zip(misses, predictions):
+            results[i] = result
+        await loop.run_in_executor(
+            executors.decode_executor,
+            lambda: [prediction_cache.set(contents, model_ids[i], results[i]) for i in misses if results[i].get("error") != DEADLINE_ERROR]
+        )
+        return results
+
+@app.post("/crop-health/")
+async def crop_health(file: UploadFile = File(...)):
+    """Diagnose plant disease and pests from one uploaded image"""
+    if not await _loaded(disease_scheduler, disease_slot):
+        raise HTTPException(status_code=503, detail="Disease model not initialized")
+    if not await _loaded(pest_scheduler, pest_slot):
+        raise HTTPException(status_code=503, detail="Pest model not initialized")
+    
+    try:
+        async with executors.limit("crop_health"):
+            with metrics.time("upload_read", component="crop_health"):
+                contents = await read_upload(file, UPLOAD_MAX_FILE_BYTES)
+            disease_result, pest_result = await _diagnose(contents)
+        return JSONResponse(content={
+            "success": disease_result.get("success", False) or pest_result.get("success", False),
+            "disease": disease_result,
+            "pest": pest_result,
+            "summary": summarize_diagnosis(
+                disease_result,
+                pest_result,
+                disease_threshold=DIAGNOSIS_DISEASE_THRESHOLD,
+                pest_threshold=DIAGNOSIS_PEST_THRESHOLD
+            )
+        })
+    except UploadLimitError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except Exception as e:
+        logger.error(f"Crop health error: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+def _llm_unavailable(error: LLMError) -> HTTPException:
+    """504 when the LLM timed out, 503 when it is overloaded or failing"""
+    logger.error(f"Chatbot LLM error: {error}")
+    return HTTPException(
+        status_code=504 if isinstance(error, LLMTimeout) else 503,
+        detail=str(error),
+        headers={"Retry-After": str(error.retry_after)}
+    )
+
 @app.post("/chatbot/")
-async def chatbot_endpoint(chat_query: ChatQuery):
+async def chatbot_endpoint(request: Request, chat_query: ChatQuery, x_session_id: Optional[str] = Header(None)):
     """Chat with Krishi Mitra assistant"""
-    if chatbot is None:
+    if not await _loaded(chatbot, chatbot_slot):
         raise HTTPException(status_code=503, detail="Chatbot not initialized")
     
     try:
-        response = chatbot.ask(chat_query.query)
-        return JSONResponse(content={"response": response})
+        session_id = _session_id(request, chat_query.session_id, x_session_id)
+        response = await executors.run_io("chatbot", chatbot.ask, chat_query.query, session_id)
+        return JSONResponse(content={"response": response, "session_id": session_id})
+    except LLMError as e:
+        raise _llm_unavailable(e)
     except Exception as e:
         logger.error(f"Chatbot error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/chatbot/")
-async def chatbot_get(query: str = Query(..., description="User query")):
+async def chatbot_get(
+    request: Request,
+    query: str = Query(..., description="User query"),
+    session_id: Optional[str] = Query(None, description="Chat session id"),
+    x_session_id: Optional[str] = Header(None)
+):
     """Chat with Krishi Mitra assistant (GET method)"""
-    if chatbot is None:
+    if not await _loaded(chatbot, chatbot_slot):
         raise HTTPException(status_code=503, detail="Chatbot not initialized")
     
     try:
-        response = chatbot.ask(query)
-        return JSONResponse(content={"response": response})
+        session_id = _session_id(request, session_id, x_session_id)
+        response = await executors.run_io("chatbot", chatbot.ask, query, session_id)
+        return JSONResponse(content={"response": response, "session_id": session_id})
+    except LLMError as e:
+        raise _llm_unavailable(e)
     except Exception as e:
         logger.error(f"Chatbot error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+def _sse(event: str, data: dict) -> str:
+    """Format one server-sent event"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+async def _stream_answer(request: Request, query: str, session_id: str):
+    """Yield the answer as "token" events followed by a "done" event"""
+    async with executors.limit("chatbot"):
+        # aclosing() stops the chain (and skips saving memory) if we leave early
+        async with aclosing(chatbot.astream(query, session_id)) as stream:
+            try:
+                async for chunk in stream:
+                    if await request.is_disconnected():
+                        logger.info(f"Client disconnected from chat stream (session {session_id})")
+                        return
+                    yield _sse("token", {"text": chunk})
+                yield _sse("done", {"session_id": session_id})
+            except Exception as e:
+                logger.error(f"Chatbot stream error: {e}")
+                yield _sse("error", {"detail": str(e)})
+
+def _event_stream(generator) -> StreamingResponse:
+    return StreamingResponse(
+        generator,
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.post("/chatbot/stream/")
+async def chatbot_stream(request: Request, chat_query: ChatQuery, x_session_id: Optional[str] = Header(None)):
+    """Chat with Krishi Mitra assistant, streaming the answer as server-sent events"""
+    if not await _loaded(chatbot, chatbot_slot):
+        raise HTTPException(status_code=503, detail="Chatbot not initialized")
+    
+    session_id = _session_id(request, chat_query.session_id, x_session_id)
+    return _event_stream(_stream_answer(request, chat_query.query, session_id))
+
+@app.get("/chatbot/stream/")
+async def chatbot_stream_get(
+    request: Request,
+    query: str = Query(..., description="User query"),
+    session_id: Optional[str] = Query(None, description="Chat session id"),
+    x_session_id: Optional[str] = Header(None)
+):
+    """Chat with Krishi Mitra assistant, streaming the answer as server-sent events (GET method)"""
+    if not await _loaded(chatbot, chatbot_slot):
+        raise HTTPException(status_code=503, detail="Chatbot not initialized")
+    
+    return _event_stream(_stream_answer(request, query, _session_id(request, session_id, x_session_id)))
+
+def _admit_message():
+    """Admission for one WebSocket chat message, through the same queue as the HTTP chat routes"""
+    queue = admission.queue_for("WEBSOCKET", "/chatbot/ws/")
+    return queue.admit(kind="/chatbot/ws/") if queue is not None else nullcontext()
+
+@app.websocket("/chatbot/ws/")
+async def chatbot_websocket(websocket: WebSocket):
+    """Chat over a WebSocket: send {"query", "session_id"}, receive token messages then a done message"""
+    # Messages without a session id use the connection's: its header, its cookie, or a new cookie
+    connection_session_id = websocket.headers.get("x-session-id") or websocket.cookies.get(SESSION_COOKIE)
+    if connection_session_id:
+        await websocket.accept()
+    else:
+        connection_session_id = new_session_id()
+        await websocket.accept(headers=[(b"set-cookie", session_cookie(connection_session_id))])
+    if not await _loaded(chatbot, chatbot_slot):
+        await websocket.close(code=1013, reason="Chatbot not initialized")
+        return
+    
+    try:
+        while True:
+            message = await websocket.receive_json()
+            session_id = message.get("session_id") or connection_session_id
+            try:
+                async with _admit_message():
+                    async with executors.limit("chatbot"):
+                        async with aclosing(chatbot.astream(message["query"], session_id)) as stream:
+                            async for chunk in stream:
+                                await websocket.send_json({"type": "token", "text": chunk})
+                await websocket.send_json({"type": "done", "session_id": session_id})
+            except AdmissionRejected as e:
+                # The connection stays open; the client may retry the message later
+                await websocket.send_json({
+                    "type": "error", "detail": str(e), "reason": e.reason, "retry_after": e.retry_after
+                })
+            except WebSocketDisconnect:
+                raise
+            except Exception as e:
+                logger.error(f"Chatbot websocket error: {e}")
+                await websocket.send_json({"type": "error", "detail": str(e)})
+    except WebSocketDisconnect:
+        logger.info("Chat websocket disconnected")
+
 @app.get("/weather/")
-async def get_weather():
-    """Get current weather data for the set location"""
-    if chatbot is None:
+async def get_weather(
+    request: Request,
+    session_id: Optional[str] = Query(None, description="Chat session id"),
+    x_session_id: Optional[str] = Header(None)
+):
+    """Get current weather data for the session's location"""
+    if not await _loaded(chatbot, chatbot_slot):
         raise HTTPException(status_code=503, detail="Chatbot not initialized")
     
     try:
-        weather_data = chatbot.get_weather_data()
+        weather_data = await executors.run_priority(
+            "weather", chatbot.get_weather_data, None, _session_id(request, session_id, x_session_id)
+        )
         if weather_data:
             return JSONResponse(content=weather_data)
         else:
@@ -168,11 +796,11 @@ async def get_weather():
 @app.get("/weather/{location}")
 async def get_weather_by_location(location: str):
     """Get weather data for a specific location"""
-    if chatbot is None:
+    if not await _loaded(chatbot, chatbot_slot):
         raise HTTPException(status_code=503, detail="Chatbot not initialized")
     
     try:
-        weather_data = chatbot.get_weather_data(location)
+        weather_data = await executors.run_priority("weather", chatbot.get_weather_data, location)
         if weather_data:
             return JSONResponse(content=weather_data)
         else:
@@ -182,34 +810,73 @@ async def get_weather_by_location(location: str):
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.put("/set-location/")
-async def set_location(location_data: LocationUpdate):
+async def set_location(request: Request, location_data: LocationUpdate, x_session_id: Optional[str] = Header(None)):
     """Set location for weather and chatbot context"""
-    if chatbot is None:
+    if not await _loaded(chatbot, chatbot_slot):
         raise HTTPException(status_code=503, detail="Chatbot not initialized")
     
     try:
-        chatbot.update_location(location_data.location)
+        session_id = _session_id(request, location_data.session_id, x_session_id)
+        await executors.run_priority("weather", chatbot.update_location, location_data.location, session_id)
         return JSONResponse(content={
             "message": f"Location updated to {location_data.location}",
-            "location": location_data.location
+            "location": location_data.location,
+            "session_id": session_id
         })
     except Exception as e:
         logger.error(f"Location update error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/clear-memory/")
-async def clear_chatbot_memory():
-    """Clear chatbot conversation memory"""
-    if chatbot is None:
+async def clear_chatbot_memory(
+    request: Request,
+    session_id: Optional[str] = Query(None, description="Chat session id"),
+    x_session_id: Optional[str] = Header(None)
+):
+    """Clear chatbot conversation memory for one session"""
+    if not await _loaded(chatbot, chatbot_slot):
         raise HTTPException(status_code=503, detail="Chatbot not initialized")
     
     try:
-        chatbot.clear_memory()
+        await executors.run_io("chatbot", chatbot.clear_memory, _session_id(request, session_id, x_session_id))
         return JSONResponse(content={"message": "Memory cleared successfully"})
     except Exception as e:
         logger.error(f"Memory clear error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/chatbot/stats/")
+async def get_chatbot_stats():
+    """Get chat session, memory, prompt size, embedding, answer and weather cache, and LLM client statistics"""
+    if chatbot is None:
+        raise HTTPException(status_code=503, detail="Chatbot not initialized")
+    
+    return {
+        "sessions": chatbot.sessions.stats(),
+        "memory": {
+            "mode": chatbot.memory_mode,
+            "token_budget": chatbot.memory_token_budget,
+            "summary_budget": chatbot.memory_summary_budget,
+            "index": chatbot.memory_index.stats()
+        },
+        "prompt_tokens": chatbot.token_stats.stats(),
+        "embeddings": chatbot.embeddings.stats(),
+        "answer_cache": chatbot.answer_cache.stats() if chatbot.answer_cache is not None else None,
+        "weather_cache": chatbot.weather_client.stats(),
+        "llm": chatbot.llm_client.stats()
+    }
+
+@app.get("/admission/stats/")
+async def get_admission_stats():
+    """Get admission queue depth, running requests, service time and shed requests per endpoint"""
+    return admission.stats()
+
+@app.get("/metrics")
+async def get_metrics():
+    """Metrics in the Prometheus text exposition format"""
+    if not metrics.enabled:
+        raise HTTPException(status_code=404, detail="Metrics are disabled")
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
 @app.get("/models/info/")
 async def get_models_info():
     """Get information about loaded models"""
@@ -217,16 +884,84 @@ async def get_models_info():
         "disease_model": {
             "loaded": disease_model is not None,
             "classes": len(disease_model.class_names) if disease_model else 0,
-            "target_size": disease_model.target_size if disease_model else None
+            "target_size": disease_model.target_size if disease_model else None,
+            "runner": disease_model.runner_name if disease_model else None,
+            "versions": disease_registry.stats(),
+            "tta": disease_model.tta.stats() if disease_model else None,
+            "cascade": disease_model.cascade.stats() if disease_model and disease_model.cascade else None,
+            "batching": {
+                "max_batch_size": BATCH_MAX_SIZE,
+                "max_wait_ms": BATCH_MAX_WAIT_MS,
+                "queue_depth": disease_scheduler.queue_depth if disease_scheduler else 0
+            }
         },
         "pest_model": {
             "loaded": pest_model is not None,
             "classes": len(pest_model.class_names) if pest_model else 0,
             "class_names": pest_model.class_names if pest_model else [],
-            "target_size": pest_model.target_size if pest_model else None
-        }
+            "target_size": pest_model.target_size if pest_model else None,
+            "runner": pest_model.runner_name if pest_model else None,
+            "versions": pest_registry.stats(),
+            "tta": pest_model.tta.stats() if pest_model else None,
+            "cascade": pest_model.cascade.stats() if pest_model and pest_model.cascade else None,
+            "batching": {
+                "max_batch_size": BATCH_MAX_SIZE,
+                "max_wait_ms": BATCH_MAX_WAIT_MS,
+                "queue_depth": pest_scheduler.queue_depth if pest_scheduler else 0
+            }
+        },
+        "prediction_cache": prediction_cache.stats(),
+        "model_server": model_server.socket_path if model_server is not None else None
     }
 
+async def _registry(name: str, x_admin_token: Optional[str]) -> ModelRegistry:
+    """The registry of a loaded model, after checking the admin token"""
+    if not MODEL_ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Model administration is disabled (set MODEL_ADMIN_TOKEN)")
+    if x_admin_token != MODEL_ADMIN_TOKEN:
+        raise HTTPException(status_code=401, detail="Invalid admin token")
+    if name not in MODEL_REGISTRIES:
+        raise HTTPException(status_code=404, detail=f"Unknown model: {name}")
+    slot = disease_slot if name == "disease" else pest_slot
+    if await slot.get() is None:
+        raise HTTPException(status_code=503, detail=f"{name} model not initialized")
+    return MODEL_REGISTRIES[name]
+
+@app.post("/models/{name}/versions/", status_code=202)
+async def deploy_model_version(name: str, deployment: ModelDeployment, x_admin_token: Optional[str] = Header(None)):
+    """Load a new model version in the background, then switch to it (or shadow it with shadow_percent)"""
+    registry = await _registry(name, x_admin_token)
+    if not os.path.isfile(deployment.path):
+        raise HTTPException(status_code=400, detail=f"Model file not found: {deployment.path}")
+    if deployment.shadow_percent is not None and not 0 <= deployment.shadow_percent <= 100:
+        raise HTTPException(status_code=422, detail="shadow_percent must be between 0 and 100")
+    
+    try:
+        version = registry.deploy(deployment.path, deployment.version, deployment.shadow_percent)
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return version.stats()
+
+@app.post("/models/{name}/versions/{version}/activate/")
+async def activate_model_version(name: str, version: str, x_admin_token: Optional[str] = Header(None)):
+    """Switch traffic to a model version (e.g. promote the shadow, or roll back)"""
+    registry = await _registry(name, x_admin_token)
+    if version not in registry.versions:
+        raise HTTPException(status_code=404, detail=f"Unknown {name} version: {version}")
+    
+    try:
+        return (await registry.activate(version)).stats()
+    except Exception as e:
+        logger.error(f"Model activation error: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.delete("/models/{name}/shadow/")
+async def stop_model_shadow(name: str, x_admin_token: Optional[str] = Header(None)):
+    """Stop mirroring traffic to the shadow version"""
+    registry = await _registry(name, x_admin_token)
+    await registry.stop_shadow()
+    return registry.stats()
+
 if __name__ == "__main__":
     port = int(os.environ.get("PORT", 8000))
     # uvicorn.run("main:app", host="0.0.0.0", port=port, reload=True)     # for using across multiple devices
@@ -0,0 +1,64 @@
+"""
+Serve the disease and pest classifiers and the MiniLM embedder to several
+API worker processes on the same machine.
+
+Without it, every uvicorn worker loads TensorFlow, both classifiers and
+MiniLM into its own memory. Start one model server (or a few, for more
+inference parallelism), then run the API workers with MODEL_SERVER_SOCKET
+pointing at it: they decode and preprocess images themselves and send the
+tensors to the server through a shared-memory ring, without loading any
+model. See src/model_server.py for the protocol.
+
+Usage (from the repository root):
+    python Backend/model_server.py --socket /tmp/krishimitra-models.sock &
+    MODEL_SERVER_SOCKET=/tmp/krishimitra-models.sock uvicorn main:app --app-dir Backend --workers 4
+
+    # Two servers; workers are spread over them by process id
+    python Backend/model_server.py --socket /tmp/models-a.sock &
+    python Backend/model_server.py --socket /tmp/models-b.sock &
+    MODEL_SERVER_SOCKET=/tmp/models-a.sock,/tmp/models-b.sock uvicorn main:app --app-dir Backend --workers 8
+
+Model files, runners, cascades and TTA limits are configured with the usual
+environment variables (DISEASE_MODEL_PATH, MODEL_RUNNER, ...) on the server.
+"""
+import argparse
+import os
+import signal
+import threading
+
+from dotenv import load_dotenv
+
+from src.model_server import ModelServer, minilm_embeddings
+
+load_dotenv()
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument(
+        "--socket", default=os.environ.get("MODEL_SERVER_SOCKET", "/tmp/krishimitra-models.sock"),
+        help="Unix domain socket to listen on"
+    )
+    parser.add_argument(
+        "--inference-workers", type=int, default=int(os.environ.get("INFERENCE_WORKERS", 1)),
+        help="Forward passes run at once"
+    )
+    parser.add_argument("--preload", default="disease,pest", help="Models loaded before accepting workers ('' for none)")
+    parser.add_argument("--no-embeddings", action="store_true", help="Do not serve the MiniLM embedder")
+    args = parser.parse_args()
+
+    server = ModelServer(
+        args.socket,
+        inference_workers=args.inference_workers,
+        embeddings_factory=None if args.no_embeddings else minilm_embeddings
+    )
+    # serve_forever blocks, so shut down from another thread on SIGTERM
+    signal.signal(signal.SIGTERM, lambda *_: threading.Thread(target=server.shutdown).start())
+    try:
+        server.serve_forever(preload=tuple(name for name in args.preload.split(",") if name))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main_cli()
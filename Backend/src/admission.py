@@ -0,0 +1,390 @@
+import asyncio
+import heapq
+import itertools
+import json
+import math
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import Dict, Optional, Tuple
+import logging
+
+from src.metrics import metrics
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Request header with the client's remaining time budget in milliseconds
+TIMEOUT_HEADER = b"x-request-timeout-ms"
+REJECT_REASONS = ("queue_full", "deadline", "expired")
+
+# Event loop time by which the request being handled must finish; set by
+# AdmissionMiddleware so later stages (e.g. the batch scheduler) can skip
+# work for requests whose client has already given up
+request_deadline: ContextVar[Optional[float]] = ContextVar("request_deadline", default=None)
+
+admission_rejected = metrics.counter(
+    "krishimitra_admission_rejected_total", "Requests shed by admission control, by endpoint and reason"
+)
+
+
+def content_length(scope) -> Optional[int]:
+    """The request's Content-Length header, None when absent or invalid"""
+    for name, value in scope.get("headers", []):
+        if name == b"content-length":
+            try:
+                return int(value)
+            except ValueError:
+                return None
+    return None
+
+
+class AdmissionRejected(Exception):
+    """A request was not admitted; retry_after is a hint in whole seconds"""
+
+    def __init__(self, endpoint: str, reason: str, retry_after: int):
+        self.endpoint = endpoint
+        self.reason = reason
+        self.retry_after = retry_after
+        super().__init__(f"{endpoint} is overloaded ({reason}), retry in {retry_after}s")
+
+
+class EndpointQueue:
+    """
+    Bounded, deadline-ordered work queue in front of one endpoint.
+
+    Up to `concurrency` requests run at once and up to `queue_size` wait,
+    earliest deadline first. A request is turned away immediately when the
+    queue is full, or when the measured service time says it would not
+    finish before its deadline; waiting requests whose deadline passes are
+    dropped instead of being run for a client that has given up.
+
+    A request may cost several units of concurrency (e.g. a batch upload
+    counts each image); it starts once that many units are free. The
+    service time per unit is tracked separately for each kind of request
+    (the route), since a batch image and a single upload cost differently.
+    """
+
+    def __init__(self, name: str, concurrency: int, queue_size: int, timeout: float, smoothing: float = 0.2):
+        """
+        Args:
+            name: Endpoint name used in stats, metrics and logs
+            concurrency: Requests allowed to run at once
+            queue_size: Requests allowed to wait for a slot
+            timeout: Deadline (seconds) of requests that do not send one
+            smoothing: Weight of the newest sample in the service time average
+        """
+        self.name = name
+        self.concurrency = max(1, concurrency)
+        self.queue_size = max(0, queue_size)
+        self.timeout = timeout
+        self.smoothing = smoothing
+        # Request kind (route path) -> seconds per unit
+        self.service_times: Dict[str, float] = {}
+        self.active = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.rejected = {reason: 0 for reason in REJECT_REASONS}
+        # Estimated seconds of work waiting in the queue
+        self._queued_work = 0.0
+        self._waiters = []
+        self._order = itertools.count()
+
+    def service_time(self, kind: str = "") -> Optional[float]:
+        """Seconds per unit of a `kind` request; kinds not measured yet borrow the slowest measured one"""
+        if kind in self.service_times:
+            return self.service_times[kind]
+        return max(self.service_times.values()) if self.service_times else None
+
+    def retry_after(self) -> int:
+        """Seconds until the work ahead of a new request should have drained"""
+        per_unit = sum(self.service_times.values()) / len(self.service_times) if self.service_times else 1.0
+        backlog = (self.active * per_unit + self._queued_work) / self.concurrency
+        return max(1, min(60, math.ceil(backlog)))
+
+    def _reject(self, reason: str) -> AdmissionRejected:
+        self.rejected[reason] += 1
+        if metrics.enabled:
+            admission_rejected.inc(endpoint=self.name, reason=reason)
+        return AdmissionRejected(self.name, reason, self.retry_after())
+
+    def units(self, cost: int) -> int:
+        """Units a request of `cost` takes; capped, so that it can always run on its own"""
+        return max(1, min(int(cost), self.concurrency))
+
+    async def acquire(self, timeout: Optional[float] = None, cost: int = 1, kind: str = "") -> float:
+        """
+        Wait for a slot
+
+        Args:
+            timeout: Client's remaining budget in seconds (default: the endpoint's timeout)
+            cost: Units of concurrency the request takes (see units())
+            kind: Request kind its service time is tracked under, e.g. the route path
+        Returns: The request's deadline in event loop time
+        Raises: AdmissionRejected when the request is not admitted
+        """
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        deadline = now + (self.timeout if timeout is None else timeout)
+        if deadline <= now:
+            raise self._reject("expired")
+
+        cost = self.units(cost)
+        free = self.active + cost <= self.concurrency and not self.waiting
+        if not free and self.waiting >= self.queue_size:
+            raise self._reject("queue_full")
+        service_time = self.service_time(kind)
+        work = cost * (service_time or 1.0)
+        # Only judged while requests are running, so the service time estimate
+        # keeps being refreshed and cannot lock the endpoint out
+        if service_time is not None and self.active:
+            # Everyone ahead has to clear before this request starts
+            expected_wait = 0.0 if free else (self._queued_work + work) / self.concurrency
+            if now + expected_wait + work > deadline:
+                raise self._reject("deadline")
+        if free:
+            self.active += cost
+            self.admitted += 1
+            return deadline
+
+        future = loop.create_future()
+        heapq.heappush(self._waiters, (deadline, next(self._order), future, cost))
+        self.waiting += 1
+        self._queued_work += work
+        try:
+            await asyncio.wait_for(future, deadline - now)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if future.done() and not future.cancelled() and future.exception() is None:
+                # The units were handed over just as the wait ended; pass them on
+                self._release_units(cost)
+            if isinstance(e, asyncio.TimeoutError):
+                raise self._reject("expired")
+            raise
+        finally:
+            self.waiting -= 1
+            self._queued_work -= work
+        self.admitted += 1
+        return deadline
+
+    def release(self, elapsed: float, cost: int = 1, kind: str = ""):
+        """Free a request's units and record how long it ran per unit, for its kind"""
+        cost = self.units(cost)
+        elapsed /= cost
+        previous = self.service_times.get(kind)
+        self.service_times[kind] = elapsed if previous is None else (
+            self.smoothing * elapsed + (1 - self.smoothing) * previous
+        )
+        self._release_units(cost)
+
+    def _release_units(self, cost: int):
+        self.active -= cost
+        now = asyncio.get_running_loop().time()
+        while self._waiters:
+            deadline, _, future, units = self._waiters[0]
+            if future.done():
+                heapq.heappop(self._waiters)
+                continue
+            if deadline <= now:
+                heapq.heappop(self._waiters)
+                future.set_exception(self._reject("expired"))
+                continue
+            if self.active + units > self.concurrency:
+                # Earliest deadline first: later requests wait even if they would fit
+                return
+            heapq.heappop(self._waiters)
+            self.active += units
+            future.set_result(None)
+
+    @asynccontextmanager
+    async def admit(self, timeout: Optional[float] = None, cost: int = 1, kind: str = ""):
+        """
+        Hold a slot for the block, with request_deadline set for later stages
+
+        Raises: AdmissionRejected when the request is not admitted
+        """
+        deadline = await self.acquire(timeout, cost, kind)
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        token = request_deadline.set(deadline)
+        try:
+            yield deadline
+        finally:
+            request_deadline.reset(token)
+            self.release(loop.time() - start, cost, kind)
+
+    def stats(self) -> Dict:
+        return {
+            "concurrency": self.concurrency,
+            "queue_size": self.queue_size,
+            "timeout_s": self.timeout,
+            "active": self.active,
+            "waiting": self.waiting,
+            "admitted": self.admitted,
+            "rejected": dict(self.rejected),
+            "service_ms": {kind: round(seconds * 1000, 2) for kind, seconds in self.service_times.items()}
+        }
+
+
+class AdmissionControl:
+    """
+    Admission queues of the heavy endpoints and the routes that use them.
+
+    Routes that are not listed (health, weather, stats) are never queued,
+    which makes them the priority lane: they stay responsive while inference
+    or chat is saturated.
+    """
+
+    def __init__(
+        self,
+        queues: Dict[str, EndpointQueue],
+        routes: Dict[Tuple[str, str], str],
+        enabled: bool = True,
+        upload_costs: Optional[Dict[Tuple[str, str], int]] = None
+    ):
+        """
+        Args:
+            queues: Endpoint name -> EndpointQueue
+            routes: (method, path) -> endpoint name
+            enabled: False lets every request straight through
+            upload_costs: (method, path) -> request body bytes per unit of cost, for
+                routes whose work grows with the upload (e.g. batch predictions)
+        """
+        self.queues = queues
+        self.routes = routes
+        self.enabled = enabled
+        self.upload_costs = dict(upload_costs or {})
+        logger.info(
+            "Admission control: " + ", ".join(
+                f"{name}(concurrency={queue.concurrency}, queue={queue.queue_size}, timeout={queue.timeout:g}s)"
+                for name, queue in queues.items()
+            ) + ("" if enabled else " (disabled)")
+        )
+
+    def queue_for(self, method: str, path: str) -> Optional[EndpointQueue]:
+        if not self.enabled:
+            return None
+        return self.queues.get(self.routes.get((method, path)))
+
+    def cost(self, scope) -> int:
+        """
+        Units a request takes: 1, or for upload_costs routes its body size in units
+
+        The body has not been parsed at admission, so the Content-Length stands
+        in for the number of images; without one the request counts as large.
+        """
+        unit_bytes = self.upload_costs.get((scope.get("method"), scope["path"]))
+        if not unit_bytes:
+            return 1
+        length = content_length(scope)
+        return max(1, math.ceil(length / unit_bytes)) if length is not None else 2 ** 31
+
+    def stats(self) -> Dict:
+        return {"enabled": self.enabled, "endpoints": {name: queue.stats() for name, queue in self.queues.items()}}
+
+
+def create_admission(
+    routes: Dict[Tuple[str, str], str],
+    concurrency: Dict[str, int],
+    queue_sizes: Dict[str, int],
+    timeouts: Dict[str, int],
+    enabled: bool = True,
+    upload_costs: Optional[Dict[Tuple[str, str], int]] = None
+) -> AdmissionControl:
+    """
+    One EndpointQueue per endpoint named in `routes`
+
+    Args:
+        routes: (method, path) -> endpoint name
+        concurrency: Endpoint -> requests allowed to run at once (default: 8)
+        queue_sizes: Endpoint -> waiting requests (default: twice the concurrency)
+        timeouts: Endpoint -> deadline in seconds for requests without one (default: 30)
+        enabled: False lets every request straight through
+        upload_costs: (method, path) -> request body bytes per unit of cost
+    Returns: AdmissionControl
+    """
+    queues = {}
+    for name in dict.fromkeys(routes.values()):
+        limit = concurrency.get(name, 8)
+        queues[name] = EndpointQueue(name, limit, queue_sizes.get(name, 2 * limit), float(timeouts.get(name, 30)))
+    return AdmissionControl(queues, routes, enabled=enabled, upload_costs=upload_costs)
+
+
+class AdmissionMiddleware:
+    """
+    ASGI middleware that admits requests to queued routes before the
+    request body is parsed.
+
+    Rejected requests get a 503 with Retry-After straight away, without
+    parsing the upload or touching the models. Clients can send their remaining time budget in
+    an X-Request-Timeout-Ms header.
+    """
+
+    def __init__(self, app, control: AdmissionControl, drain_bytes: int = 256 * 1024):
+        """
+        Args:
+            app: ASGI application
+            control: Admission queues and routes
+            drain_bytes: Largest request body read (and discarded) before a
+                rejection; larger or unsized bodies are not read at all and
+                the connection is closed instead
+        """
+        self.app = app
+        self.control = control
+        self.drain_bytes = drain_bytes
+
+    @staticmethod
+    def _timeout(scope) -> Optional[float]:
+        for name, value in scope.get("headers", []):
+            if name == TIMEOUT_HEADER:
+                try:
+                    return float(value) / 1000.0
+                except ValueError:
+                    return None
+        return None
+
+    async def __call__(self, scope, receive, send):
+        queue = self.control.queue_for(scope["method"], scope["path"]) if scope["type"] == "http" else None
+        if queue is None:
+            await self.app(scope, receive, send)
+            return
+
+        cost = self.control.cost(scope)
+        try:
+            deadline = await queue.acquire(self._timeout(scope), cost, scope["path"])
+        except AdmissionRejected as e:
+            await self._send_rejection(scope, receive, send, e)
+            return
+
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        token = request_deadline.set(deadline)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            request_deadline.reset(token)
+            queue.release(loop.time() - start, cost, scope["path"])
+
+    async def _send_rejection(self, scope, receive, send, rejection: AdmissionRejected):
+        headers = [
+            (b"content-type", b"application/json"),
+            (b"retry-after", str(rejection.retry_after).encode())
+        ]
+        length = content_length(scope)
+        if length is not None and length <= self.drain_bytes:
+            # A small body is read first: closing with it unread would reset the
+            # connection before the client gets the 503
+            message = {"more_body": length > 0}
+            while message.get("more_body"):
+                message = await receive()
+                if message["type"] != "http.request":
+                    return
+        else:
+            # An upload is not transferred just to be shed; the connection
+            # cannot be reused with its body unread, so it is closed
+            headers.append((b"connection", b"close"))
+        body = json.dumps({"detail": str(rejection), "reason": rejection.reason}).encode()
+        await send({
+            "type": "http.response.start",
+            "status": 503,
+            "headers": headers + [(b"content-length", str(len(body)).encode())]
+        })
+        await send({"type": "http.response.body", "body": body})
@@ -0,0 +1,161 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Tuple
+import numpy as np
+import logging
+
+from src.weather import normalize_location
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def weather_bucket(location: str, weather_info: Optional[Dict]) -> str:
+    """
+    Coarse key for the weather a piece of advice was given under
+
+    Temperature is binned by 5°C and humidity by 20%, so answers are shared
+    while conditions stay similar but not once the weather has turned.
+    """
+    key = normalize_location(location or "")
+    if not weather_info:
+        return f"{key}|unknown"
+    conditions = normalize_location(str(weather_info.get("conditions", "")))
+    temperature = int(float(weather_info.get("temperature") or 0) // 5)
+    humidity = int(float(weather_info.get("humidity") or 0) // 20)
+    raining = float(weather_info.get("rainfall") or 0) > 0
+    return f"{key}|{conditions}|t{temperature}|h{humidity}|r{int(raining)}"
+
+
+class _CachedAnswer:
+    __slots__ = ("bucket", "query", "answer", "vector", "stored_at", "latency_s")
+
+    def __init__(self, bucket: str, query: str, answer: str, vector: np.ndarray, latency_s: float):
+        self.bucket = bucket
+        self.query = query
+        self.answer = answer
+        self.vector = vector
+        self.stored_at = time.time()
+        self.latency_s = latency_s
+
+
+class SemanticAnswerCache:
+    """
+    Reuses chatbot answers for near-duplicate questions asked under the same
+    location and weather bucket.
+
+    Entries are shared by all sessions and keyed without any conversation
+    history, so callers must only use it for questions that do not depend on
+    earlier turns (KrishiMitra uses it for the first question of a session).
+
+    Questions are compared by cosine similarity of their embeddings; entries
+    expire after `ttl_seconds` and the least recently used are evicted once
+    `max_entries` is reached.
+    """
+
+    def __init__(
+        self,
+        embed_fn: Callable[[str], List[float]],
+        threshold: float = 0.92,
+        ttl_seconds: float = 1800,
+        max_entries: int = 2000
+    ):
+        """
+        Args:
+            embed_fn: Embeds one query, e.g. embeddings.embed_query
+            threshold: Minimum cosine similarity for a cached answer to be reused
+            ttl_seconds: Seconds a cached answer stays valid
+            max_entries: Maximum cached answers across all buckets
+        """
+        self.embed_fn = embed_fn
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[int, _CachedAnswer]" = OrderedDict()
+        self._buckets: Dict[str, List[int]] = {}
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.latency_saved_s = 0.0
+
+    def _embed(self, query: str) -> np.ndarray:
+        vector = np.asarray(self.embed_fn(query), dtype=np.float32)
+        return vector / (np.linalg.norm(vector) or 1.0)
+
+    def lookup(self, bucket: str, query: str) -> Optional[Tuple[str, float]]:
+        """
+        Find a cached answer for a similar question
+
+        Args:
+            bucket: Location/weather bucket from weather_bucket()
+            query: User's question
+        Returns: (answer, similarity), or None on a miss
+        """
+        start = time.perf_counter()
+        vector = self._embed(query)
+        now = time.time()
+
+        with self._lock:
+            ids = [
+                entry_id for entry_id in self._buckets.get(bucket, [])
+                if now - self._entries[entry_id].stored_at <= self.ttl_seconds
+            ]
+            for entry_id in set(self._buckets.get(bucket, [])) - set(ids):
+                self._remove(entry_id)
+
+            if ids:
+                scores = np.stack([self._entries[entry_id].vector for entry_id in ids]) @ vector
+                best = int(np.argmax(scores))
+                if scores[best] >= self.threshold:
+                    entry = self._entries[ids[best]]
+                    self._entries.move_to_end(ids[best])
+                    self.hits += 1
+                    self.latency_saved_s += max(0.0, entry.latency_s - (time.perf_counter() - start))
+                    return entry.answer, float(scores[best])
+
+            self.misses += 1
+            return None
+
+    def store(self, bucket: str, query: str, answer: str, latency_s: float = 0.0):
+        """Cache an answer generated in `latency_s` seconds"""
+        vector = self._embed(query)
+        with self._lock:
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = _CachedAnswer(bucket, query, answer, vector, latency_s)
+            self._buckets.setdefault(bucket, []).append(entry_id)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def _remove(self, entry_id: int):
+        """Drop one entry (lock held)"""
+        entry = self._entries.pop(entry_id, None)
+        if entry is None:
+            return
+        ids = self._buckets.get(entry.bucket, [])
+        if entry_id in ids:
+            ids.remove(entry_id)
+        if not ids:
+            self._buckets.pop(entry.bucket, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._buckets.clear()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "buckets": len(self._buckets),
+                "max_entries": self.max_entries,
+                "threshold": self.threshold,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "latency_saved_s": round(self.latency_saved_s, 3)
+            }
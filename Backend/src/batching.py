@@ -0,0 +1,336 @@
+import asyncio
+import numpy as np
+from contextlib import contextmanager
+from concurrent.futures import Executor, ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple, Union
+import logging
+
+from src.admission import request_deadline
+from src.preprocessing import BufferPool
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+DEADLINE_ERROR = "Request deadline passed before inference"
+
+
+class ModelReleased(RuntimeError):
+    """Raised by predict_batch / predict_views of a model released after a hot-swap (e.g. unloaded from a model server)"""
+
+
+class BatchScheduler:
+    """
+    Dynamic micro-batching scheduler for the image classifiers.
+
+    Concurrent requests are queued and run through the model as one batched
+    forward pass as soon as `max_batch_size` images are waiting or
+    `max_wait_ms` has passed since the first image of the batch arrived.
+    Each caller still receives its own result dictionary.
+
+    `model` can be replaced at any time (a model hot-swap): each request
+    keeps the model it was submitted with, so queued images of the old model
+    still run on it, in their own forward pass, until it has drained.
+    """
+
+    def __init__(
+        self,
+        model,
+        max_batch_size: int = 16,
+        max_wait_ms: float = 10.0,
+        name: str = "model",
+        executor: Optional[Executor] = None,
+        decode_executor: Optional[Executor] = None,
+        on_batch: Optional[Callable[[object, float, List[float]], None]] = None
+    ):
+        """
+        Args:
+            model: DiseaseModel or PestModel (anything with preprocess_image and predict_batch)
+            max_batch_size: Largest number of images run in one forward pass
+            max_wait_ms: Longest time the first queued image waits for others to join
+            name: Name used in logs and thread names
+            executor: Executor for forward passes (defaults to a private single thread)
+            decode_executor: Executor for image preprocessing (defaults to the loop's default executor)
+            on_batch: Optional callback after each forward pass with the model, the
+                forward pass seconds and each request's seconds since it was submitted
+        """
+        self.model = model
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self.name = name
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        # A single inference thread keeps forward passes off the event loop
+        # without running several TF graphs against each other.
+        self._owns_executor = executor is None
+        self._executor = executor or ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"{name}-inference")
+        self._decode_executor = decode_executor
+        self._buffers = BufferPool()
+        self.on_batch = on_batch
+        self._outstanding: Dict[int, int] = {}
+
+    @property
+    def queue_depth(self) -> int:
+        """Number of images waiting to be batched"""
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def outstanding(self, model) -> int:
+        """Requests submitted with `model` that have not got their result yet"""
+        return self._outstanding.get(id(model), 0)
+
+    @contextmanager
+    def hold(self, model):
+        """Count work run on `model` outside the batcher (e.g. TTA passes) as outstanding for the block"""
+        self._track(model, 1)
+        try:
+            yield
+        finally:
+            self._track(model, -1)
+
+    def _track(self, model, delta: int):
+        count = self._outstanding.get(id(model), 0) + delta
+        if count:
+            self._outstanding[id(model)] = count
+        else:
+            self._outstanding.pop(id(model), None)
+
+    def _observe(self, model, forward_seconds: float, submitted: List[float]):
+        if self.on_batch is None:
+            return
+        now = asyncio.get_running_loop().time()
+        try:
+            self.on_batch(model, forward_seconds, [now - start for start in submitted])
+        except Exception as e:
+            logger.error(f"Batch observer error in '{self.name}': {e}")
+
+    async def start(self):
+        """Start the background batching task on the running event loop"""
+        if self._worker is not None:
+            return
+        self._queue = asyncio.Queue()
+        self._worker = asyncio.create_task(self._run())
+        logger.info(
+            f"Batch scheduler '{self.name}' started "
+            f"(max_batch_size={self.max_batch_size}, max_wait_ms={self.max_wait * 1000:.1f})"
+        )
+
+    async def stop(self):
+        """Stop the batching task and fail any request still waiting in the queue"""
+        if self._worker is None:
+            return
+        self._worker.cancel()
+        try:
+            await self._worker
+        except asyncio.CancelledError:
+            pass
+        self._worker = None
+
+        while not self._queue.empty():
+            future = self._queue.get_nowait()[1]
+            if not future.done():
+                future.set_result({"success": False, "error": "Batch scheduler stopped"})
+        if self._owns_executor:
+            self._executor.shutdown(wait=False)
+        logger.info(f"Batch scheduler '{self.name}' stopped")
+
+    async def submit(self, img_input: Union[str, bytes], model=None) -> Dict:
+        """
+        Preprocess an image and wait for its prediction from the next batch
+
+        Args:
+            img_input: Either file path (str) or image bytes
+            model: Model to run on (default: the current model)
+        Returns: Result dictionary in the same format as model.predict
+        """
+        if self._worker is None:
+            raise RuntimeError(f"Batch scheduler '{self.name}' is not running")
+
+        model = model or self.model
+        loop = asyncio.get_running_loop()
+        deadline = request_deadline.get()
+        if deadline is not None and loop.time() >= deadline:
+            return {"success": False, "error": DEADLINE_ERROR}
+        self._track(model, 1)
+        try:
+            try:
+                img_array = await loop.run_in_executor(self._decode_executor, model.preprocess_image, img_input)
+            except Exception as e:
+                logger.error(f"Prediction error: {e}")
+                return {"success": False, "error": str(e)}
+            return await self.submit_array(img_array, model)
+        finally:
+            self._track(model, -1)
+
+    async def submit_array(self, img_array: np.ndarray, model=None) -> Dict:
+        """
+        Queue an already preprocessed image, e.g. one decoded once for several models
+
+        Args:
+            img_array: Array of shape (1, height, width, 3) from preprocess_image
+            model: Model to run on (default: the current model)
+        Returns: Result dictionary in the same format as model.predict
+        """
+        if self._worker is None:
+            raise RuntimeError(f"Batch scheduler '{self.name}' is not running")
+
+        model = model or self.model
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._track(model, 1)
+        try:
+            await self._queue.put((img_array, future, request_deadline.get(), model, loop.time()))
+            return await future
+        finally:
+            self._track(model, -1)
+
+    async def submit_many(self, img_inputs: List[Union[str, bytes]], model=None) -> List[Dict]:
+        """
+        Predict a caller-supplied batch of images with a single forward pass
+
+        Images are decoded in parallel and stacked into one tensor. A file that
+        fails to decode gets its own error result instead of failing the batch.
+
+        Args:
+            img_inputs: List of file paths (str) or image bytes
+            model: Model to run on (default: the current model)
+        Returns: One result dictionary per input, in input order
+        """
+        model = model or self.model
+        self._track(model, 1)
+        try:
+            return await self._submit_many(img_inputs, model)
+        finally:
+            self._track(model, -1)
+
+    async def _submit_many(self, img_inputs: List[Union[str, bytes]], model) -> List[Dict]:
+        loop = asyncio.get_running_loop()
+        submitted = loop.time()
+        preprocess_into = getattr(model, "preprocess_into", None)
+        if preprocess_into is None:
+            decoded = await asyncio.gather(
+                *[loop.run_in_executor(self._decode_executor, model.preprocess_image, img_input) for img_input in img_inputs],
+                return_exceptions=True
+            )
+            rows = [item if isinstance(item, Exception) else item[0] for item in decoded]
+            return await self._predict_rows(rows, model, submitted)
+
+        # Decode straight into the rows of a pooled batch buffer
+        shape = model.input_spec.shape
+        buffer = self._buffers.acquire(len(img_inputs), shape)
+        try:
+            decoded = await asyncio.gather(
+                *[
+                    loop.run_in_executor(self._decode_executor, preprocess_into, img_input, buffer[i])
+                    for i, img_input in enumerate(img_inputs)
+                ],
+                return_exceptions=True
+            )
+            return await self._predict_rows(decoded, model, submitted, buffer[:len(img_inputs)])
+        finally:
+            self._buffers.release(buffer)
+
+    async def _predict_rows(self, rows: List, model, submitted: float, batch_array: Optional[np.ndarray] = None) -> List[Dict]:
+        """
+        Run one forward pass over the rows that decoded successfully
+
+        Args:
+            rows: Per input, its preprocessed row or the exception it raised
+            model: Model to run
+            submitted: Event loop time the request was submitted
+            batch_array: The rows already stacked in input order, if available
+        Returns: One result dictionary per input, in input order
+        """
+        loop = asyncio.get_running_loop()
+        results: List[Optional[Dict]] = [None] * len(rows)
+        valid_indices = []
+        for i, item in enumerate(rows):
+            if isinstance(item, Exception):
+                results[i] = {"success": False, "error": str(item)}
+            else:
+                valid_indices.append(i)
+
+        if valid_indices:
+            try:
+                if batch_array is None:
+                    batch_array = np.stack([rows[i] for i in valid_indices])
+                elif len(valid_indices) < len(rows):
+                    batch_array = batch_array[valid_indices]
+                start = loop.time()
+                predictions = await self._predict_batch(model, batch_array)
+                self._observe(model, loop.time() - start, [submitted])
+            except Exception as e:
+                logger.error(f"Batch prediction error in '{self.name}' (batch size {len(valid_indices)}): {e}")
+                predictions = [{"success": False, "error": str(e)} for _ in valid_indices]
+            for i, result in zip(valid_indices, predictions):
+                results[i] = result
+
+        return results
+
+    async def _run(self):
+        """Collect queued images into batches and run them"""
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.max_wait
+
+            while len(batch) < self.max_batch_size:
+                if not self._queue.empty():
+                    batch.append(self._queue.get_nowait())
+                    continue
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            await self._process(batch)
+
+    async def _process(self, batch: List[Tuple[np.ndarray, asyncio.Future, Optional[float], object, float]]):
+        """Run the batch's forward pass(es) and hand every caller its own result"""
+        now = asyncio.get_running_loop().time()
+        # Normally one group; during a hot-swap, images of the old model run separately
+        groups: Dict[int, List] = {}
+        for img_array, future, deadline, model, submitted in batch:
+            # Callers that disconnected or ran out of time while queued do not need a slot in the batch
+            if future.done():
+                continue
+            if deadline is not None and now >= deadline:
+                future.set_result({"success": False, "error": DEADLINE_ERROR})
+                continue
+            groups.setdefault(id(model), []).append((img_array, future, model, submitted))
+
+        for group in groups.values():
+            await self._forward(group[0][2], group)
+
+    async def _forward(self, model, group: List[Tuple[np.ndarray, asyncio.Future, object, float]]):
+        loop = asyncio.get_running_loop()
+        buffer = self._buffers.acquire(len(group), group[0][0].shape[1:])
+        try:
+            batch_array = buffer[:len(group)]
+            for row, item in enumerate(group):
+                batch_array[row] = item[0][0]
+            start = loop.time()
+            results = await self._predict_batch(model, batch_array)
+            self._observe(model, loop.time() - start, [item[3] for item in group])
+        except Exception as e:
+            logger.error(f"Batch prediction error in '{self.name}' (batch size {len(group)}): {e}")
+            results = [{"success": False, "error": str(e)} for _ in group]
+        finally:
+            self._buffers.release(buffer)
+
+        for item, result in zip(group, results):
+            if not item[1].done():
+                item[1].set_result(result)
+
+    async def _predict_batch(self, model, batch_array: np.ndarray) -> List[Dict]:
+        """Forward pass on `model`; if a hot-swap already released it, the batch runs on the current model"""
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(self._executor, model.predict_batch, batch_array)
+        except ModelReleased as e:
+            current = self.model
+            if current is model or getattr(current, "input_spec", None) != getattr(model, "input_spec", None):
+                raise
+            logger.warning(f"{e}; running the batch on the current '{self.name}' model")
+            return await loop.run_in_executor(self._executor, current.predict_batch, batch_array)
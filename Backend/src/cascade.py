@@ -0,0 +1,152 @@
+import os
+import threading
+from typing import Callable, Dict, List, Optional, Tuple
+import cv2
+import numpy as np
+import logging
+
+from src.metrics import metrics
+from src.runners import create_runner
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+STAGES = ("fast", "full")
+
+cascade_results = metrics.counter(
+    "krishimitra_cascade_total", "Images answered by each cascade stage (fast model or escalated to the full model)"
+)
+
+
+def fast_model_path(model_path: str) -> str:
+    """
+    Where the distilled fast model of a classifier lives
+
+    e.g. Backend/models/disease_classifier.h5 -> Backend/models/disease_classifier.fast.keras
+    """
+    return f"{os.path.splitext(model_path)[0]}.fast.keras"
+
+
+def downsample(img_array: np.ndarray, size: Tuple[int, int]) -> np.ndarray:
+    """
+    Shrink a batch of preprocessed images to the fast model's input size
+
+    Normalisation is linear, so area-resizing the normalised full-size input
+    matches preprocessing at the smaller size, without decoding again.
+
+    Args:
+        img_array: Array of shape (N, height, width, 3) from preprocess_image
+        size: (width, height) of the fast model input
+    Returns: float32 array of shape (N, size[1], size[0], 3)
+    """
+    out = np.empty((len(img_array), size[1], size[0], 3), dtype=np.float32)
+    for i, img in enumerate(img_array):
+        cv2.resize(img, size, dst=out[i], interpolation=cv2.INTER_AREA)
+    return out
+
+
+class Cascade:
+    """
+    Confidence-gated early exit in front of a classifier.
+
+    A small, low-resolution model distilled from the full classifier sees
+    every image first. Images whose fast top-1 confidence is below
+    `threshold` are escalated to the full model in one batched call; the
+    rest are answered by the fast model.
+    """
+
+    def __init__(self, runner, input_size: Tuple[int, int], threshold: float = 90.0, name: str = "model", path: Optional[str] = None):
+        """
+        Args:
+            runner: Runner of the fast model (predict(batch) -> probabilities)
+            input_size: (width, height) of the fast model input
+            threshold: Minimum fast top-1 confidence (%) to skip the full model
+            name: Model name used in metrics and logs
+            path: Fast model file, recorded in the model identity
+        """
+        self.runner = runner
+        self.input_size = input_size
+        self.threshold = threshold
+        self.name = name
+        self.path = path
+        self.counts = {stage: 0 for stage in STAGES}
+        self._lock = threading.Lock()
+
+    def predict(self, img_array: np.ndarray, full_predict: Callable[[np.ndarray], np.ndarray]) -> Tuple[np.ndarray, List[str]]:
+        """
+        Run a batch through the cascade
+
+        Args:
+            img_array: Full-size preprocessed batch
+            full_predict: Forward pass of the full model
+        Returns: (probabilities of shape (N, classes), stage that answered each image)
+        """
+        with metrics.time("forward_fast", component=self.name):
+            probs = np.array(self.runner.predict(downsample(img_array, self.input_size)), dtype=np.float32)
+        escalate = np.flatnonzero(probs.max(axis=1) * 100 < self.threshold)
+        if len(escalate):
+            probs[escalate] = full_predict(img_array[escalate])
+
+        stages = ["fast"] * len(img_array)
+        for i in escalate:
+            stages[i] = "full"
+        escalated = len(escalate)
+        with self._lock:
+            self.counts["full"] += escalated
+            self.counts["fast"] += len(img_array) - escalated
+        if metrics.enabled:
+            cascade_results.inc(len(img_array) - escalated, model=self.name, stage="fast")
+            cascade_results.inc(escalated, model=self.name, stage="full")
+        return probs, stages
+
+    def identity(self) -> str:
+        """Fast model file and threshold, for prediction cache keys"""
+        try:
+            stat = os.stat(self.path)
+            version = f"{stat.st_size}:{int(stat.st_mtime)}"
+        except (OSError, TypeError):
+            version = "unknown"
+        return f"cascade:{self.path}:{version}:{self.threshold}"
+
+    def stats(self) -> Dict:
+        with self._lock:
+            counts = dict(self.counts)
+        total = counts["fast"] + counts["full"]
+        return {
+            "model_path": self.path,
+            "input_size": list(self.input_size),
+            "threshold": self.threshold,
+            "answered": counts,
+            "escalation_rate": round(counts["full"] / total, 4) if total else 0.0
+        }
+
+
+def load_cascade(path: str, threshold: float, name: str) -> Cascade:
+    """
+    Load a fast model (Keras file, or an exported .tflite) as a cascade stage
+
+    Keras files run through a tf.function runner, which has the lowest
+    per-call overhead for small inputs.
+
+    Args:
+        path: Fast model file, e.g. from Backend/distill_models.py
+        threshold: Minimum fast top-1 confidence (%) to skip the full model
+        name: Model name used in metrics and logs
+    Returns: Cascade
+    """
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"Fast model not found: {path} (run Backend/distill_models.py)")
+
+    if path.endswith(".tflite"):
+        runner = create_runner("tflite", path=path)
+        height, width = runner._interpreter().get_input_details()[0]["shape"][1:3]
+    else:
+        from tensorflow.keras.models import load_model
+
+        model = load_model(path, compile=False)
+        height, width = model.input_shape[1:3]
+        runner = create_runner("tf_function", model=model, input_shape=(height, width, 3))
+
+    cascade = Cascade(runner, (int(width), int(height)), threshold=threshold, name=name, path=path)
+    logger.info(f"{name} cascade loaded from {path} ({width}x{height}, threshold {threshold}%)")
+    return cascade
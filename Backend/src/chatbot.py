@@ -1,37 +1,107 @@
-from langchain_community.vectorstores import FAISS
-from langchain.memory import VectorStoreRetrieverMemory, ConversationBufferMemory, CombinedMemory
 from langchain_huggingface import HuggingFaceEmbeddings, HuggingFaceEndpoint, ChatHuggingFace
-from langchain_core.prompts import PromptTemplate
 from langchain_core.output_parsers import StrOutputParser
-from langchain_core.runnables import RunnableParallel, RunnableLambda, RunnablePassthrough
+from langchain_core.runnables import RunnableParallel, RunnableLambda
+from langchain_core.callbacks import BaseCallbackHandler
 from dotenv import load_dotenv
 from datetime import datetime, timezone
-from typing import Dict, Union, Tuple
+from typing import AsyncIterator, Dict, List, Union, Tuple
 import os
-import requests
+import time
+import asyncio
 import logging
 
+from src.weather import WeatherClient
+from src.sessions import ChatSession, SessionManager, DEFAULT_SESSION_ID
+from src.memory import TokenBudgetMemory, PromptTokenStats
+from src.memory_index import MemoryIndex
+from src.embeddings import CachedEmbeddings
+from src.answer_cache import SemanticAnswerCache, weather_bucket
+from src.metrics import metrics
+from src.llm_client import LLMError, create_llm_client
+from src.prompt_builder import PromptBuilder
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 load_dotenv()
 
+class LLMTimer(BaseCallbackHandler):
+    """Records LLM call duration, and time to first token when streaming, as metrics"""
+    
+    run_inline = True
+    
+    def __init__(self):
+        self._starts = {}
+        self._waiting_first_token = set()
+    
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        self._starts[run_id] = time.perf_counter()
+        self._waiting_first_token.add(run_id)
+    
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        self.on_chat_model_start(serialized, prompts, run_id=run_id)
+    
+    def on_llm_new_token(self, token, *, run_id, **kwargs):
+        if run_id in self._waiting_first_token and run_id in self._starts:
+            self._waiting_first_token.discard(run_id)
+            metrics.observe(
+                metrics.stage_seconds, time.perf_counter() - self._starts[run_id],
+                stage="llm_first_token", component="chatbot"
+            )
+    
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        self._waiting_first_token.discard(run_id)
+        start = self._starts.pop(run_id, None)
+        if start is not None:
+            metrics.observe(metrics.stage_seconds, time.perf_counter() - start, stage="llm", component="chatbot")
+    
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._waiting_first_token.discard(run_id)
+        self._starts.pop(run_id, None)
+
 class KrishiMitra:
     """Agricultural AI Assistant"""
     
-    def __init__(self, default_location: str = "Pune"):
+    def __init__(self, default_location: str = "Pune", embeddings=None, chat_model=None):
+        """
+        Args:
+            default_location: Location used for sessions that have not set one
+            embeddings: Embedding model to use instead of MiniLM (e.g. a local stand-in)
+            chat_model: Chat model to use instead of the Hugging Face endpoint
+        """
         self.location = default_location
-        self._initialize_embeddings()
-        self._initialize_llm()
+        self._initialize_embeddings(embeddings)
+        if chat_model is None:
+            self._initialize_llm()
+        else:
+            self.model = chat_model
+        # Concurrency cap, deadlines, retries, hedging and coalescing in front of the model
+        self.llm_client = create_llm_client(self.model)
         self._initialize_memory()
         self._initialize_chain()
-        self.weather_context = self._get_weather_context() or "<p>Weather data not available.</p>"
+        self._initialize_weather()
+        self._initialize_answer_cache()
+        # Chain callbacks; the LLM timer is only attached when metrics are collected
+        self.callbacks = [LLMTimer()] if metrics.enabled else []
+    
+    def warm_up(self):
+        """Run the embedding model once and warm the weather cache for the default location"""
+        self.embeddings.embed_query("When should I sow wheat?")
+        self.sessions.get(DEFAULT_SESSION_ID).set_weather_context(self._get_weather_context())
     
-    def _initialize_embeddings(self):
-        """Initialize embedding model"""
+    def _initialize_embeddings(self, base=None):
+        """Initialize embedding model behind the embedding cache"""
         try:
-            self.embeddings = HuggingFaceEmbeddings(
-                model_name="sentence-transformers/all-MiniLM-L6-v2"
+            if base is None:
+                base = HuggingFaceEmbeddings(
+                    model_name="sentence-transformers/all-MiniLM-L6-v2"
+                )
+            self.embeddings = CachedEmbeddings(
+                base,
+                max_entries=int(os.getenv("EMBEDDING_CACHE_SIZE", 10000)),
+                cache_path=os.getenv("EMBEDDING_CACHE_PATH") or None,
+                max_batch_size=int(os.getenv("EMBEDDING_BATCH_MAX_SIZE", 64)),
+                max_wait_ms=float(os.getenv("EMBEDDING_BATCH_MAX_WAIT_MS", 5))
             )
             logger.info("Embeddings initialized successfully")
         except Exception as e:
@@ -45,8 +115,15 @@ class KrishiMitra:
             if not api_token:
                 raise ValueError("HUGGINGFACE_API_TOKEN not found in environment")
             
+            # HUGGINGFACE_ENDPOINT_URL serves the model from a dedicated endpoint
+            # (or a local stand-in) instead of the serverless Inference API
+            endpoint_url = os.getenv("HUGGINGFACE_ENDPOINT_URL")
+            model_source = (
+                {"endpoint_url": endpoint_url} if endpoint_url
+                else {"repo_id": "meta-llama/Meta-Llama-3-8B-Instruct"}
+            )
             self.llm = HuggingFaceEndpoint(
-                repo_id="meta-llama/Meta-Llama-3-8B-Instruct",
+                **model_source,
                 task="text-generation",
                 temperature=0.7,
                 max_new_tokens=512,
@@ -59,65 +136,99 @@ class KrishiMitra:
             raise
     
     def _initialize_memory(self):
-        """Initialize conversation memory"""
+        """Initialize the per-session conversation memory store"""
         try:
-            self.buffer_memory = ConversationBufferMemory(
-                memory_key="chat_history",
-                return_messages=True
-            )
-            
-            self.memory_store = FAISS.from_texts(
-                ["Initial context"],
-                self.embeddings
+            self.embedding_dim = len(self.embeddings.embed_query("Initial context"))
+            self.memory_mode = os.getenv("CHAT_MEMORY_MODE", "summary")
+            self.memory_token_budget = int(os.getenv("CHAT_MEMORY_TOKEN_BUDGET", 1024))
+            self.memory_summary_budget = int(os.getenv("CHAT_MEMORY_SUMMARY_BUDGET", 256))
+            self.max_history_turns = int(os.getenv("CHAT_MAX_HISTORY_TURNS", 20))
+            self.token_stats = PromptTokenStats()
+            # Empty CHAT_MEMORY_INDEX_DIR keeps the vector memory in RAM only
+            self.memory_index = MemoryIndex(
+                embed_fn=self.embeddings.embed_documents,
+                dim=self.embedding_dim,
+                store_dir=os.getenv("CHAT_MEMORY_INDEX_DIR", "Backend/cache/memory_index") or None,
+                sweep_interval=float(os.getenv("CHAT_MEMORY_SWEEP_INTERVAL", 60)),
+                max_sessions=int(os.getenv("CHAT_MEMORY_INDEX_MAX_SESSIONS", 2000)),
+                session_ttl=float(os.getenv("CHAT_MEMORY_INDEX_SESSION_TTL", 7 * 24 * 3600)),
+                max_turns=int(os.getenv("CHAT_MEMORY_INDEX_MAX_TURNS", 50))
             )
-            
-            self.memory_retriever = self.memory_store.as_retriever(
-                search_type="mmr",
-                search_kwargs={'k': 5, 'fetch_k': 10, 'lambda_mult': 0.7}
-            )
-            
-            self.vector_memory = VectorStoreRetrieverMemory(
-                retriever=self.memory_retriever
-            )
-            
-            self.memory = CombinedMemory(
-                memories=[self.buffer_memory, self.vector_memory]
+            self.sessions = SessionManager(
+                factory=self._new_session,
+                max_sessions=int(os.getenv("CHAT_MAX_SESSIONS", 10000)),
+                idle_ttl=float(os.getenv("CHAT_SESSION_IDLE_TTL", 1800)),
+                max_total_bytes=int(os.getenv("CHAT_SESSIONS_MAX_BYTES", 256 * 1024 * 1024))
             )
             logger.info("Memory initialized successfully")
         except Exception as e:
             logger.error(f"Error initializing memory: {e}")
             raise
     
+    def _new_session(self, session_id: str) -> ChatSession:
+        """Create a session, restoring recent turns stored in the memory index"""
+        session = ChatSession(session_id, self.location)
+        self._reset_session_memory(session)
+        # Stored turns already carry their embeddings, so nothing is re-embedded here
+        for turn in self.memory_index.session_turns(session_id)[-self.max_history_turns:]:
+            session.history_memory.save_context({"input": turn["query"]}, {"output": turn["answer"]})
+        return session
+    
+    def _session(self, session_id: str) -> ChatSession:
+        """The session, with its conversation buffer reset if another worker cleared it since"""
+        session = self.sessions.get(session_id)
+        if self.memory_index.cleared_at(session_id) > session.memory_reset_at:
+            with session.lock:
+                self._reset_session_memory(session)
+            self.sessions.update_size(session)
+        return session
+    
+    def _reset_session_memory(self, session: ChatSession):
+        """Give a session a fresh conversation buffer"""
+        session.memory_reset_at = time.time()
+        session.history_memory = TokenBudgetMemory(
+            mode=self.memory_mode,
+            token_budget=self.memory_token_budget,
+            summary_budget=self.memory_summary_budget,
+            max_turns=self.max_history_turns,
+            retrieve_fn=lambda query, session_id=session.session_id: self._relevant_turns(session_id, query)
+        )
+    
+    def _relevant_turns(self, session_id: str, query: str) -> List[Tuple[str, str]]:
+        """Stored (query, answer) pairs of a session most relevant to a query"""
+        return [
+            (turn["query"], turn["answer"])
+            for turn in self.memory_index.search(session_id, query, k=5, fetch_k=10, lambda_mult=0.7)
+        ]
+    
+    def _initialize_weather(self):
+        """Initialize the cached weather client"""
+        self.weather_client = WeatherClient(
+            current_ttl=float(os.getenv("WEATHER_CURRENT_TTL", 600)),
+            forecast_ttl=float(os.getenv("WEATHER_FORECAST_TTL", 3600)),
+            failure_ttl=float(os.getenv("WEATHER_FAILURE_TTL", 30))
+        )
+    
+    def _initialize_answer_cache(self):
+        """Initialize the semantic answer cache (ANSWER_CACHE_ENABLED=false disables it)"""
+        self.answer_cache = None
+        if os.getenv("ANSWER_CACHE_ENABLED", "true").lower() in ("0", "false", "no"):
+            return
+        self.answer_cache = SemanticAnswerCache(
+            embed_fn=self.embeddings.embed_query,
+            threshold=float(os.getenv("ANSWER_CACHE_THRESHOLD", 0.92)),
+            ttl_seconds=float(os.getenv("ANSWER_CACHE_TTL", 1800)),
+            max_entries=int(os.getenv("ANSWER_CACHE_SIZE", 2000))
+        )
+    
     def _initialize_chain(self):
         """Initialize the conversation chain"""
         try:
-            self.prompt_template = """
-You are Krishi Mitra, an advanced AI agricultural assistant specialized in helping farmers.
-
-Return responses in clean, structured HTML format with proper formatting:
-- Use <h3>, <h4> for headings
-- Use <p> for paragraphs
-- Use <ul>, <li> for lists
-- Use <strong> for emphasis
-- Use <br> for line breaks when needed
-
-Current Weather Information:
-{weather_context}
-
-Conversation History (use if relevant):
-{history}
-
-User Query: {query}
-
-Provide practical, actionable advice based on the weather conditions and farming best practices.
-Your response:
-"""
-            
-            self.prompt = PromptTemplate(
-                template=self.prompt_template,
-                input_variables=["weather_context", "history", "query"]
+            self.prompt_builder = PromptBuilder(
+                weather_tokens=int(os.getenv("PROMPT_WEATHER_TOKENS", 120)),
+                forecast_days=int(os.getenv("PROMPT_FORECAST_DAYS", 3)),
+                stats=self.token_stats
             )
-            
             self.parser = StrOutputParser()
             self.chain = self._make_chain()
             logger.info("Chain initialized successfully")
@@ -126,140 +237,177 @@ Your response:
             raise
     
     def _make_chain(self):
-        """Create the runnable chain"""
-        def get_history(query: str):
+        """Create the runnable chain (input: {"query": str, "session": ChatSession})"""
+        def get_history(inputs: Dict):
             try:
-                history_vars = self.memory.load_memory_variables({'input': query})
-                history = history_vars.get("chat_history", [])
-                
-                if isinstance(history, list):
-                    formatted_history = "\n".join(
-                        f"{msg.type.upper()}: {msg.content}" for msg in history
-                    )
-                else:
-                    formatted_history = str(history)
-                
-                return formatted_history
+                with metrics.time("memory_load", component="chatbot"):
+                    return inputs["session"].history_memory.format_history(inputs["query"])
             except Exception as e:
                 logger.error(f"Error getting history: {e}")
                 return ""
         
         parallel_chain = RunnableParallel({
-            'weather_context': RunnableLambda(lambda _: self.weather_context),
+            'weather_context': RunnableLambda(lambda inputs: self._session_weather_context(inputs["session"])),
             'history': RunnableLambda(get_history),
-            'query': RunnablePassthrough()
+            'query': RunnableLambda(lambda inputs: inputs["query"])
         })
         
-        return parallel_chain | self.prompt | self.model | self.parser
+        # Looked up per call, so the builder can be swapped (e.g. by benchmarks)
+        build_prompt = RunnableLambda(lambda sections: self.prompt_builder.build(sections))
+        return parallel_chain | build_prompt | self.llm_client | self.parser
     
-    def get_weather_data(self, location: str = None) -> Dict:
-        """Fetch weather data for a location"""
-        api_key = os.getenv("WEATHER_API_KEY")
-        if not api_key:
-            logger.warning("Weather API key not found")
-            return None
-        
-        location = location or self.location
-        
-        try:
-            current_url = f"http://api.weatherapi.com/v1/current.json?key={api_key}&q={location}&aqi=no"
-            forecast_url = f"http://api.weatherapi.com/v1/forecast.json?key={api_key}&q={location}&days=7&aqi=no&alerts=no"
-            
-            current_response = requests.get(current_url, timeout=10)
-            forecast_response = requests.get(forecast_url, timeout=10)
-            
-            if current_response.status_code == 200 and forecast_response.status_code == 200:
-                current_data = current_response.json()
-                forecast_data = forecast_response.json()
-                
-                return {
-                    "location": current_data["location"]["name"],
-                    "region": current_data["location"]["region"],
-                    "country": current_data["location"]["country"],
-                    "temperature": current_data["current"]["temp_c"],
-                    "feels_like": current_data["current"]["feelslike_c"],
-                    "conditions": current_data["current"]["condition"]["text"],
-                    "humidity": current_data["current"]["humidity"],
-                    "wind_speed": current_data["current"]["wind_kph"],
-                    "wind_direction": current_data["current"]["wind_dir"],
-                    "rainfall": current_data["current"].get("precip_mm", 0),
-                    "cloud_cover": current_data["current"]["cloud"],
-                    "uv_index": current_data["current"]["uv"],
-                    "forecast": forecast_data["forecast"]["forecastday"]
-                }
-            else:
-                logger.warning(f"Weather API returned status {current_response.status_code}")
-                return None
-                
-        except requests.exceptions.RequestException as e:
-            logger.error(f"Error fetching weather data: {e}")
-            return None
-        except Exception as e:
-            logger.error(f"Unexpected error in weather data fetch: {e}")
-            return None
+    def get_weather_data(self, location: str = None, session_id: str = None) -> Dict:
+        """Fetch weather data for a location (cached per location)"""
+        if location is None and session_id is not None:
+            location = self.sessions.get(session_id).location
+        with metrics.time("weather_fetch", component="chatbot"):
+            return self.weather_client.get_weather(location or self.location)
     
-    def _get_weather_context(self) -> str:
-        """Format weather data as HTML context"""
-        weather_info = self.get_weather_data()
-        
-        if not weather_info:
-            return "<p>Weather data not available.</p>"
-        
-        return f"""
-<div style="background-color: #f0f8ff; padding: 10px; border-radius: 5px;">
-    <h4>🌤 Current Weather in {weather_info['location']}, {weather_info['region']}</h4>
-    <p><strong>Temperature:</strong> {weather_info['temperature']}°C (Feels like: {weather_info['feels_like']}°C)</p>
-    <p><strong>Conditions:</strong> {weather_info['conditions']}</p>
-    <p><strong>Humidity:</strong> {weather_info['humidity']}%</p>
-    <p><strong>Wind:</strong> {weather_info['wind_speed']} kph {weather_info['wind_direction']}</p>
-    <p><strong>Rainfall:</strong> {weather_info['rainfall']} mm</p>
-    <p><strong>Cloud Cover:</strong> {weather_info['cloud_cover']}%</p>
-    <p><strong>UV Index:</strong> {weather_info['uv_index']}</p>
-</div>
-"""
-    
-    def update_location(self, new_location: str):
-        """Update the location and refresh weather data"""
-        self.location = new_location
-        self.weather_context = self._get_weather_context()
-        logger.info(f"Location updated to: {new_location}")
-    
-    def ask(self, query: str) -> str:
+    def _session_weather_context(self, session: ChatSession) -> str:
+        """Weather context for a session, rebuilt once it is older than the current-conditions TTL"""
+        age = time.time() - session.weather_context_at
+        if session.weather_context is None or age > self.weather_client.ttls["current"]:
+            session.set_weather_context(self._get_weather_context(session.location))
+        return session.weather_context
+    
+    def _get_weather_context(self, location: str = None) -> str:
+        """Format weather data as a compact, token-budgeted prompt section"""
+        return self.prompt_builder.weather_summary(self.get_weather_data(location))
+    
+    def update_location(self, new_location: str, session_id: str = DEFAULT_SESSION_ID):
+        """Update the session's location and refresh its weather data"""
+        session = self.sessions.get(session_id)
+        session.location = new_location
+        session.set_weather_context(self._get_weather_context(new_location))
+        self.sessions.update_size(session)
+        logger.info(f"Location updated to: {new_location} (session {session_id})")
+    
+    def ask(self, query: str, session_id: str = DEFAULT_SESSION_ID) -> str:
         """
         Process a user query and return response
 
-        Args: query: User's question
+        Args:
+            query: User's question
+            session_id: Conversation the query belongs to
         Returns: HTML formatted response
         """
         try:
-            answer = self.chain.invoke(query)
-            self.buffer_memory.save_context(
-                {"input": query},
-                {"output": answer}
-            )
-            self.vector_memory.save_context(
-                {"input": query},
-                {"output": answer, "timestamp": datetime.now(timezone.utc).isoformat()}
-            )
+            session = self._session(session_id)
+            bucket = self._answer_bucket(session)
+            answer = self._cached_answer(bucket, query)
+            if answer is not None:
+                self._save_turn(session, query, answer)
+                return answer
+            
+            start = time.perf_counter()
+            answer = self.chain.invoke({"query": query, "session": session}, config={"callbacks": self.callbacks})
+            self._save_turn(session, query, answer)
+            self._store_answer(bucket, query, answer, time.perf_counter() - start)
             
             return answer
+        except LLMError:
+            # Overload and timeouts are reported by the API as 503/504
+            raise
         except Exception as e:
             logger.error(f"Error processing query: {e}")
             return f"<p>Sorry, I encountered an error processing your request: {str(e)}</p>"
     
-    def clear_memory(self):
-        """Clear conversation memory"""
-        try:
-            self.buffer_memory.clear()
+    async def astream(self, query: str, session_id: str = DEFAULT_SESSION_ID) -> AsyncIterator[str]:
+        """
+        Stream the response to a user query as the model produces it
 
-            memory_store = FAISS.from_texts([""], self.embeddings)
-            memory_retriever = memory_store.as_retriever(
-                search_type="mmr",
-                search_kwargs={'k': 5, 'fetch_k': 10, 'lambda_mult': 0.7}
-            )
-            vector_memory = VectorStoreRetrieverMemory(retriever=memory_retriever)
+        Memory is saved only after the stream completes; if the consumer stops
+        early (e.g. the client disconnects) the partial turn is discarded.
+
+        Args:
+            query: User's question
+            session_id: Conversation the query belongs to
+        Yields: HTML formatted response fragments
+        """
+        session = await asyncio.to_thread(self._session, session_id)
+        bucket = await asyncio.to_thread(self._answer_bucket, session)
+        answer = await asyncio.to_thread(self._cached_answer, bucket, query)
+        if answer is not None:
+            yield answer
+            await asyncio.to_thread(self._save_turn, session, query, answer)
+            return
+        
+        start = time.perf_counter()
+        chunks = []
+        async for chunk in self.chain.astream({"query": query, "session": session}, config={"callbacks": self.callbacks}):
+            chunks.append(chunk)
+            yield chunk
+        
+        answer = "".join(chunks)
+        await asyncio.to_thread(self._save_turn, session, query, answer)
+        await asyncio.to_thread(self._store_answer, bucket, query, answer, time.perf_counter() - start)
+    
+    def _answer_bucket(self, session: ChatSession) -> Union[str, None]:
+        """
+        Location/weather bucket the session's answers are cached under
 
-            self.memory.memories = [self.buffer_memory, self.vector_memory]
-            logger.info("Memory cleared successfully")
+        Returns: None when the answer must not be shared. The cache is shared by
+        all sessions and does not see the history, so only the opening question
+        of a conversation is looked up and stored; follow-ups depend on (and
+        would leak) what was said before.
+        """
+        if self.answer_cache is None or not session.history_memory.is_empty():
+            return None
+        return weather_bucket(session.location, self.get_weather_data(session.location))
+    
+    def _cached_answer(self, bucket: Union[str, None], query: str) -> Union[str, None]:
+        """Answer previously given to a similar question under similar weather, if any"""
+        if self.answer_cache is None or bucket is None:
+            return None
+        try:
+            cached = self.answer_cache.lookup(bucket, query)
+        except Exception as e:
+            logger.error(f"Error looking up answer cache: {e}")
+            return None
+        if cached is None:
+            return None
+        answer, similarity = cached
+        logger.info(f"Answer cache hit (similarity {similarity:.3f})")
+        return answer
+    
+    def _store_answer(self, bucket: Union[str, None], query: str, answer: str, latency_s: float):
+        if self.answer_cache is None or bucket is None or not answer:
+            return
+        try:
+            self.answer_cache.store(bucket, query, answer, latency_s)
+        except Exception as e:
+            logger.error(f"Error storing answer in cache: {e}")
+    
+    def _save_turn(self, session: ChatSession, query: str, answer: str):
+        """Store a completed turn in the session's memory"""
+        with metrics.time("memory_save", component="chatbot"):
+            with session.lock:
+                session.history_memory.save_context(
+                    {"input": query},
+                    {"output": answer}
+                )
+            # Embedded in the background; searchable once the index worker catches up
+            self.memory_index.add(
+                session.session_id,
+                f"input: {query}\noutput: {answer}",
+                {"query": query, "answer": answer, "timestamp": datetime.now(timezone.utc).isoformat()}
+            )
+        self.sessions.update_size(session)
+    
+    def clear_memory(self, session_id: str = DEFAULT_SESSION_ID):
+        """Clear a session's conversation memory"""
+        try:
+            session = self.sessions.get(session_id)
+            with session.lock:
+                removed = self.memory_index.delete_session(session_id)
+                self._reset_session_memory(session)
+            self.sessions.update_size(session)
+            logger.info(f"Memory cleared successfully (session {session_id}, {removed} stored turns removed)")
         except Exception as e:
             logger.error(f"Error clearing memory: {e}")
+    
+    def close(self):
+        """Persist the memory index and release pooled connections"""
+        self.memory_index.close()
+        self.weather_client.close()
+        self.llm_client.close()
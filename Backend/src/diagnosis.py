@@ -0,0 +1,85 @@
+from typing import Dict, List, Optional
+import logging
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def _label(name: str) -> str:
+    """Readable class label, e.g. stem_borer -> stem borer"""
+    return " ".join(name.replace("_", " ").split())
+
+
+def summarize_diagnosis(
+    disease_result: Optional[Dict],
+    pest_result: Optional[Dict],
+    disease_threshold: float = 50.0,
+    pest_threshold: float = 60.0
+) -> Dict:
+    """
+    Merge disease and pest predictions for one photo into a single verdict
+
+    The pest model has no "no pest" class, so a pest is only reported when
+    its confidence reaches `pest_threshold`.
+
+    Args:
+        disease_result: DiseaseModel result dictionary
+        pest_result: PestModel result dictionary
+        disease_threshold: Minimum confidence (%) to report a disease
+        pest_threshold: Minimum confidence (%) to report a pest
+    Returns: Dictionary with status, message, plant, and the problems found
+    """
+    disease_ok = bool(disease_result and disease_result.get("success"))
+    pest_ok = bool(pest_result and pest_result.get("success"))
+
+    plant = _label(disease_result["plant"]) if disease_ok else None
+    healthy = disease_ok and disease_result["is_healthy"]
+    disease_found = (
+        disease_ok and not healthy and disease_result["confidence"] >= disease_threshold
+    )
+    pest_found = pest_ok and pest_result["confidence"] >= pest_threshold
+
+    problems: List[Dict] = []
+    if disease_found:
+        problems.append({
+            "type": "disease",
+            "name": _label(disease_result["disease"]),
+            "confidence": disease_result["confidence"]
+        })
+    if pest_found:
+        problems.append({
+            "type": "pest",
+            "name": _label(pest_result["predicted_pest"]),
+            "confidence": pest_result["confidence"]
+        })
+
+    subject = f"{plant} leaf" if plant else "Leaf"
+    if disease_found and pest_found:
+        status = "disease_and_pests"
+        message = f"{problems[0]['name']} on {subject.lower()} and {problems[1]['name']} detected"
+    elif disease_found:
+        status = "disease"
+        message = f"{problems[0]['name']} detected on {subject.lower()}"
+    elif pest_found and healthy:
+        status = "pests"
+        message = f"Healthy {subject.lower()} but {problems[0]['name']} detected"
+    elif pest_found:
+        status = "pests"
+        message = f"{problems[0]['name'].capitalize()} detected"
+    elif healthy:
+        status = "healthy"
+        message = f"Healthy {subject.lower()}, no pests detected"
+    elif disease_ok or pest_ok:
+        status = "uncertain"
+        message = "No confident diagnosis; try a closer, well-lit photo"
+    else:
+        status = "failed"
+        message = "The image could not be analysed"
+
+    return {
+        "status": status,
+        "message": message,
+        "plant": plant,
+        "is_healthy": status == "healthy",
+        "problems": problems
+    }
@@ -1,13 +1,16 @@
 import tensorflow as tf
 import numpy as np
 from tensorflow.keras.models import load_model
-from tensorflow.keras.preprocessing import image
-from PIL import Image
-import io
 import os
-from typing import Dict, Union, Tuple
+from typing import Dict, List, Optional, Union, Tuple
 import logging
 
+from src.runners import EXPORTED_RUNNERS, create_runner, exported_model_path
+from src.metrics import metrics
+from src.preprocessing import DISEASE_INPUT, decode_image, draft_size, prepare_into, preprocess
+from src.tta import TTAPolicy, average_logits, make_views
+from src.cascade import fast_model_path, load_cascade
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
@@ -55,20 +58,67 @@ CLASS_DICT = {
 class DiseaseModel:
     """Disease detection model wrapper"""
     
-    def __init__(self, model_path: str = "Backend/models/disease_classifier.h5"):
-        self.model_path = model_path
+    def __init__(
+        self,
+        model_path: Optional[str] = None,
+        runner: Optional[str] = None,
+        runner_path: Optional[str] = None,
+        cascade_path: Optional[str] = None
+    ):
+        """
+        Args:
+            model_path: Keras model file; defaults to DISEASE_MODEL_PATH, then
+                Backend/models/disease_classifier.h5
+            runner: Inference backend (see src.runners.RUNNERS); defaults to
+                DISEASE_RUNNER, then MODEL_RUNNER, then "keras"
+            runner_path: Exported model for the tflite/onnx runners; defaults to
+                DISEASE_RUNNER_PATH, then the file next to model_path
+            cascade_path: Distilled fast model answering confident images first;
+                defaults to DISEASE_CASCADE_PATH, or the .fast.keras file next to
+                model_path when MODEL_CASCADE=true. Unset disables the cascade.
+        """
+        self.model_path = model_path or os.environ.get("DISEASE_MODEL_PATH", "Backend/models/disease_classifier.h5")
         self.model = None
+        self.runner = None
+        self.runner_name = runner or os.environ.get("DISEASE_RUNNER", os.environ.get("MODEL_RUNNER", "keras"))
+        self.runner_path = runner_path or os.environ.get("DISEASE_RUNNER_PATH")
+        self.cascade_path = cascade_path or os.environ.get("DISEASE_CASCADE_PATH") or (
+            fast_model_path(self.model_path)
+            if os.environ.get("MODEL_CASCADE", "false").lower() in ("1", "true", "yes") else None
+        )
+        # Minimum fast-model confidence (%) to answer without the full model
+        self.cascade_threshold = float(os.environ.get("DISEASE_CASCADE_THRESHOLD", os.environ.get("CASCADE_THRESHOLD", 90)))
+        self.cascade = None
         self.target_size = (256, 256)
+        self.input_spec = DISEASE_INPUT
+        # Test-time augmentation: TTA_VIEWS views per prediction unless the
+        # caller asks otherwise (1 = single crop)
+        self.tta_views = int(os.environ.get("TTA_VIEWS", 1))
+        self.tta = TTAPolicy(
+            max_views=int(os.environ.get("TTA_MAX_VIEWS", 8)),
+            budget_ms=float(os.environ.get("TTA_BUDGET_MS", 150)),
+            max_load=int(os.environ.get("TTA_MAX_LOAD", 4))
+        )
         self.load_model()
+        if self.cascade_path:
+            self.cascade = load_cascade(self.cascade_path, self.cascade_threshold, "disease")
         self.class_names = CLASS_DICT
     
     def load_model(self):
-        """Load the trained model"""
+        """Load the trained model and its inference runner"""
         try:
+            if self.runner_name in EXPORTED_RUNNERS:
+                # The exported model replaces Keras entirely
+                self.runner_path = self.runner_path or exported_model_path(self.model_path, self.runner_name)
+                self.runner = create_runner(self.runner_name, path=self.runner_path)
+                logger.info(f"Disease model loaded successfully from {self.runner_path} ({self.runner_name})")
+                return
+            
             if not os.path.exists(self.model_path):
                 raise FileNotFoundError(f"Model file not found: {self.model_path}")
             self.model = load_model(self.model_path)
-            logger.info(f"Disease model loaded successfully from {self.model_path}")
+            self.runner = create_runner(self.runner_name, model=self.model, input_shape=(*self.target_size, 3))
+            logger.info(f"Disease model loaded successfully from {self.model_path} ({self.runner_name})")
         except Exception as e:
             logger.error(f"Error loading disease model: {e}")
             raise
@@ -81,75 +131,146 @@ class DiseaseModel:
         Returns: Preprocessed image array
         """
         try:
-            if isinstance(img_input, bytes):
-                img = Image.open(io.BytesIO(img_input))
-            else:
-                img = Image.open(img_input)
-            
-            # Convert to RGB if necessary
-            if img.mode != 'RGB':
-                img = img.convert('RGB')
-            
-            # Resize
-            img = img.resize(self.target_size)
-            
-            # Convert to array and normalize
-            img_array = np.array(img, dtype=np.float32)
-            img_array = img_array / 255.0
-            img_array = np.expand_dims(img_array, axis=0)
-            
-            return img_array
+            with metrics.time("preprocess", component="disease"):
+                return preprocess(img_input, self.input_spec)
+        except Exception as e:
+            logger.error(f"Error preprocessing image: {e}")
+            raise ValueError(f"Failed to preprocess image: {str(e)}")
+    
+    def preprocess_into(self, img_input: Union[str, bytes], out: np.ndarray) -> np.ndarray:
+        """
+        Preprocess an image directly into one row of a batch buffer
+
+        Args:
+            img_input: Either file path (str) or image bytes
+            out: float32 array of shape (256, 256, 3)
+        Returns: out
+        """
+        try:
+            with metrics.time("preprocess", component="disease"):
+                img = decode_image(img_input, draft_size([self.input_spec]))
+                return prepare_into(img, self.input_spec, out)
         except Exception as e:
             logger.error(f"Error preprocessing image: {e}")
             raise ValueError(f"Failed to preprocess image: {str(e)}")
     
-    def predict(self, img_input: Union[str, bytes]) -> Dict:
+    def preprocess_views(self, img_input: Union[str, bytes], views: int) -> np.ndarray:
+        """
+        Decode an image once and preprocess its test-time augmentation views
+
+        Args:
+            img_input: Either file path (str) or image bytes
+            views: Number of crops/flips (see src.tta.VIEWS)
+        Returns: Array of shape (views, 256, 256, 3)
+        """
+        try:
+            with metrics.time("preprocess", component="disease"):
+                img = decode_image(img_input, draft_size([self.input_spec]))
+                return make_views(img, self.input_spec, views)
+        except Exception as e:
+            logger.error(f"Error preprocessing image: {e}")
+            raise ValueError(f"Failed to preprocess image: {str(e)}")
+    
+    def predict_views(self, views_array: np.ndarray) -> Dict:
+        """
+        Predict one image from its augmentation views in a single forward pass
+
+        Args: views_array: Array of shape (views, 256, 256, 3) from preprocess_views
+        Returns: Dictionary with prediction results from the averaged logits
+        """
+        if self.runner is None:
+            raise RuntimeError("Model not loaded")
+        
+        metrics.observe(metrics.batch_size, len(views_array), component="disease")
+        with metrics.time("forward", component="disease"):
+            predictions = self.runner.predict(views_array)
+        with metrics.time("postprocess", component="disease"):
+            return self._format_prediction(average_logits(predictions))
+    
+    def predict(self, img_input: Union[str, bytes], tta: Optional[int] = None, load: int = 0) -> Dict:
         """
         Predict disease from image
 
-        Args: img_input: Either file path or image bytes
+        Args:
+            img_input: Either file path or image bytes
+            tta: Test-time augmentation views (defaults to TTA_VIEWS); reduced
+                to fit the latency budget, or to 1 when the model is busy
+            load: Images waiting elsewhere for this model, e.g. a batch queue
         Returns: Dictionary with prediction results
         """
         try:
-            if self.model is None:
+            if self.runner is None:
                 raise RuntimeError("Model not loaded")
             
-            # Preprocess
-            img_array = self.preprocess_image(img_input)
-            
-            # Predict
-            predictions = self.model.predict(img_array, verbose=0)
-            pred_index = int(np.argmax(predictions[0]))
-            confidence = float(np.max(predictions[0])) * 100
-            top_3_indices = np.argsort(predictions[0])[-3:][::-1]
-            top_3_predictions = [
-                {
-                    "pest": self.class_names[i],
-                    "confidence": round(float(predictions[0][i]) * 100, 2)
-                }
-                for i in top_3_indices
-            ]
-            
-            # Get class label
-            class_name = CLASS_DICT.get(pred_index, "Unknown")
-            
-            # Extract plant and disease information
-            parts = class_name.split("___")
-            plant = parts[0] if len(parts) > 0 else "Unknown"
-            disease = parts[1] if len(parts) > 1 else "Unknown"
+            requested = self.tta_views if tta is None else tta
+            views, fallback = self.tta.plan(requested, load)
+            if views > 1:
+                with self.tta.track(views):
+                    result = self.predict_views(self.preprocess_views(img_input, views))
+            else:
+                # Preprocess and predict a single crop
+                result = self.predict_batch(self.preprocess_image(img_input))[0]
             
-            return {
-                "success": True,
-                "predicted_class": class_name,
-                "plant": plant,
-                "disease": disease,
-                "confidence": round(confidence, 2),
-                "is_healthy": "healthy" in disease.lower(),
-                "top_3_predictions": top_3_predictions
-            }
+            if requested > 1:
+                result["tta"] = {"requested": requested, "views": views, "fallback": fallback}
+            return result
         except Exception as e:
             logger.error(f"Prediction error: {e}")
             return {
                 "success": False,
                 "error": str(e)
-            }
\ No newline at end of file
+            }
+    
+    def predict_batch(self, img_array: np.ndarray) -> List[Dict]:
+        """
+        Predict diseases for a batch of preprocessed images in one forward pass
+
+        Args: img_array: Array of shape (N, 256, 256, 3) from preprocess_image
+        Returns: One result dictionary per image, in input order
+        """
+        if self.runner is None:
+            raise RuntimeError("Model not loaded")
+        
+        metrics.observe(metrics.batch_size, len(img_array), component="disease")
+        with metrics.time("forward", component="disease"):
+            if self.cascade is not None:
+                predictions, stages = self.cascade.predict(img_array, self.runner.predict)
+            else:
+                predictions, stages = self.runner.predict(img_array), None
+        with metrics.time("postprocess", component="disease"):
+            results = [self._format_prediction(probs) for probs in predictions]
+            if stages is not None:
+                for result, stage in zip(results, stages):
+                    result["stage"] = stage
+            return results
+    
+    def _format_prediction(self, probs: np.ndarray) -> Dict:
+        """Build the result dictionary for a single row of model output"""
+        pred_index = int(np.argmax(probs))
+        confidence = float(np.max(probs)) * 100
+        top_3_indices = np.argsort(probs)[-3:][::-1]
+        top_3_predictions = [
+            {
+                "pest": self.class_names[i],
+                "confidence": round(float(probs[i]) * 100, 2)
+            }
+            for i in top_3_indices
+        ]
+        
+        # Get class label
+        class_name = CLASS_DICT.get(pred_index, "Unknown")
+        
+        # Extract plant and disease information
+        parts = class_name.split("___")
+        plant = parts[0] if len(parts) > 0 else "Unknown"
+        disease = parts[1] if len(parts) > 1 else "Unknown"
+        
+        return {
+            "success": True,
+            "predicted_class": class_name,
+            "plant": plant,
+            "disease": disease,
+            "confidence": round(confidence, 2),
+            "is_healthy": "healthy" in disease.lower(),
+            "top_3_predictions": top_3_predictions
+        }
@@ -0,0 +1,259 @@
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Dict, List, Optional
+import numpy as np
+from langchain_core.embeddings import Embeddings
+import logging
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_text(text: str) -> str:
+    """Cache key form of a text: case-folded with whitespace collapsed"""
+    return _WHITESPACE.sub(" ", (text or "").casefold()).strip()
+
+
+class _DiskVectorStore:
+    """SQLite table of float16 vectors keyed by text hash"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL)")
+
+    def _connect(self) -> sqlite3.Connection:
+        """One connection per thread, as sqlite3 connections are not thread-safe"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5.0)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get_many(self, keys: List[str]) -> Dict[str, np.ndarray]:
+        if not keys:
+            return {}
+        placeholders = ",".join("?" * len(keys))
+        rows = self._connect().execute(
+            f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", keys
+        ).fetchall()
+        return {key: np.frombuffer(blob, dtype=np.float16) for key, blob in rows}
+
+    def set_many(self, items: Dict[str, np.ndarray]):
+        conn = self._connect()
+        with conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)",
+                [(key, vector.tobytes()) for key, vector in items.items()]
+            )
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Embedding layer in front of an encoder such as MiniLM.
+
+    - Vectors are cached by normalised text in an LRU (float16) and,
+      optionally, in a SQLite file shared across restarts.
+    - Cache misses from concurrent callers are collected for up to
+      `max_wait_ms` and encoded in one batched encoder call. The caller that
+      starts a batch encodes until its own texts are done, then hands what
+      is still pending to a background thread, so it is never kept busy
+      serving later arrivals.
+    """
+
+    def __init__(
+        self,
+        base: Embeddings,
+        max_entries: int = 10000,
+        cache_path: Optional[str] = None,
+        max_batch_size: int = 64,
+        max_wait_ms: float = 5
+    ):
+        """
+        Args:
+            base: Encoder whose embed_documents does the actual work
+            max_entries: Vectors kept in the in-memory LRU
+            cache_path: SQLite file for persistent vectors; None disables persistence
+            max_batch_size: Maximum texts sent to the encoder in one call
+            max_wait_ms: How long the first caller waits for others to join its batch
+        """
+        self.base = base
+        self.max_entries = max_entries
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self.disk = _DiskVectorStore(cache_path) if cache_path else None
+
+        self._cache: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._cache_lock = threading.Lock()
+
+        # Texts waiting for the encoder, texts being encoded (until their vectors
+        # are in the LRU), and whether a caller is already collecting them
+        self._pending: "OrderedDict[str, tuple]" = OrderedDict()
+        self._in_flight: Dict[str, Future] = {}
+        self._batch_lock = threading.Lock()
+        self._collecting = False
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.batches = 0
+        self.batched_texts = 0
+
+    @staticmethod
+    def _key(text: str) -> str:
+        return hashlib.sha1(normalize_text(text).encode("utf-8")).hexdigest()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys = [self._key(text) for text in texts]
+        vectors: Dict[str, np.ndarray] = {}
+
+        with self._cache_lock:
+            for key in keys:
+                vector = self._cache.get(key)
+                if vector is not None:
+                    self._cache.move_to_end(key)
+                    vectors[key] = vector
+            self.hits += sum(1 for key in keys if key in vectors)
+
+        missing = {key: text for key, text in zip(keys, texts) if key not in vectors}
+        if missing and self.disk is not None:
+            try:
+                stored = self.disk.get_many(list(missing))
+            except Exception as e:
+                logger.error(f"Error reading embedding cache: {e}")
+                stored = {}
+            if stored:
+                self._remember(stored, disk_hits=len(stored))
+                vectors.update(stored)
+                for key in stored:
+                    missing.pop(key)
+
+        if missing:
+            with self._cache_lock:
+                self.misses += len(missing)
+            futures = self._enqueue(missing)
+            for key, future in futures.items():
+                vectors[key] = future.result()
+
+        return [vectors[key].astype(np.float32).tolist() for key in keys]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+    def _remember(self, items: Dict[str, np.ndarray], disk_hits: int = 0):
+        with self._cache_lock:
+            self.disk_hits += disk_hits
+            for key, vector in items.items():
+                self._cache[key] = vector
+                self._cache.move_to_end(key)
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+
+    def _enqueue(self, texts: Dict[str, str]) -> Dict[str, Future]:
+        """Queue texts for encoding; the first caller to arrive encodes the batch"""
+        futures = {}
+        with self._batch_lock:
+            for key, text in texts.items():
+                if key in self._pending:
+                    futures[key] = self._pending[key][1]
+                elif key in self._in_flight:
+                    futures[key] = self._in_flight[key]
+                else:
+                    # Encoded and remembered since the caller's cache lookup
+                    with self._cache_lock:
+                        vector = self._cache.get(key)
+                    if vector is not None:
+                        futures[key] = Future()
+                        futures[key].set_result(vector)
+                        continue
+                    self._pending[key] = (text, Future())
+                    futures[key] = self._pending[key][1]
+            if all(future.done() for future in futures.values()):
+                return futures
+            lead = not self._collecting
+            self._collecting = True
+
+        if lead:
+            time.sleep(self.max_wait_ms / 1000.0)
+            self._drain(until=list(futures.values()))
+        return futures
+
+    def _drain(self, until: Optional[List[Future]] = None):
+        """Encode pending texts in batches until none are left, or (for a leading caller) until `until` are resolved"""
+        while True:
+            with self._batch_lock:
+                if not self._pending:
+                    self._collecting = False
+                    return
+                if until is not None and all(future.done() for future in until):
+                    # Leadership passes to a worker that drains the rest
+                    threading.Thread(target=self._drain, name="embedding-batcher", daemon=True).start()
+                    return
+                batch = []
+                while self._pending and len(batch) < self.max_batch_size:
+                    key, (text, future) = self._pending.popitem(last=False)
+                    self._in_flight[key] = future
+                    batch.append((key, (text, future)))
+
+            try:
+                encoded = self.base.embed_documents([text for _, (text, _) in batch])
+                if len(encoded) != len(batch):
+                    raise ValueError(f"Encoder returned {len(encoded)} vectors for {len(batch)} texts")
+                items = {key: np.asarray(vector, dtype=np.float16) for (key, _), vector in zip(batch, encoded)}
+            except Exception as e:
+                logger.error(f"Error embedding batch of {len(batch)}: {e}")
+                self._finish(batch)
+                for _, (_, future) in batch:
+                    future.set_exception(e)
+                continue
+
+            self._remember(items)
+            if self.disk is not None:
+                try:
+                    self.disk.set_many(items)
+                except Exception as e:
+                    logger.error(f"Error writing embedding cache: {e}")
+            self.batches += 1
+            self.batched_texts += len(batch)
+            # Remembered above, so later callers find these keys in the LRU
+            self._finish(batch)
+            for key, (_, future) in batch:
+                future.set_result(items[key])
+
+    def _finish(self, batch: List[tuple]):
+        """Stop tracking a batch as in flight"""
+        with self._batch_lock:
+            for key, _ in batch:
+                self._in_flight.pop(key, None)
+
+    def stats(self) -> Dict:
+        with self._cache_lock:
+            entries = len(self._cache)
+            cache_bytes = sum(vector.nbytes for vector in self._cache.values())
+        lookups = self.hits + self.disk_hits + self.misses
+        return {
+            "entries": entries,
+            "max_entries": self.max_entries,
+            "cache_bytes": cache_bytes,
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": round((self.hits + self.disk_hits) / lookups, 4) if lookups else 0.0,
+            "batches": self.batches,
+            "mean_batch_size": round(self.batched_texts / self.batches, 2) if self.batches else 0.0,
+            "persistent": self.disk is not None
+        }
@@ -0,0 +1,114 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from functools import partial
+from typing import Callable, Dict, Optional
+import logging
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def parse_limits(spec: str) -> Dict[str, int]:
+    """
+    Parse per-endpoint concurrency limits
+
+    Args: spec: Comma separated "endpoint=limit" pairs, e.g. "chatbot=8,weather=16"
+    Returns: Mapping of endpoint name to limit
+    """
+    limits = {}
+    for item in (spec or "").split(","):
+        item = item.strip()
+        if not item:
+            continue
+        name, _, value = item.partition("=")
+        try:
+            limits[name.strip()] = int(value)
+        except ValueError:
+            logger.warning(f"Ignoring invalid concurrency limit: {item}")
+    return limits
+
+
+class ExecutorPool:
+    """
+    Executors that keep blocking work off the FastAPI event loop.
+
+    - io_executor: thread pool for blocking network calls (LLM, weather API)
+    - decode_executor: thread pool for image decoding and preprocessing
+    - inference_executor: dedicated thread(s) for TensorFlow forward passes
+    - priority_executor: small thread pool for cheap calls (weather) that
+      must not wait behind slow LLM calls on the I/O pool
+    - shadow_executor: thread(s) for shadow model versions, so mirrored
+      traffic never queues on the inference thread
+
+    Each endpoint can additionally be capped to a number of concurrent calls.
+    """
+
+    def __init__(
+        self,
+        io_workers: int = 16,
+        decode_workers: int = 4,
+        inference_workers: int = 1,
+        priority_workers: int = 4,
+        shadow_workers: int = 1,
+        endpoint_limits: Optional[Dict[str, int]] = None
+    ):
+        self.io_executor = ThreadPoolExecutor(max_workers=io_workers, thread_name_prefix="io")
+        self.decode_executor = ThreadPoolExecutor(max_workers=decode_workers, thread_name_prefix="decode")
+        self.inference_executor = ThreadPoolExecutor(max_workers=inference_workers, thread_name_prefix="inference")
+        self.priority_executor = ThreadPoolExecutor(max_workers=priority_workers, thread_name_prefix="priority")
+        self.shadow_executor = ThreadPoolExecutor(max_workers=shadow_workers, thread_name_prefix="shadow")
+        self.endpoint_limits = dict(endpoint_limits or {})
+        self._semaphores: Dict[str, asyncio.Semaphore] = {}
+        self._in_flight: Dict[str, int] = {}
+        logger.info(
+            f"Executor pool started (io={io_workers}, decode={decode_workers}, "
+            f"inference={inference_workers}, priority={priority_workers}, shadow={shadow_workers}, "
+            f"limits={self.endpoint_limits})"
+        )
+
+    @asynccontextmanager
+    async def limit(self, endpoint: str):
+        """Hold one of the endpoint's concurrency slots for the duration of the block"""
+        semaphore = self._semaphores.get(endpoint)
+        if semaphore is None and endpoint in self.endpoint_limits:
+            semaphore = self._semaphores[endpoint] = asyncio.Semaphore(self.endpoint_limits[endpoint])
+
+        if semaphore is not None:
+            await semaphore.acquire()
+        self._in_flight[endpoint] = self._in_flight.get(endpoint, 0) + 1
+        try:
+            yield
+        finally:
+            self._in_flight[endpoint] -= 1
+            if semaphore is not None:
+                semaphore.release()
+
+    async def run_io(self, endpoint: str, func: Callable, *args, **kwargs):
+        """Run a blocking I/O-bound call on the I/O thread pool"""
+        async with self.limit(endpoint):
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.io_executor, partial(func, *args, **kwargs))
+
+    async def run_priority(self, endpoint: str, func: Callable, *args, **kwargs):
+        """Run a short blocking call on the priority thread pool"""
+        async with self.limit(endpoint):
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.priority_executor, partial(func, *args, **kwargs))
+
+    def stats(self) -> Dict:
+        """Current in-flight counts and configured limits per endpoint"""
+        return {
+            endpoint: {
+                "in_flight": self._in_flight.get(endpoint, 0),
+                "limit": self.endpoint_limits.get(endpoint)
+            }
+            for endpoint in sorted(set(self._in_flight) | set(self.endpoint_limits))
+        }
+
+    def shutdown(self):
+        """Shut down all executors without waiting for queued work"""
+        for executor in (
+            self.io_executor, self.decode_executor, self.inference_executor, self.priority_executor, self.shadow_executor
+        ):
+            executor.shutdown(wait=False)
@@ -0,0 +1,548 @@
+import asyncio
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from typing import Any, AsyncIterator, Callable, Dict, Optional
+import numpy as np
+import logging
+
+from langchain_core.messages import BaseMessage
+from langchain_core.runnables import Runnable, RunnableConfig
+
+from src.admission import request_deadline
+from src.metrics import metrics
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+LLM_EVENTS = ("call", "coalesced", "retry", "hedge", "hedge_win", "timeout", "overloaded", "failure")
+
+llm_events = metrics.counter("krishimitra_llm_events_total", "LLM client calls, retries, hedges and failures, by event")
+
+
+class LLMError(Exception):
+    """The LLM could not answer; retry_after is a hint in whole seconds"""
+
+    def __init__(self, message: str, retry_after: int = 1):
+        self.retry_after = retry_after
+        super().__init__(message)
+
+
+class LLMOverloaded(LLMError):
+    """No concurrency slot came free before the call's deadline"""
+
+
+class LLMTimeout(LLMError):
+    """The call's deadline passed while the LLM was answering"""
+
+
+class LLMUnavailable(LLMError):
+    """The LLM kept failing, or failed in a way a retry cannot fix"""
+
+
+def is_retryable(error: BaseException) -> bool:
+    """
+    Whether a failed LLM call may succeed when repeated
+
+    Network errors and timeouts are retried; HTTP errors only for 408, 429 and 5xx.
+    """
+    status = getattr(error, "status", None)
+    if not isinstance(status, int):
+        status = getattr(getattr(error, "response", None), "status_code", None)
+    if isinstance(status, int):
+        return status in (408, 429) or status >= 500
+    return not isinstance(error, (ValueError, TypeError, KeyError))
+
+
+def _prompt_key(kind: str, input: Any, kwargs: Dict) -> str:
+    """Hash of a prompt (a PromptValue, string or message list) and call options"""
+    if hasattr(input, "to_messages"):
+        input = input.to_messages()
+    if isinstance(input, list):
+        input = [
+            [message.type, message.content] if isinstance(message, BaseMessage) else message
+            for message in input
+        ]
+    payload = json.dumps([kind, input, kwargs], sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class LatencyWindow:
+    """Recent latencies of successful calls, for the hedging threshold"""
+
+    def __init__(self, size: int = 200):
+        self._values = deque(maxlen=size)
+
+    def add(self, seconds: float):
+        self._values.append(seconds)
+
+    def __len__(self) -> int:
+        return len(self._values)
+
+    def percentile(self, q: float) -> Optional[float]:
+        if not self._values:
+            return None
+        return float(np.percentile(np.fromiter(self._values, dtype=np.float64), q))
+
+    def stats(self) -> Dict:
+        if not self._values:
+            return {"samples": 0}
+        values = np.fromiter(self._values, dtype=np.float64) * 1000
+        return {
+            "samples": len(values),
+            "p50_ms": round(float(np.percentile(values, 50)), 2),
+            "p95_ms": round(float(np.percentile(values, 95)), 2),
+            "p99_ms": round(float(np.percentile(values, 99)), 2)
+        }
+
+
+class _Shared:
+    """An in-flight call (or stream) and the callers waiting for it"""
+
+    def __init__(self):
+        self.task: Optional[asyncio.Task] = None
+        self.subscribers = 0
+        # Streams only: chunks so far, and an event replaced after every chunk
+        self.chunks = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.changed = asyncio.Event()
+
+    def publish(self):
+        event, self.changed = self.changed, asyncio.Event()
+        event.set()
+
+
+class _Stream:
+    """A started streaming attempt: its first chunk, the rest, and its slot"""
+
+    def __init__(self, first, chunks, release: Callable[[], None]):
+        self.first = first
+        self.chunks = chunks
+        self._release = release
+
+    async def close(self):
+        try:
+            await self.chunks.aclose()
+        finally:
+            self._release()
+
+
+class LLMClient(Runnable):
+    """
+    Chat model wrapper that keeps the LLM endpoint within its limits.
+
+    - At most `max_concurrency` calls reach the endpoint at once; the rest
+      wait, up to their deadline, and fail with LLMOverloaded after it.
+    - Every call has a deadline (`timeout`, or the request's admission
+      deadline if sooner) covering queueing, attempts and backoff.
+    - Failed attempts are retried `retries` times with full-jitter
+      exponential backoff, unless the error cannot be fixed by retrying.
+    - Optionally, a call slower than the `hedge_percentile` of recent
+      latencies (time to first token for streams) gets a second, hedged
+      attempt if a slot is free; the first one to answer wins.
+    - Identical prompts already in flight are answered by that call (or
+      stream) instead of reaching the endpoint again.
+
+    Calls run on a private event loop thread, so sync (chain.invoke from a
+    worker thread) and async callers share one set of limits.
+    """
+
+    def __init__(
+        self,
+        model: Runnable,
+        max_concurrency: int = 8,
+        timeout: float = 60.0,
+        retries: int = 2,
+        backoff_base: float = 0.5,
+        backoff_max: float = 8.0,
+        hedge_percentile: Optional[float] = None,
+        hedge_min_samples: int = 20,
+        coalesce: bool = True
+    ):
+        """
+        Args:
+            model: Chat model (e.g. ChatHuggingFace) with ainvoke and astream
+            max_concurrency: Calls allowed to reach the endpoint at once
+            timeout: Seconds a call may take in total
+            retries: Extra attempts after a retryable failure
+            backoff_base: Backoff ceiling (seconds) before the first retry; doubles per retry
+            backoff_max: Largest backoff ceiling in seconds
+            hedge_percentile: Latency percentile (e.g. 95) after which a hedged
+                attempt starts; None disables hedging
+            hedge_min_samples: Successful calls measured before hedging starts
+            coalesce: Share in-flight calls with identical prompts
+        """
+        self.model = model
+        self.max_concurrency = max(1, max_concurrency)
+        self.timeout = timeout
+        self.retries = max(0, retries)
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_samples = hedge_min_samples
+        self.coalesce = coalesce
+        self.latency = LatencyWindow()
+        self.first_token = LatencyWindow()
+        self.events = {event: 0 for event in LLM_EVENTS}
+        self.active = 0
+        self.waiting = 0
+        self._inflight: Dict[str, _Shared] = {}
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def _submit(self, coro) -> Future:
+        """Run a coroutine on the private event loop, starting it on first use"""
+        if self._loop is None:
+            with self._lock:
+                if self._loop is None:
+                    loop = asyncio.new_event_loop()
+                    self._thread = threading.Thread(target=loop.run_forever, name="llm-client", daemon=True)
+                    self._thread.start()
+                    self._semaphore = asyncio.run_coroutine_threadsafe(self._make_semaphore(), loop).result()
+                    self._loop = loop
+        return asyncio.run_coroutine_threadsafe(coro, self._loop)
+
+    async def _make_semaphore(self) -> asyncio.Semaphore:
+        return asyncio.Semaphore(self.max_concurrency)
+
+    def close(self):
+        """Stop the private event loop; calls still running are cancelled"""
+        with self._lock:
+            loop, self._loop = self._loop, None
+        if loop is not None:
+            try:
+                asyncio.run_coroutine_threadsafe(self._shutdown(), loop).result(timeout=5)
+            except Exception as e:
+                logger.warning(f"Error stopping LLM client: {e}")
+            loop.call_soon_threadsafe(loop.stop)
+            self._thread.join(timeout=5)
+            loop.close()
+
+    async def _shutdown(self):
+        tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await asyncio.get_running_loop().shutdown_asyncgens()
+
+    def _deadline(self, async_caller: bool = False) -> float:
+        """Monotonic deadline of a new call"""
+        timeout = self.timeout
+        if async_caller:
+            # The admission deadline is in the caller's event loop time
+            deadline = request_deadline.get()
+            if deadline is not None:
+                timeout = min(timeout, deadline - asyncio.get_running_loop().time())
+        return time.monotonic() + timeout
+
+    def _count(self, event: str):
+        self.events[event] += 1
+        if metrics.enabled:
+            llm_events.inc(event=event)
+
+    def invoke(self, input: Any, config: Optional[RunnableConfig] = None, **kwargs) -> BaseMessage:
+        return self._submit(self._call(input, config, kwargs, self._deadline())).result()
+
+    async def ainvoke(self, input: Any, config: Optional[RunnableConfig] = None, **kwargs) -> BaseMessage:
+        return await asyncio.wrap_future(self._submit(self._call(input, config, kwargs, self._deadline(True))))
+
+    async def astream(self, input: Any, config: Optional[RunnableConfig] = None, **kwargs) -> AsyncIterator:
+        caller = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue()
+
+        def put(item):
+            caller.call_soon_threadsafe(queue.put_nowait, item)
+
+        future = self._submit(self._pump(input, config, kwargs, self._deadline(True), put))
+        try:
+            while True:
+                kind, value = await queue.get()
+                if kind == "chunk":
+                    yield value
+                elif kind == "error":
+                    raise value
+                else:
+                    return
+        finally:
+            # Stops the stream if the consumer leaves early
+            future.cancel()
+
+    def _remaining(self, deadline: float) -> float:
+        return deadline - time.monotonic()
+
+    async def _acquire(self, deadline: float):
+        """Take a concurrency slot, waiting no longer than the deadline"""
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), max(0.0, self._remaining(deadline)))
+        except asyncio.TimeoutError:
+            self._count("overloaded")
+            raise LLMOverloaded(
+                f"LLM busy: no slot free within the deadline ({self.max_concurrency} calls in flight)",
+                retry_after=max(1, round(self.latency.percentile(50) or 1))
+            )
+        finally:
+            self.waiting -= 1
+        self.active += 1
+
+    def _release(self):
+        self.active -= 1
+        self._semaphore.release()
+
+    def _timed_out(self) -> LLMTimeout:
+        self._count("timeout")
+        return LLMTimeout(f"LLM did not answer within {self.timeout:g}s")
+
+    async def _call(self, input: Any, config, kwargs: Dict, deadline: float) -> BaseMessage:
+        self._count("call")
+        if not self.coalesce:
+            return await self._invoke(input, config, kwargs, deadline)
+
+        key = _prompt_key("invoke", input, kwargs)
+        shared = self._inflight.get(key)
+        if shared is None:
+            shared = self._inflight[key] = _Shared()
+            shared.task = asyncio.ensure_future(self._invoke(input, config, kwargs, deadline))
+            shared.task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        else:
+            self._count("coalesced")
+        shared.subscribers += 1
+        try:
+            return await asyncio.wait_for(asyncio.shield(shared.task), max(0.0, self._remaining(deadline)))
+        except asyncio.TimeoutError:
+            raise self._timed_out()
+        finally:
+            shared.subscribers -= 1
+            if not shared.subscribers and not shared.task.done():
+                shared.task.cancel()
+
+    async def _invoke(self, input: Any, config, kwargs: Dict, deadline: float) -> BaseMessage:
+        async def attempt():
+            await self._acquire(deadline)
+            start = time.monotonic()
+            try:
+                result = await asyncio.wait_for(
+                    self.model.ainvoke(input, config, **kwargs), max(0.0, self._remaining(deadline))
+                )
+            except asyncio.TimeoutError:
+                raise self._timed_out()
+            finally:
+                self._release()
+            self.latency.add(time.monotonic() - start)
+            return result
+
+        return await self._with_retries(lambda: self._hedged(attempt, self.latency), deadline)
+
+    async def _with_retries(self, call: Callable, deadline: float):
+        """Repeat `call` after retryable failures, with full-jitter exponential backoff"""
+        retry = 0
+        while True:
+            try:
+                return await call()
+            except LLMError:
+                raise
+            except Exception as e:
+                delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** retry))
+                if not is_retryable(e) or retry >= self.retries or self._remaining(deadline) <= delay:
+                    self._count("failure")
+                    logger.error(f"LLM call failed after {retry + 1} attempt(s): {e}")
+                    raise LLMUnavailable(f"LLM request failed: {e}") from e
+                retry += 1
+                self._count("retry")
+                logger.warning(f"LLM attempt failed ({e}); retry {retry}/{self.retries} in {delay:.2f}s")
+                await asyncio.sleep(delay)
+
+    def hedge_delay(self, window: LatencyWindow) -> Optional[float]:
+        """Seconds after which a call gets a hedged attempt, if hedging is on and warmed up"""
+        if self.hedge_percentile is None or len(window) < self.hedge_min_samples:
+            return None
+        return window.percentile(self.hedge_percentile)
+
+    async def _hedged(self, attempt: Callable, window: LatencyWindow, discard: Optional[Callable] = None):
+        """
+        Run `attempt`, plus a second copy if the first is slower than the hedge delay
+
+        Args:
+            attempt: Coroutine function making one attempt
+            window: Latencies the hedge delay is taken from
+            discard: Coroutine function cleaning up the losing attempt's result
+        Returns: The result of whichever attempt succeeded first
+        """
+        first = asyncio.ensure_future(attempt())
+        delay = self.hedge_delay(window)
+        if delay is None:
+            return await first
+        tasks = [first]
+        winner = None
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            # Hedges only use spare capacity; they never queue
+            if not done and not self._semaphore.locked():
+                self._count("hedge")
+                tasks.append(asyncio.ensure_future(attempt()))
+            pending = set(tasks)
+            while pending and winner is None:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                winner = next((task for task in tasks if task in done and task.exception() is None), None)
+            if winner is None:
+                # Every attempt failed: report the original one
+                return first.result()
+            if winner is not first:
+                self._count("hedge_win")
+            return winner.result()
+        finally:
+            losers = [task for task in tasks if task is not winner]
+            for task in losers:
+                task.cancel()
+            if losers:
+                await asyncio.wait(losers)
+            for task in losers:
+                # Both attempts may have finished; the loser's result still needs cleaning up
+                if not task.cancelled() and task.exception() is None and discard is not None:
+                    await discard(task.result())
+
+    async def _pump(self, input: Any, config, kwargs: Dict, deadline: float, put: Callable):
+        """Forward a (possibly shared) stream's chunks to the caller's loop"""
+        try:
+            async for chunk in self._subscribe(input, config, kwargs, deadline):
+                put(("chunk", chunk))
+            put(("end", None))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            put(("error", e))
+
+    async def _subscribe(self, input: Any, config, kwargs: Dict, deadline: float):
+        self._count("call")
+        key = _prompt_key("stream", input, kwargs) if self.coalesce else None
+        shared = self._inflight.get(key) if key else None
+        if shared is None:
+            shared = _Shared()
+            shared.task = asyncio.ensure_future(self._produce(shared, input, config, kwargs, deadline))
+            if key:
+                self._inflight[key] = shared
+                shared.task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        else:
+            self._count("coalesced")
+        shared.subscribers += 1
+        try:
+            position = 0
+            while True:
+                # Late subscribers first catch up on the chunks sent so far
+                while position < len(shared.chunks):
+                    yield shared.chunks[position]
+                    position += 1
+                if shared.done:
+                    if shared.error is not None:
+                        raise shared.error
+                    return
+                try:
+                    await asyncio.wait_for(shared.changed.wait(), max(0.0, self._remaining(deadline)))
+                except asyncio.TimeoutError:
+                    raise self._timed_out()
+        finally:
+            shared.subscribers -= 1
+            if not shared.subscribers and not shared.task.done():
+                shared.task.cancel()
+
+    async def _produce(self, shared: _Shared, input: Any, config, kwargs: Dict, deadline: float):
+        try:
+            stream = await self._with_retries(
+                lambda: self._hedged(lambda: self._open(input, config, kwargs, deadline), self.first_token, _Stream.close),
+                deadline
+            )
+            try:
+                shared.chunks.append(stream.first)
+                shared.publish()
+                while True:
+                    try:
+                        chunk = await asyncio.wait_for(stream.chunks.__anext__(), max(0.0, self._remaining(deadline)))
+                    except StopAsyncIteration:
+                        break
+                    except asyncio.TimeoutError:
+                        raise self._timed_out()
+                    shared.chunks.append(chunk)
+                    shared.publish()
+            finally:
+                await stream.close()
+        except asyncio.CancelledError:
+            shared.error = LLMTimeout("LLM stream cancelled")
+            raise
+        except LLMError as e:
+            shared.error = e
+        except Exception as e:
+            # Chunks were already sent, so the stream cannot be retried
+            self._count("failure")
+            logger.error(f"LLM stream failed: {e}")
+            shared.error = LLMUnavailable(f"LLM stream failed: {e}")
+        finally:
+            shared.done = True
+            shared.publish()
+
+    async def _open(self, input: Any, config, kwargs: Dict, deadline: float) -> _Stream:
+        """Take a slot, start streaming and wait for the first chunk"""
+        await self._acquire(deadline)
+        start = time.monotonic()
+        chunks = self.model.astream(input, config, **kwargs)
+        try:
+            first = await asyncio.wait_for(chunks.__anext__(), max(0.0, self._remaining(deadline)))
+        except BaseException as e:
+            try:
+                await chunks.aclose()
+            finally:
+                self._release()
+            if isinstance(e, asyncio.TimeoutError):
+                raise self._timed_out()
+            if isinstance(e, StopAsyncIteration):
+                raise LLMUnavailable("LLM returned an empty stream")
+            raise
+        self.first_token.add(time.monotonic() - start)
+        return _Stream(first, chunks, self._release)
+
+    def stats(self) -> Dict:
+        return {
+            "max_concurrency": self.max_concurrency,
+            "timeout_s": self.timeout,
+            "retries": self.retries,
+            "hedge_percentile": self.hedge_percentile,
+            "hedge_delay_ms": {
+                name: round(delay * 1000, 2) if delay is not None else None
+                for name, delay in (("invoke", self.hedge_delay(self.latency)), ("stream", self.hedge_delay(self.first_token)))
+            },
+            "coalesce": self.coalesce,
+            "active": self.active,
+            "waiting": self.waiting,
+            "events": dict(self.events),
+            "latency": self.latency.stats(),
+            "first_token": self.first_token.stats()
+        }
+
+
+def create_llm_client(model: Runnable) -> LLMClient:
+    """
+    LLMClient configured from the environment
+
+    LLM_MAX_CONCURRENCY, LLM_TIMEOUT (s), LLM_RETRIES, LLM_BACKOFF_MS,
+    LLM_BACKOFF_MAX_MS, LLM_HEDGE_PERCENTILE (unset disables hedging),
+    LLM_HEDGE_MIN_SAMPLES and LLM_COALESCE.
+    """
+    hedge = os.getenv("LLM_HEDGE_PERCENTILE", "").strip()
+    return LLMClient(
+        model,
+        max_concurrency=int(os.getenv("LLM_MAX_CONCURRENCY", 8)),
+        timeout=float(os.getenv("LLM_TIMEOUT", 60)),
+        retries=int(os.getenv("LLM_RETRIES", 2)),
+        backoff_base=float(os.getenv("LLM_BACKOFF_MS", 500)) / 1000.0,
+        backoff_max=float(os.getenv("LLM_BACKOFF_MAX_MS", 8000)) / 1000.0,
+        hedge_percentile=float(hedge) if hedge else None,
+        hedge_min_samples=int(os.getenv("LLM_HEDGE_MIN_SAMPLES", 20)),
+        coalesce=os.getenv("LLM_COALESCE", "true").lower() not in ("0", "false", "no")
+    )
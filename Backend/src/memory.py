@@ -0,0 +1,214 @@
+import re
+import threading
+from collections import deque
+from typing import Callable, Deque, Dict, List, Optional, Tuple
+import logging
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+MEMORY_MODES = ("buffer", "window", "summary", "relevance")
+
+_TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+_TAG_PATTERN = re.compile(r"<[^>]+>")
+
+
+def count_tokens(text: str) -> int:
+    """
+    Approximate LLM token count of a text
+
+    Counts words and punctuation marks, which tracks Llama-3 BPE counts
+    closely enough for budgeting without loading a tokenizer.
+    """
+    return len(_TOKEN_PATTERN.findall(text or ""))
+
+
+def _plain_text(html: str) -> str:
+    """Strip tags and collapse whitespace"""
+    return " ".join(_TAG_PATTERN.sub(" ", html or "").split())
+
+
+def _first_sentence(text: str, max_tokens: int) -> str:
+    """First sentence of a text, cut to at most max_tokens tokens"""
+    sentence = re.split(r"(?<=[.!?])\s", text, maxsplit=1)[0]
+    tokens = _TOKEN_PATTERN.findall(sentence)
+    if len(tokens) <= max_tokens:
+        return sentence
+    return " ".join(tokens[:max_tokens]) + " ..."
+
+
+class Turn:
+    """One user query and the assistant's answer"""
+
+    __slots__ = ("query", "answer", "tokens")
+
+    def __init__(self, query: str, answer: str):
+        self.query = query
+        self.answer = answer
+        self.tokens = count_tokens(query) + count_tokens(answer) + 4
+
+    def format(self) -> str:
+        return f"HUMAN: {self.query}\nAI: {self.answer}"
+
+
+class TokenBudgetMemory:
+    """
+    Conversation memory whose prompt contribution is capped by a token budget.
+
+    The newest turns are kept verbatim while they fit in `token_budget`.
+    Older turns are handled according to `mode`:
+    - "buffer": no token budget, only the `max_turns` cap (the original behaviour)
+    - "window": dropped
+    - "summary": compacted into a rolling summary of at most `summary_budget` tokens
+    - "relevance": dropped, then re-admitted per query when `retrieve_fn` ranks them relevant
+    """
+
+    def __init__(
+        self,
+        mode: str = "summary",
+        token_budget: int = 1024,
+        summary_budget: int = 256,
+        max_turns: int = 20,
+        retrieve_fn: Optional[Callable[[str], List[Tuple[str, str]]]] = None,
+        summarizer: Optional[Callable[[str, List[Turn]], str]] = None
+    ):
+        """
+        Args:
+            mode: One of MEMORY_MODES
+            token_budget: Maximum history tokens placed in the prompt
+            summary_budget: Maximum tokens of the rolling summary (summary mode)
+            max_turns: Maximum turns kept verbatim in any mode
+            retrieve_fn: Returns stored (query, answer) pairs most relevant to a query (relevance mode)
+            summarizer: Optional (previous_summary, turns) -> new_summary; defaults to extractive
+        """
+        if mode not in MEMORY_MODES:
+            raise ValueError(f"Unknown memory mode: {mode}. Expected one of {MEMORY_MODES}")
+        if mode == "relevance" and retrieve_fn is None:
+            raise ValueError("Relevance memory mode needs a retrieval function")
+
+        self.mode = mode
+        self.token_budget = token_budget
+        self.summary_budget = summary_budget
+        self.max_turns = max_turns
+        self.retrieve_fn = retrieve_fn
+        self.summarizer = summarizer or self._extractive_summary
+        self.turns: Deque[Turn] = deque()
+        self.summary = ""
+        self._lock = threading.Lock()
+
+    def save_context(self, inputs: Dict, outputs: Dict):
+        """Store a turn (same call signature as LangChain memories)"""
+        turn = Turn(inputs.get("input", ""), outputs.get("output", ""))
+        with self._lock:
+            self.turns.append(turn)
+            self._compact()
+
+    def clear(self):
+        with self._lock:
+            self.turns.clear()
+            self.summary = ""
+
+    def is_empty(self) -> bool:
+        """True when there are no turns and no summary of earlier ones"""
+        with self._lock:
+            return not self.turns and not self.summary
+
+    def _verbatim_tokens(self) -> int:
+        return sum(turn.tokens for turn in self.turns)
+
+    def _compact(self):
+        """Move the oldest turns out of the verbatim window until it fits the budget"""
+        evicted = []
+        while len(self.turns) > self.max_turns:
+            evicted.append(self.turns.popleft())
+        if self.mode != "buffer":
+            # Always keep the newest turn, even when it alone exceeds the budget
+            while len(self.turns) > 1 and self._verbatim_tokens() > self.token_budget:
+                evicted.append(self.turns.popleft())
+        if evicted and self.mode == "summary":
+            self.summary = self.summarizer(self.summary, evicted)
+
+    def _extractive_summary(self, previous: str, turns: List[Turn]) -> str:
+        """Cheap rolling summary: one short line per compacted turn, oldest lines dropped first"""
+        lines = [line for line in previous.split("\n") if line]
+        for turn in turns:
+            question = _first_sentence(_plain_text(turn.query), 24)
+            answer = _first_sentence(_plain_text(turn.answer), 32)
+            lines.append(f"- Asked: {question} Answered: {answer}")
+
+        while len(lines) > 1 and count_tokens("\n".join(lines)) > self.summary_budget:
+            lines.pop(0)
+        return "\n".join(lines)
+
+    def _relevant_turns(self, query: str, verbatim: List[Turn], budget: int) -> List[Turn]:
+        """Earlier turns ranked relevant to the query that fit in the remaining budget"""
+        if budget <= 0 or not query:
+            return []
+        seen = {(turn.query, turn.answer) for turn in verbatim}
+        selected = []
+        for past_query, past_answer in self.retrieve_fn(query):
+            if (past_query, past_answer) in seen:
+                continue
+            turn = Turn(past_query, past_answer)
+            if turn.tokens <= budget:
+                selected.append(turn)
+                budget -= turn.tokens
+        return selected
+
+    def format_history(self, query: str = "") -> str:
+        """History text for the prompt"""
+        with self._lock:
+            turns = list(self.turns)
+            summary = self.summary
+            verbatim_tokens = self._verbatim_tokens()
+
+        relevant = []
+        if self.mode == "relevance":
+            relevant = self._relevant_turns(query, turns, self.token_budget - verbatim_tokens)
+
+        parts = []
+        if summary:
+            parts.append(f"SUMMARY OF EARLIER CONVERSATION:\n{summary}")
+        if relevant:
+            parts.append("RELEVANT EARLIER TURNS:\n" + "\n".join(turn.format() for turn in relevant))
+        parts.extend(turn.format() for turn in turns)
+        return "\n".join(parts)
+
+    def size_bytes(self) -> int:
+        """Approximate RAM held by this memory"""
+        return len(self.summary) + sum(len(turn.query) + len(turn.answer) for turn in self.turns)
+
+
+class PromptTokenStats:
+    """Running token counts per prompt section, to check prompt size stays flat"""
+
+    def __init__(self, window: int = 100):
+        self._recent: Dict[str, Deque[int]] = {}
+        self._totals: Dict[str, int] = {}
+        self._max: Dict[str, int] = {}
+        self.requests = 0
+        self.window = window
+        self._lock = threading.Lock()
+
+    def record(self, sections: Dict[str, int]):
+        with self._lock:
+            self.requests += 1
+            for name, tokens in sections.items():
+                self._recent.setdefault(name, deque(maxlen=self.window)).append(tokens)
+                self._totals[name] = self._totals.get(name, 0) + tokens
+                self._max[name] = max(self._max.get(name, 0), tokens)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "sections": {
+                    name: {
+                        "last": recent[-1],
+                        "mean": round(self._totals[name] / self.requests, 1),
+                        "recent_mean": round(sum(recent) / len(recent), 1),
+                        "max": self._max[name]
+                    }
+                    for name, recent in self._recent.items()
+                }
+            }
@@ -0,0 +1,441 @@
+import base64
+import hashlib
+import json
+import os
+import queue
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional
+import numpy as np
+from langchain_community.vectorstores.utils import maximal_marginal_relevance
+import logging
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class _StoredSession:
+    """One session's turns as held in memory, and how much of its file has been read"""
+
+    def __init__(self, dim: int):
+        self.vectors = np.zeros((0, dim), dtype=np.float32)
+        self.items: List[Dict] = []
+        self.cleared_at = 0.0
+        self.last_active = 0.0
+        self.inode = None
+        self.offset = 0
+
+    def extend(self, vectors: List[np.ndarray], items: List[Dict], max_turns: int) -> int:
+        """Append rows, keeping the newest `max_turns`; returns the number of rows dropped"""
+        if items:
+            self.vectors = np.concatenate([self.vectors, np.stack(vectors)])
+            self.items.extend(items)
+            self.last_active = max(self.last_active, max(item.get("indexed_at", 0.0) for item in items))
+        dropped = len(self.items) - max_turns if max_turns else 0
+        if dropped > 0:
+            self.vectors = self.vectors[dropped:]
+            del self.items[:dropped]
+            return dropped
+        return 0
+
+
+class MemoryIndex:
+    """
+    Vector memory of conversation turns, partitioned by chat session.
+
+    - Turns are embedded in a background thread, in batches, off the request path.
+    - With `store_dir`, each session's turns (metadata and vector) are appended
+      to one file per session, shared by every process using the directory
+      (e.g. uvicorn workers): any worker sees the turns stored by the others,
+      a restart never re-embeds history, and no process owns another's sessions.
+    - Deleting a session replaces its file with a "cleared" marker, so every
+      worker drops the turns on its next read and turns queued before the
+      clear anywhere are never written.
+    - Each session keeps at most `max_turns` turns (in memory and on disk).
+      Sessions idle for `session_ttl` seconds are expired, and the least
+      recently active are dropped beyond `max_sessions`, so RAM and disk stay
+      bounded however many sessions come and go.
+    """
+
+    def __init__(
+        self,
+        embed_fn: Callable[[List[str]], List[List[float]]],
+        dim: int,
+        store_dir: Optional[str] = None,
+        batch_size: int = 32,
+        flush_interval: float = 0.2,
+        sweep_interval: float = 60,
+        max_sessions: int = 2000,
+        session_ttl: float = 7 * 24 * 3600,
+        max_turns: int = 50
+    ):
+        """
+        Args:
+            embed_fn: Embeds a list of texts, e.g. embeddings.embed_documents
+            dim: Embedding dimensionality
+            store_dir: Directory of the per-session files; None keeps the index in memory only
+            batch_size: Maximum turns embedded in one encoder call
+            flush_interval: Seconds the worker waits to fill a batch
+            sweep_interval: Seconds between expiry sweeps
+            max_sessions: Sessions kept at most; the least recently active are dropped first (0 for no limit)
+            session_ttl: Seconds after its last turn a session is dropped (0 to keep sessions forever)
+            max_turns: Newest turns kept per session (0 for no limit)
+        """
+        self.embed_fn = embed_fn
+        self.dim = dim
+        self.store_dir = store_dir
+        if store_dir:
+            os.makedirs(store_dir, exist_ok=True)
+            if fcntl is None:
+                logger.warning("File locks unavailable; concurrent processes may interleave memory index writes")
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.sweep_interval = sweep_interval
+        self.max_sessions = max_sessions
+        self.session_ttl = session_ttl
+        self.max_turns = max_turns
+
+        self._sessions: Dict[str, _StoredSession] = {}
+        self._generation: Dict[str, int] = {}
+        self._lock = threading.RLock()
+        self.deleted_rows = 0
+        self.expired_sessions = 0
+
+        self._pending: "queue.Queue" = queue.Queue()
+        self._stop = threading.Event()
+        self._worker = threading.Thread(target=self._run, name="memory-index", daemon=True)
+        self._worker.start()
+
+    # ------------------------------------------------------------------ writes
+
+    def add(self, session_id: str, text: str, metadata: Optional[Dict] = None):
+        """Queue a turn for embedding; returns immediately"""
+        # Queued under the lock, so expire() never forgets a generation a queued turn still carries
+        with self._lock:
+            generation = self._generation.get(session_id, 0)
+            self._pending.put((session_id, generation, time.time(), text, dict(metadata or {})))
+
+    def delete_session(self, session_id: str) -> int:
+        """Remove every stored turn of a session, in every process, including turns still queued"""
+        with self._lock:
+            stored = self._sync(session_id)
+            removed = len(stored.items) if stored is not None else 0
+            self._generation[session_id] = self._generation.get(session_id, 0) + 1
+            self._forget(session_id)
+            self.deleted_rows += removed
+            if self.store_dir:
+                self._write_cleared(session_id, time.time())
+            return removed
+
+    def expire(self) -> int:
+        """
+        Drop sessions idle longer than session_ttl, then the least recently active beyond max_sessions
+
+        Returns: Number of sessions dropped
+        """
+        now = time.time()
+        with self._lock:
+            expired = set()
+            if self.session_ttl:
+                expired = {
+                    session_id for session_id, stored in self._sessions.items()
+                    if now - stored.last_active > self.session_ttl
+                }
+            overflow = len(self._sessions) - len(expired) - self.max_sessions
+            if self.max_sessions and overflow > 0:
+                active = sorted(
+                    (stored.last_active, session_id) for session_id, stored in self._sessions.items()
+                    if session_id not in expired
+                )
+                expired.update(session_id for _, session_id in active[:overflow])
+            for session_id in expired:
+                self.deleted_rows += len(self._sessions[session_id].items)
+                self._forget(session_id)
+            if self._pending.unfinished_tasks == 0:
+                # Nothing queued can carry an old generation, so cleared sessions need not be remembered
+                self._generation = {
+                    session_id: generation for session_id, generation in self._generation.items()
+                    if session_id in self._sessions
+                }
+            self.expired_sessions += len(expired)
+        removed_files = self._sweep_files(now) if self.store_dir else 0
+        if expired or removed_files:
+            logger.info(f"Memory index expired {len(expired)} sessions in memory, {removed_files} on disk")
+        return len(expired)
+
+    def _forget(self, session_id: str):
+        """Drop a session from memory only (lock held); with a store it is read again when next used"""
+        self._sessions.pop(session_id, None)
+
+    def flush(self, timeout: float = 30):
+        """Block until every queued turn has been embedded"""
+        deadline = time.time() + timeout
+        while (self._pending.unfinished_tasks > 0) and time.time() < deadline:
+            time.sleep(0.01)
+
+    def _run(self):
+        """Background worker: embed queued turns in batches and expire sessions periodically"""
+        last_sweep = time.time()
+        while not self._stop.is_set():
+            batch = []
+            try:
+                batch.append(self._pending.get(timeout=self.flush_interval))
+                while len(batch) < self.batch_size:
+                    batch.append(self._pending.get_nowait())
+            except queue.Empty:
+                pass
+
+            if batch:
+                try:
+                    self._embed_batch(batch)
+                except Exception as e:
+                    logger.error(f"Error embedding memory batch of {len(batch)}: {e}")
+                finally:
+                    for _ in batch:
+                        self._pending.task_done()
+
+            if time.time() - last_sweep > self.sweep_interval:
+                try:
+                    self.expire()
+                except Exception as e:
+                    logger.error(f"Error expiring memory index sessions: {e}")
+                last_sweep = time.time()
+
+    def _embed_batch(self, batch: List):
+        vectors = np.asarray(self.embed_fn([text for _, _, _, text, _ in batch]), dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors = vectors / np.where(norms == 0, 1.0, norms)
+
+        turns: Dict[str, List] = {}
+        with self._lock:
+            for (session_id, generation, queued_at, text, metadata), vector in zip(batch, vectors):
+                if generation != self._generation.get(session_id, 0):
+                    # The session was cleared while this turn was queued
+                    continue
+                item = {"session_id": session_id, "text": text, "indexed_at": time.time(), **metadata}
+                turns.setdefault(session_id, []).append((queued_at, vector, item))
+            if not self.store_dir:
+                for session_id, rows in turns.items():
+                    stored = self._sessions.setdefault(session_id, _StoredSession(self.dim))
+                    self.deleted_rows += stored.extend([vector for _, vector, _ in rows], [item for _, _, item in rows], self.max_turns)
+                return
+
+        for session_id, rows in turns.items():
+            self._append_file(session_id, rows)
+            with self._lock:
+                self._sync(session_id)
+
+    # ------------------------------------------------------------------- reads
+
+    def session_turns(self, session_id: str) -> List[Dict]:
+        """Stored turns of a session, oldest first"""
+        with self._lock:
+            stored = self._sync(session_id)
+            return list(stored.items) if stored is not None else []
+
+    def cleared_at(self, session_id: str) -> float:
+        """When the session was last cleared (by any process), 0 if never"""
+        with self._lock:
+            stored = self._sync(session_id)
+            return stored.cleared_at if stored is not None else 0.0
+
+    def search(self, session_id: str, query: str, k: int = 5, fetch_k: int = 10, lambda_mult: float = 0.7) -> List[Dict]:
+        """
+        Most relevant stored turns of a session for a query (MMR re-ranked)
+
+        Args:
+            session_id: Session whose turns are searched
+            query: Query text
+            k: Number of turns returned
+            fetch_k: Candidates considered before MMR re-ranking
+            lambda_mult: MMR trade-off between relevance (1) and diversity (0)
+        Returns: Turn metadata dictionaries, most relevant first
+        """
+        with self._lock:
+            stored = self._sync(session_id)
+            if stored is None or not stored.items:
+                return []
+
+        query_vector = np.asarray(self.embed_fn([query])[0], dtype=np.float32)
+        query_vector /= np.linalg.norm(query_vector) or 1.0
+
+        with self._lock:
+            stored = self._sync(session_id)
+            if stored is None or not stored.items:
+                return []
+            matrix, items = stored.vectors, stored.items
+            scores = matrix @ query_vector
+            candidates = np.argsort(scores)[::-1][:fetch_k]
+            selected = maximal_marginal_relevance(query_vector, matrix[candidates], lambda_mult=lambda_mult, k=k)
+            return [items[candidates[i]] for i in selected]
+
+    # ------------------------------------------------------------- persistence
+
+    def _path(self, session_id: str) -> str:
+        name = hashlib.sha1(session_id.encode("utf-8")).hexdigest()
+        return os.path.join(self.store_dir, f"{name}.jsonl")
+
+    def _sync(self, session_id: str) -> Optional[_StoredSession]:
+        """
+        The session's turns, after reading what other processes appended to its file (lock held)
+
+        A file replaced since the last read (cleared or trimmed) is read again
+        from the start; a missing file means the session is gone.
+        """
+        stored = self._sessions.get(session_id)
+        if not self.store_dir:
+            return stored
+        path = self._path(session_id)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            self._forget(session_id)
+            return None
+        if stored is not None and stored.inode == stat.st_ino and stored.offset == stat.st_size:
+            return stored
+
+        if stored is None or stored.inode != stat.st_ino or stat.st_size < stored.offset:
+            stored = _StoredSession(self.dim)
+            stored.inode = stat.st_ino
+        try:
+            with open(path, "rb") as f:
+                f.seek(stored.offset)
+                data = f.read()
+        except FileNotFoundError:
+            self._forget(session_id)
+            return None
+        # A line still being written by another process is read next time
+        complete = data[:data.rfind(b"\n") + 1]
+        vectors, items = [], []
+        for line in complete.splitlines():
+            record = json.loads(line)
+            if "cleared_at" in record:
+                stored.cleared_at = max(stored.cleared_at, record["cleared_at"])
+                continue
+            vectors.append(np.frombuffer(base64.b64decode(record["vector"]), dtype=np.float32))
+            items.append(record["item"])
+        stored.offset += len(complete)
+        # Re-applied on every read, so turns trimmed by any process never come back
+        self.deleted_rows += stored.extend(vectors, items, self.max_turns)
+        self._sessions[session_id] = stored
+        return stored
+
+    @contextmanager
+    def _locked_file(self, path: str, create: bool = True):
+        """
+        Open `path` for writing under an exclusive file lock, retrying if
+        another process replaced or removed it while we waited for the lock
+
+        Yields: The open file, or None when it does not exist and `create` is False
+        """
+        while True:
+            try:
+                f = open(path, "a+b" if create else "r+b")
+            except FileNotFoundError:
+                yield None
+                return
+            try:
+                if fcntl is not None:
+                    fcntl.flock(f, fcntl.LOCK_EX)
+                try:
+                    current = os.stat(path).st_ino
+                except FileNotFoundError:
+                    current = None
+                if current == os.fstat(f.fileno()).st_ino:
+                    yield f
+                    return
+            finally:
+                f.close()
+
+    def _append_file(self, session_id: str, rows: List):
+        """Append embedded turns to the session's file, skipping turns queued before a clear"""
+        path = self._path(session_id)
+        with self._locked_file(path) as f:
+            f.seek(0)
+            first = f.readline()
+            cleared_at = json.loads(first).get("cleared_at", 0.0) if first.endswith(b"\n") else 0.0
+            lines = [
+                json.dumps({
+                    "item": item,
+                    "vector": base64.b64encode(np.ascontiguousarray(vector, dtype=np.float32).tobytes()).decode("ascii")
+                }).encode("utf-8") + b"\n"
+                for queued_at, vector, item in rows if queued_at > cleared_at
+            ]
+            if not lines:
+                return
+            f.seek(0, os.SEEK_END)
+            f.write(b"".join(lines))
+            f.flush()
+            # Trim once the file holds about twice max_turns turns, so rewrites stay rare
+            if self.max_turns and f.tell() > 2 * self.max_turns * sum(map(len, lines)) / len(lines):
+                self._rewrite(f, path)
+
+    def _rewrite(self, f, path: str):
+        """Replace the locked file with its cleared marker and newest max_turns turns"""
+        f.seek(0)
+        records = f.read().splitlines(keepends=True)
+        header = [line for line in records[:1] if b'"cleared_at"' in line]
+        turns = records[len(header):][-self.max_turns:]
+        self._replace(path, b"".join(header + turns))
+
+    def _write_cleared(self, session_id: str, cleared_at: float):
+        """Replace the session's file with a marker; other processes drop its turns when they next read it"""
+        path = self._path(session_id)
+        with self._locked_file(path):
+            self._replace(path, json.dumps({"cleared_at": cleared_at}).encode("utf-8") + b"\n")
+
+    def _replace(self, path: str, data: bytes):
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+    def _sweep_files(self, now: float) -> int:
+        """Remove session files idle longer than session_ttl, then the oldest beyond max_sessions"""
+        files = []
+        for entry in os.scandir(self.store_dir):
+            if entry.name.endswith(".jsonl"):
+                try:
+                    files.append((entry.stat().st_mtime, entry.path))
+                except FileNotFoundError:
+                    pass
+        files.sort()
+        stale = {path for mtime, path in files if self.session_ttl and now - mtime > self.session_ttl}
+        kept = [path for _, path in files if path not in stale]
+        overflow = set(kept[:max(0, len(kept) - self.max_sessions)]) if self.max_sessions else set()
+
+        removed = 0
+        for path in stale | overflow:
+            with self._locked_file(path, create=False) as f:
+                if f is None:
+                    continue
+                # A stale file another process wrote to since the listing stays
+                if path in stale and now - os.fstat(f.fileno()).st_mtime <= self.session_ttl:
+                    continue
+                os.unlink(path)
+                removed += 1
+        return removed
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "sessions": len(self._sessions),
+                "turns": sum(len(stored.items) for stored in self._sessions.values()),
+                "deleted_rows": self.deleted_rows,
+                "expired_sessions": self.expired_sessions,
+                "max_sessions": self.max_sessions,
+                "store_dir": self.store_dir,
+                "pending": self._pending.qsize()
+            }
+
+    def close(self):
+        """Embed what is queued and stop the worker; stored turns are already on disk"""
+        self.flush()
+        self._stop.set()
+        self._worker.join(timeout=5)
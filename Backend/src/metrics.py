@@ -0,0 +1,239 @@
+import bisect
+import os
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from typing import Callable, Dict, Iterable, List, Sequence, Tuple
+import logging
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128)
+
+_NOOP = nullcontext()
+
+# (labels, value) pairs produced by a gauge callback at scrape time
+Samples = Iterable[Tuple[Dict[str, str], float]]
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Monotonic counter, one series per label combination"""
+
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help_text = help_text
+        self._values: Dict[Tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_format_labels(dict(key))} {_format_value(value)}" for key, value in items]
+
+
+class Histogram:
+    """Cumulative-bucket histogram, one series per label combination"""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = tuple(buckets)
+        # label key -> [per-bucket counts (last is +Inf), sum, count]
+        self._series: Dict[Tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(sorted(labels.items()))
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = [(key, list(counts), total, count) for key, (counts, total, count) in self._series.items()]
+
+        lines = []
+        for key, counts, total, count in items:
+            labels = dict(key)
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                lines.append(f"{self.name}_bucket{_format_labels({**labels, 'le': _format_value(float(bound))})} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(labels)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(labels)} {count}")
+        return lines
+
+
+class GaugeCallback:
+    """Gauge whose samples are read from the application at scrape time"""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, help_text: str, collect: Callable[[], Samples]):
+        self.name = name
+        self.help_text = help_text
+        self.collect = collect
+
+    def render(self) -> List[str]:
+        try:
+            samples = list(self.collect())
+        except Exception as e:
+            logger.error(f"Error collecting metric {self.name}: {e}")
+            return []
+        return [
+            f"{self.name}{_format_labels(labels)} {_format_value(value)}"
+            for labels, value in samples if value is not None
+        ]
+
+
+class Metrics:
+    """
+    Process-wide metrics registry rendered in the Prometheus text format.
+
+    When disabled, timers are a shared no-op context manager and
+    observations return immediately, so instrumented hot paths cost one
+    attribute check.
+    """
+
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self._metrics: Dict[str, object] = {}
+        self._lock = threading.Lock()
+
+        self.stage_seconds = self.histogram(
+            "krishimitra_stage_seconds",
+            "Time spent in each hot-path stage (upload_read, preprocess, forward, postprocess, "
+            "llm, memory_load, memory_save, weather_fetch)"
+        )
+        self.batch_size = self.histogram(
+            "krishimitra_batch_size", "Images per model forward pass", buckets=SIZE_BUCKETS
+        )
+        self.request_seconds = self.histogram(
+            "krishimitra_http_request_duration_seconds", "HTTP request latency until the response starts"
+        )
+        self.requests = self.counter("krishimitra_http_requests_total", "HTTP requests by route and status")
+        self.http_in_flight = 0
+
+    def _register(self, metric):
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name: str, help_text: str) -> Counter:
+        return self._register(Counter(name, help_text))
+
+    def histogram(self, name: str, help_text: str, buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, help_text, buckets))
+
+    def gauge_callback(self, name: str, help_text: str, collect: Callable[[], Samples]) -> GaugeCallback:
+        """Register a gauge read at scrape time; `collect` returns (labels, value) pairs"""
+        with self._lock:
+            gauge = self._metrics[name] = GaugeCallback(name, help_text, collect)
+        return gauge
+
+    def observe(self, histogram: Histogram, value: float, **labels):
+        if self.enabled:
+            histogram.observe(value, **labels)
+
+    @contextmanager
+    def _timer(self, stage: str, labels: Dict[str, str]):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stage_seconds.observe(time.perf_counter() - start, stage=stage, **labels)
+
+    def time(self, stage: str, **labels):
+        """Context manager recording the block's duration under krishimitra_stage_seconds"""
+        if not self.enabled:
+            return _NOOP
+        return self._timer(stage, labels)
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.help_text}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware recording HTTP latency (until the response starts),
+    status codes and in-flight requests.
+
+    Written against raw ASGI so streaming responses pass straight through.
+    """
+
+    def __init__(self, app, registry: Metrics):
+        self.app = app
+        self.metrics = registry
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        recorded = False
+
+        def record(status: int):
+            nonlocal recorded
+            recorded = True
+            # Label by route template, not raw path, so /weather/{location} stays one series
+            route = getattr(scope.get("route"), "path", "unmatched")
+            self.metrics.observe(
+                self.metrics.request_seconds, time.perf_counter() - start, method=scope["method"], route=route
+            )
+            self.metrics.requests.inc(method=scope["method"], route=route, status=str(status))
+
+        async def send_with_metrics(message):
+            if message["type"] == "http.response.start" and not recorded:
+                record(message["status"])
+            await send(message)
+
+        self.metrics.http_in_flight += 1
+        try:
+            await self.app(scope, receive, send_with_metrics)
+        finally:
+            self.metrics.http_in_flight -= 1
+            if not recorded:
+                record(500)
+
+
+# Shared by the models, the chatbot and the API (METRICS_ENABLED=false disables collection)
+metrics = Metrics(enabled=os.environ.get("METRICS_ENABLED", "true").lower() not in ("0", "false", "no"))
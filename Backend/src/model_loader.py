@@ -0,0 +1,104 @@
+import asyncio
+import time
+from concurrent.futures import Executor
+from typing import Any, Awaitable, Callable, Dict, Optional
+import logging
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class ModelSlot:
+    """
+    A subsystem (model or chatbot) loaded in a worker thread, either at
+    startup or lazily on first use.
+
+    Loading runs `loader`, then an optional `warmup` on the loaded object (e.g.
+    a dummy inference so the first real request does not pay for graph
+    tracing), then the async `on_ready` hook. Concurrent callers of `get()`
+    share one load.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        loader: Callable[[], Any],
+        warmup: Optional[Callable[[Any], None]] = None,
+        on_ready: Optional[Callable[[Any], Awaitable[None]]] = None,
+        lazy: bool = False,
+        executor: Optional[Executor] = None
+    ):
+        """
+        Args:
+            name: Name reported in /health/
+            loader: Builds the object; runs in a worker thread
+            warmup: Optional warm-up call on the loaded object; runs in a worker thread
+            on_ready: Optional coroutine called with the object once it is warm
+            lazy: Load on first use instead of at startup
+            executor: Executor for loading; None uses the event loop's default
+        """
+        self.name = name
+        self.loader = loader
+        self.warmup = warmup
+        self.on_ready = on_ready
+        self.lazy = lazy
+        self.executor = executor
+        self.value = None
+        self.state = "lazy" if lazy else "pending"
+        self.error: Optional[str] = None
+        self.load_seconds: Optional[float] = None
+        self.warmup_seconds: Optional[float] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        """Begin loading in the background unless the slot is lazy"""
+        if not self.lazy and self._task is None:
+            self._task = asyncio.ensure_future(self._load())
+
+    async def get(self):
+        """The loaded object, loading it first if needed; None if loading failed"""
+        if self.state == "ready":
+            return self.value
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._load())
+        await asyncio.shield(self._task)
+        return self.value
+
+    async def _load(self):
+        loop = asyncio.get_running_loop()
+        self.state = "loading"
+        try:
+            start = time.perf_counter()
+            value = await loop.run_in_executor(self.executor, self.loader)
+            self.load_seconds = round(time.perf_counter() - start, 3)
+
+            if self.warmup is not None:
+                start = time.perf_counter()
+                await loop.run_in_executor(self.executor, self.warmup, value)
+                self.warmup_seconds = round(time.perf_counter() - start, 3)
+
+            if self.on_ready is not None:
+                await self.on_ready(value)
+            self.value = value
+            self.state = "ready"
+            logger.info(
+                f"{self.name} ready (load {self.load_seconds}s, warm-up {self.warmup_seconds or 0}s)"
+            )
+        except Exception as e:
+            self.state = "failed"
+            self.error = str(e)
+            logger.error(f"Failed to initialize {self.name}: {e}")
+
+    @property
+    def ready(self) -> bool:
+        return self.state == "ready"
+
+    def status(self) -> Dict:
+        return {
+            "state": self.state,
+            "ready": self.ready,
+            "lazy": self.lazy,
+            "load_seconds": self.load_seconds,
+            "warmup_seconds": self.warmup_seconds,
+            "error": self.error
+        }
@@ -0,0 +1,634 @@
+import gc
+import json
+import os
+import queue
+import socket
+import socketserver
+import struct
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+from typing import Callable, Dict, List, Optional, Tuple, Union
+import numpy as np
+import logging
+
+from src.batching import ModelReleased
+from src.metrics import metrics
+from src.prediction_cache import model_identity
+from src.preprocessing import DISEASE_INPUT, PEST_INPUT, decode_image, draft_size, prepare_into, preprocess
+from src.tta import VIEWS, TTAPolicy, make_views
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+INPUT_SPECS = {"disease": DISEASE_INPUT, "pest": PEST_INPUT}
+# Bytes of one row of the largest model input
+MAX_ROW_BYTES = max(spec.shape[0] * spec.shape[1] * spec.shape[2] for spec in INPUT_SPECS.values()) * 4
+
+_HEADER = struct.Struct("!I")
+
+
+def _send(sock: socket.socket, message: Dict):
+    """Send one length-prefixed JSON message"""
+    body = json.dumps(message).encode("utf-8")
+    sock.sendall(_HEADER.pack(len(body)) + body)
+
+
+def _recv_exact(sock: socket.socket, size: int) -> Optional[bytes]:
+    data = bytearray(size)
+    view = memoryview(data)
+    received = 0
+    while received < size:
+        count = sock.recv_into(view[received:])
+        if count == 0:
+            return None
+        received += count
+    return bytes(data)
+
+
+def _recv(sock: socket.socket) -> Optional[Dict]:
+    """Receive one length-prefixed JSON message, or None once the peer has closed"""
+    header = _recv_exact(sock, _HEADER.size)
+    if header is None:
+        return None
+    body = _recv_exact(sock, _HEADER.unpack(header)[0])
+    if body is None:
+        return None
+    return json.loads(body)
+
+
+def _build_model(name: str, path: Optional[str]):
+    # TensorFlow is only imported by the model server
+    if name == "disease":
+        from src.disease_model import DiseaseModel
+        return DiseaseModel(model_path=path)
+    if name == "pest":
+        from src.pest_model import PestModel
+        return PestModel(model_path=path)
+    raise ValueError(f"Unknown model: {name}")
+
+
+def minilm_embeddings():
+    from langchain_huggingface import HuggingFaceEmbeddings
+    return HuggingFaceEmbeddings(model_name="sentence-transformers/all-MiniLM-L6-v2")
+
+
+class ModelServer:
+    """
+    Process hosting the image classifiers and the MiniLM embedder for every
+    API worker on the machine.
+
+    Workers connect over a Unix domain socket. Each connection is bound to
+    one slot of a shared-memory ring created by the worker: input tensors and
+    output vectors are written to and read from the slot in place, so only a
+    small JSON header ({"op", "key", "shape"}) and the formatted results
+    cross the socket. Each model file is loaded once, however many workers
+    use it, and forward passes share `inference_workers` threads.
+
+    Every "load" from a worker holds the model until the worker sends the
+    matching "unload" (e.g. when its registry retires the version); a model
+    nobody holds is released, except the ones preloaded at startup. A predict
+    for a model the worker no longer holds is rejected with "unloaded", which
+    the worker raises as ModelReleased.
+    """
+
+    def __init__(
+        self,
+        socket_path: str,
+        inference_workers: int = 1,
+        build: Callable[[str, Optional[str]], object] = _build_model,
+        embeddings_factory: Optional[Callable[[], object]] = minilm_embeddings
+    ):
+        """
+        Args:
+            socket_path: Unix domain socket to listen on
+            inference_workers: Forward passes allowed to run at once
+            build: Loads a model from its name and file path (None for the default file)
+            embeddings_factory: Creates the sentence embedder on first use; None disables embeddings
+        """
+        self.socket_path = socket_path
+        self.build = build
+        self.embeddings_factory = embeddings_factory
+        self.embeddings = None
+        self._models: Dict[str, object] = {}
+        self._model_locks: Dict[str, threading.Lock] = {}
+        # Model key -> {worker id: loads not yet unloaded}
+        self._holders: Dict[str, Dict[str, int]] = {}
+        self._pinned = set()
+        self._lock = threading.Lock()
+        self._inference = threading.BoundedSemaphore(max(1, inference_workers))
+        self.requests = 0
+        self.connections = 0
+        self._server = None
+
+    @staticmethod
+    def model_key(name: str, path: Optional[str]) -> str:
+        return f"{name}:{path or ''}"
+
+    def _model_lock(self, key: str) -> threading.Lock:
+        with self._lock:
+            return self._model_locks.setdefault(key, threading.Lock())
+
+    def load(self, name: str, path: Optional[str] = None, owner: Optional[str] = None, pin: bool = False):
+        """
+        Load a model once; concurrent callers for the same file wait for the first
+
+        Args:
+            name: "disease" or "pest"
+            path: Model file (None for the default file)
+            owner: Worker taking a hold on the model until it unloads it
+            pin: Keep the model loaded for the life of the server
+        """
+        key = self.model_key(name, path)
+        with self._model_lock(key):
+            model = self._models.get(key)
+            if model is None:
+                start = time.perf_counter()
+                model = self.build(name, path)
+                self._models[key] = model
+                logger.info(f"Model server loaded {key} in {time.perf_counter() - start:.1f}s")
+            with self._lock:
+                if pin:
+                    self._pinned.add(key)
+                if owner is not None:
+                    holders = self._holders.setdefault(key, {})
+                    holders[owner] = holders.get(owner, 0) + 1
+            return model
+
+    def unload(self, key: str, owner: Optional[str]) -> bool:
+        """
+        Drop one of `owner`'s holds on a model, releasing the model once nobody holds it
+
+        Returns: Whether the model was released
+        """
+        with self._model_lock(key):
+            with self._lock:
+                holders = self._holders.get(key, {})
+                if holders.get(owner):
+                    holders[owner] -= 1
+                    if not holders[owner]:
+                        del holders[owner]
+                if holders or key in self._pinned:
+                    return False
+                self._holders.pop(key, None)
+                model = self._models.pop(key, None)
+        if model is None:
+            return False
+        # Requests already running keep their reference until they finish
+        del model
+        gc.collect()
+        logger.info(f"Model server released {key}")
+        return True
+
+    def _held_model(self, key: str, owner: Optional[str]):
+        """The model, if it is loaded and (for a known worker) still held by that worker"""
+        with self._lock:
+            if owner is not None and key not in self._pinned and not self._holders.get(key, {}).get(owner):
+                return None
+            return self._models.get(key)
+
+    def _describe(self, key: str, model) -> Dict:
+        class_names = model.class_names
+        if isinstance(class_names, dict):
+            class_names = [class_names[i] for i in sorted(class_names)]
+        return {
+            "key": key,
+            "model_path": model.model_path,
+            "runner_path": getattr(model, "runner_path", None),
+            "runner_name": model.runner_name,
+            "target_size": list(model.target_size),
+            "class_names": list(class_names),
+            "identity": model_identity(model)
+        }
+
+    def _embedder(self):
+        if self.embeddings is None:
+            if self.embeddings_factory is None:
+                raise RuntimeError("Embeddings are disabled on this model server")
+            with self._lock:
+                if self.embeddings is None:
+                    self.embeddings = self.embeddings_factory()
+                    logger.info("Model server loaded the embedding model")
+        return self.embeddings
+
+    def handle(self, message: Dict, region: Optional[np.ndarray], owner: Optional[str] = None) -> Dict:
+        """
+        Run one request against the connection's shared-memory slot
+
+        Args:
+            message: Decoded request header
+            region: uint8 view of the connection's slot (None before "attach")
+            owner: Worker the connection belongs to (from "attach")
+        Returns: Reply header
+        """
+        op = message.get("op")
+        if op == "load":
+            model = self.load(message["model"], message.get("path"), owner=owner)
+            return {"ok": True, **self._describe(self.model_key(message["model"], message.get("path")), model)}
+        if op == "unload":
+            return {"ok": True, "released": self.unload(message["key"], owner)}
+        if region is None:
+            raise RuntimeError("No shared memory attached to this connection")
+
+        if op in ("predict_batch", "predict_views"):
+            model = self._held_model(message["key"], owner)
+            if model is None:
+                # A request that read the model before its worker unloaded it
+                logger.warning(f"Model server rejected {op} for unloaded {message['key']}")
+                return {"ok": False, "unloaded": True, "error": f"Model {message['key']} was unloaded"}
+            shape = tuple(message["shape"])
+            batch = np.ndarray(shape, dtype=np.float32, buffer=region)
+            with self._inference:
+                if op == "predict_batch":
+                    return {"ok": True, "results": model.predict_batch(batch)}
+                return {"ok": True, "result": model.predict_views(batch)}
+
+        if op == "embed":
+            vectors = np.asarray(self._embedder().embed_documents(message["texts"]), dtype=np.float32)
+            if vectors.nbytes > region.nbytes:
+                raise ValueError(f"{len(vectors)} embeddings do not fit in a {region.nbytes} byte slot")
+            region[:vectors.nbytes] = vectors.reshape(-1).view(np.uint8)
+            return {"ok": True, "shape": list(vectors.shape)}
+
+        raise ValueError(f"Unknown operation: {op}")
+
+    def _serve_connection(self, sock: socket.socket):
+        shm: Optional[SharedMemory] = None
+        region = None
+        owner = None
+        with self._lock:
+            self.connections += 1
+        try:
+            while True:
+                message = _recv(sock)
+                if message is None:
+                    return
+                try:
+                    if message.get("op") == "attach":
+                        region = None
+                        if shm is not None:
+                            shm.close()
+                        shm = SharedMemory(name=message["shm"])
+                        # The worker owns the segment; without this the server's
+                        # resource tracker would unlink it when the server exits
+                        resource_tracker.unregister(shm._name, "shared_memory")
+                        offset, size = message["offset"], message["size"]
+                        region = np.ndarray((size,), dtype=np.uint8, buffer=shm.buf, offset=offset)
+                        owner = message.get("owner")
+                        reply = {"ok": True, "pid": os.getpid()}
+                    else:
+                        reply = self.handle(message, region, owner)
+                except Exception as e:
+                    logger.error(f"Model server error ({message.get('op')}): {e}")
+                    reply = {"ok": False, "error": str(e)}
+                with self._lock:
+                    self.requests += 1
+                _send(sock, reply)
+        except OSError as e:
+            logger.error(f"Model server connection error: {e}")
+        finally:
+            with self._lock:
+                self.connections -= 1
+            region = None
+            if shm is not None:
+                shm.close()
+
+    def serve_forever(self, preload: Tuple[str, ...] = ()):
+        """
+        Load `preload` models, then accept worker connections until shut down
+
+        Args: preload: Model names to load before accepting connections, e.g. ("disease", "pest")
+        """
+        for name in preload:
+            self.load(name, pin=True)
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+
+        server_self = self
+
+        class Handler(socketserver.BaseRequestHandler):
+            def handle(self):
+                server_self._serve_connection(self.request)
+
+        socketserver.ThreadingUnixStreamServer.daemon_threads = True
+        self._server = socketserver.ThreadingUnixStreamServer(self.socket_path, Handler)
+        logger.info(f"Model server listening on {self.socket_path} (pid {os.getpid()})")
+        try:
+            self._server.serve_forever()
+        finally:
+            self._server.server_close()
+            if os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)
+
+    def shutdown(self):
+        if self._server is not None:
+            self._server.shutdown()
+
+
+class _Slot:
+    """One slot of a worker's shared-memory ring and its server connection"""
+
+    def __init__(self, index: int, region: np.ndarray):
+        self.index = index
+        self.region = region
+        self.sock: Optional[socket.socket] = None
+
+    def close(self):
+        if self.sock is not None:
+            try:
+                self.sock.close()
+            except OSError:
+                pass
+            self.sock = None
+
+
+class ModelServerClient:
+    """
+    An API worker's connection to a model server.
+
+    The worker owns a shared-memory ring of `slots` equal slots, created on
+    first use. A request takes a free slot, writes its tensor into it, sends
+    a header over the slot's own socket and waits for the reply; at most
+    `slots` requests are in flight at once.
+    """
+
+    def __init__(self, socket_path: str, slots: int = 4, slot_rows: int = 16, connect_timeout: float = 60.0):
+        """
+        Args:
+            socket_path: Model server socket; several comma-separated sockets
+                spread workers over servers by process id
+            slots: Requests in flight at once
+            slot_rows: Images of the largest model input that fit in one slot
+            connect_timeout: Seconds to wait for the server to come up
+        """
+        sockets = [path.strip() for path in socket_path.split(",") if path.strip()]
+        if not sockets:
+            raise ValueError("No model server socket given")
+        self.socket_path = sockets[os.getpid() % len(sockets)]
+        self.slot_count = max(1, slots)
+        # A test-time augmentation request needs all of its views in one slot
+        self.slot_rows = max(slot_rows, len(VIEWS))
+        self.slot_bytes = self.slot_rows * MAX_ROW_BYTES
+        self.connect_timeout = connect_timeout
+        # Identifies this worker's holds on server models
+        self.owner = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._shm: Optional[SharedMemory] = None
+        self._free: "queue.Queue[_Slot]" = queue.Queue()
+        self._lock = threading.Lock()
+
+    def _ensure_ring(self):
+        if self._shm is not None:
+            return
+        with self._lock:
+            if self._shm is not None:
+                return
+            shm = SharedMemory(create=True, size=self.slot_count * self.slot_bytes)
+            for i in range(self.slot_count):
+                region = np.ndarray((self.slot_bytes,), dtype=np.uint8, buffer=shm.buf, offset=i * self.slot_bytes)
+                self._free.put(_Slot(i, region))
+            self._shm = shm
+            logger.info(
+                f"Model server ring {shm.name}: {self.slot_count} slots of "
+                f"{self.slot_bytes / 2 ** 20:.1f} MB for {self.socket_path}"
+            )
+
+    def _connect(self, slot: _Slot):
+        deadline = time.monotonic() + self.connect_timeout
+        while True:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                sock.connect(self.socket_path)
+                break
+            except OSError:
+                sock.close()
+                if time.monotonic() >= deadline:
+                    raise ConnectionError(f"Model server not reachable at {self.socket_path}")
+                time.sleep(0.2)
+        slot.sock = sock
+        self._exchange(slot, {
+            "op": "attach", "shm": self._shm.name, "owner": self.owner,
+            "offset": slot.index * self.slot_bytes, "size": self.slot_bytes
+        })
+
+    def _exchange(self, slot: _Slot, message: Dict) -> Dict:
+        try:
+            _send(slot.sock, message)
+            reply = _recv(slot.sock)
+        except OSError as e:
+            slot.close()
+            raise ConnectionError(f"Model server connection lost: {e}")
+        if reply is None:
+            slot.close()
+            raise ConnectionError("Model server closed the connection")
+        if not reply.get("ok"):
+            if reply.get("unloaded"):
+                raise ModelReleased(reply["error"])
+            raise RuntimeError(reply.get("error", "Model server error"))
+        return reply
+
+    @contextmanager
+    def slot(self):
+        """Hold a free slot, connected to the server, for the duration of the block"""
+        self._ensure_ring()
+        slot = self._free.get()
+        try:
+            if slot.sock is None:
+                self._connect(slot)
+            yield slot
+        finally:
+            self._free.put(slot)
+
+    def request(self, message: Dict, inputs: Optional[np.ndarray] = None) -> Dict:
+        """
+        Send a request, with `inputs` written into the slot first
+
+        Args:
+            message: Request header
+            inputs: float32 tensor for the server to read from shared memory
+        Returns: Reply header
+        """
+        with self.slot() as slot:
+            if inputs is not None:
+                self._write(slot, inputs)
+                message = {**message, "shape": list(inputs.shape)}
+            return self._exchange(slot, message)
+
+    def _write(self, slot: _Slot, inputs: np.ndarray):
+        nbytes = inputs.size * 4
+        if nbytes > self.slot_bytes:
+            raise ValueError(f"Tensor of shape {inputs.shape} does not fit in a {self.slot_bytes} byte slot")
+        np.copyto(np.ndarray(inputs.shape, dtype=np.float32, buffer=slot.region), inputs, casting="same_kind")
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        """Embed texts on the server; the vectors come back through shared memory"""
+        with self.slot() as slot:
+            reply = self._exchange(slot, {"op": "embed", "texts": texts})
+            shape = tuple(reply["shape"])
+            return np.ndarray(shape, dtype=np.float32, buffer=slot.region).copy()
+
+    def close(self):
+        """Close the connections and remove the shared-memory ring"""
+        with self._lock:
+            if self._shm is None:
+                return
+            while not self._free.empty():
+                slot = self._free.get_nowait()
+                slot.close()
+                slot.region = None
+            try:
+                self._shm.close()
+                self._shm.unlink()
+            except (BufferError, FileNotFoundError) as e:
+                logger.warning(f"Error removing model server ring: {e}")
+            self._shm = None
+
+
+class RemoteModel:
+    """
+    Stand-in for DiseaseModel / PestModel in an API worker whose models live
+    in a model server.
+
+    Images are decoded and preprocessed in the worker; batches go to the
+    server through shared memory and come back as the usual result
+    dictionaries. The worker never imports TensorFlow.
+    """
+
+    def __init__(self, client: ModelServerClient, name: str, model_path: Optional[str] = None):
+        """
+        Args:
+            client: The worker's model server connection
+            name: "disease" or "pest"
+            model_path: Model file on the server (default: the server's default file)
+        """
+        if name not in INPUT_SPECS:
+            raise ValueError(f"Unknown model: {name}")
+        self.client = client
+        self.name = name
+        self.input_spec = INPUT_SPECS[name]
+        info = client.request({"op": "load", "model": name, "path": model_path})
+        self.key = info["key"]
+        self.model_path = info["model_path"]
+        self.runner_path = info["runner_path"]
+        self.runner_name = info["runner_name"]
+        self.target_size = tuple(info["target_size"])
+        self.class_names = info["class_names"]
+        self.remote_identity = info["identity"]
+        # The server runs the cascade, if one is configured; results carry its "stage"
+        self.cascade = None
+        self.tta_views = int(os.environ.get("TTA_VIEWS", 1))
+        self.tta = TTAPolicy(
+            max_views=int(os.environ.get("TTA_MAX_VIEWS", 8)),
+            budget_ms=float(os.environ.get("TTA_BUDGET_MS", 150)),
+            max_load=int(os.environ.get("TTA_MAX_LOAD", 4))
+        )
+        self.rows_per_request = client.slot_bytes // (self.input_spec.shape[0] * self.input_spec.shape[1] * self.input_spec.shape[2] * 4)
+        logger.info(f"{name.capitalize()} model served by {client.socket_path} ({self.model_path}, {self.runner_name})")
+
+    def close(self):
+        """Release this worker's hold on the model, so the server can free it"""
+        try:
+            self.client.request({"op": "unload", "key": self.key})
+        except Exception as e:
+            logger.error(f"Error unloading {self.key} from the model server: {e}")
+
+    def _draft(self) -> Optional[Tuple[int, int]]:
+        return draft_size([self.input_spec])
+
+    def preprocess_image(self, img_input: Union[str, bytes]) -> np.ndarray:
+        """
+        Preprocess image for prediction
+
+        Args: img_input: Either file path (str) or image bytes
+        Returns: Preprocessed image array
+        """
+        try:
+            with metrics.time("preprocess", component=self.name):
+                return preprocess(img_input, self.input_spec)
+        except Exception as e:
+            logger.error(f"Error preprocessing image: {e}")
+            raise ValueError(f"Failed to preprocess image: {str(e)}")
+
+    def preprocess_into(self, img_input: Union[str, bytes], out: np.ndarray) -> np.ndarray:
+        """Preprocess an image directly into one row of a batch buffer"""
+        try:
+            with metrics.time("preprocess", component=self.name):
+                return prepare_into(decode_image(img_input, self._draft()), self.input_spec, out)
+        except Exception as e:
+            logger.error(f"Error preprocessing image: {e}")
+            raise ValueError(f"Failed to preprocess image: {str(e)}")
+
+    def preprocess_views(self, img_input: Union[str, bytes], views: int) -> np.ndarray:
+        """Decode an image once and preprocess its test-time augmentation views"""
+        try:
+            with metrics.time("preprocess", component=self.name):
+                return make_views(decode_image(img_input, self._draft()), self.input_spec, views)
+        except Exception as e:
+            logger.error(f"Error preprocessing image: {e}")
+            raise ValueError(f"Failed to preprocess image: {str(e)}")
+
+    def predict_views(self, views_array: np.ndarray) -> Dict:
+        """Predict one image from its augmentation views in a single server call"""
+        metrics.observe(metrics.batch_size, len(views_array), component=self.name)
+        with metrics.time("forward", component=self.name):
+            return self.client.request({"op": "predict_views", "key": self.key}, views_array)["result"]
+
+    def predict_batch(self, img_array: np.ndarray) -> List[Dict]:
+        """
+        Predict a batch of preprocessed images on the model server
+
+        Args: img_array: Array of shape (N, height, width, 3) from preprocess_image
+        Returns: One result dictionary per image, in input order
+        """
+        metrics.observe(metrics.batch_size, len(img_array), component=self.name)
+        results = []
+        with metrics.time("forward", component=self.name):
+            # Batches larger than a slot are sent in slot-sized chunks
+            for start in range(0, len(img_array), self.rows_per_request):
+                chunk = img_array[start:start + self.rows_per_request]
+                results.extend(self.client.request({"op": "predict_batch", "key": self.key}, chunk)["results"])
+        return results
+
+    def predict(self, img_input: Union[str, bytes], tta: Optional[int] = None, load: int = 0) -> Dict:
+        """
+        Predict from an image, as DiseaseModel.predict / PestModel.predict
+
+        Args:
+            img_input: Either file path or image bytes
+            tta: Test-time augmentation views (defaults to TTA_VIEWS)
+            load: Images waiting elsewhere for this model, e.g. a batch queue
+        Returns: Dictionary with prediction results
+        """
+        try:
+            requested = self.tta_views if tta is None else tta
+            views, fallback = self.tta.plan(requested, load)
+            if views > 1:
+                with self.tta.track(views):
+                    result = self.predict_views(self.preprocess_views(img_input, views))
+            else:
+                result = self.predict_batch(self.preprocess_image(img_input))[0]
+            if requested > 1:
+                result["tta"] = {"requested": requested, "views": views, "fallback": fallback}
+            return result
+        except Exception as e:
+            logger.error(f"Prediction error: {e}")
+            return {"success": False, "error": str(e)}
+
+
+class RemoteEmbeddings:
+    """Sentence embedder running in the model server (embed_documents / embed_query)"""
+
+    def __init__(self, client: ModelServerClient, max_batch_size: int = 64):
+        self.client = client
+        self.max_batch_size = max_batch_size
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        vectors = []
+        for start in range(0, len(texts), self.max_batch_size):
+            vectors.extend(self.client.embed(texts[start:start + self.max_batch_size]).tolist())
+        return vectors
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
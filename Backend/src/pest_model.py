@@ -1,13 +1,15 @@
 import tensorflow as tf
 import numpy as np
-import cv2
-from PIL import Image
-import io
-from typing import Dict, Union, List
+from typing import Dict, Union, List, Optional
 import logging
 import os
 from keras.models import load_model as keras_load_model
-from keras.applications.mobilenet import preprocess_input
+
+from src.runners import EXPORTED_RUNNERS, create_runner, exported_model_path
+from src.metrics import metrics
+from src.preprocessing import PEST_INPUT, decode_image, draft_size, prepare_into, preprocess
+from src.tta import TTAPolicy, average_logits, make_views
+from src.cascade import fast_model_path, load_cascade
 
 logging.basicConfig(
     level=logging.INFO,
@@ -26,22 +28,65 @@ class PestModel:
     Pest classification model wrapper.
     """
     
-    def __init__(self, model_path: str = "Backend/models/pest_classifier.keras"):
+    def __init__(
+        self,
+        model_path: Optional[str] = None,
+        runner: Optional[str] = None,
+        runner_path: Optional[str] = None,
+        cascade_path: Optional[str] = None
+    ):
         """
         Initializes the PestModel.
         
-        Args: model_path (str): Path to the saved .keras model file.
+        Args:
+            model_path (str): Path to the saved .keras model file; defaults to
+                PEST_MODEL_PATH, then Backend/models/pest_classifier.keras.
+            runner (str): Inference backend (see src.runners.RUNNERS); defaults to
+                PEST_RUNNER, then MODEL_RUNNER, then "keras".
+            runner_path (str): Exported model for the tflite/onnx runners; defaults to
+                PEST_RUNNER_PATH, then the file next to model_path.
+            cascade_path (str): Distilled fast model answering confident images first;
+                defaults to PEST_CASCADE_PATH, or the .fast.keras file next to
+                model_path when MODEL_CASCADE=true. Unset disables the cascade.
         """
-        self.model_path = model_path
+        self.model_path = model_path or os.environ.get("PEST_MODEL_PATH", "Backend/models/pest_classifier.keras")
         self.model = None
+        self.runner = None
+        self.runner_name = runner or os.environ.get("PEST_RUNNER", os.environ.get("MODEL_RUNNER", "keras"))
+        self.runner_path = runner_path or os.environ.get("PEST_RUNNER_PATH")
+        self.cascade_path = cascade_path or os.environ.get("PEST_CASCADE_PATH") or (
+            fast_model_path(self.model_path)
+            if os.environ.get("MODEL_CASCADE", "false").lower() in ("1", "true", "yes") else None
+        )
+        # Minimum fast-model confidence (%) to answer without the full model
+        self.cascade_threshold = float(os.environ.get("PEST_CASCADE_THRESHOLD", os.environ.get("CASCADE_THRESHOLD", 90)))
+        self.cascade = None
         self.target_size = (224, 224)
+        self.input_spec = PEST_INPUT
+        # Test-time augmentation: TTA_VIEWS views per prediction unless the
+        # caller asks otherwise (1 = single crop)
+        self.tta_views = int(os.environ.get("TTA_VIEWS", 1))
+        self.tta = TTAPolicy(
+            max_views=int(os.environ.get("TTA_MAX_VIEWS", 8)),
+            budget_ms=float(os.environ.get("TTA_BUDGET_MS", 150)),
+            max_load=int(os.environ.get("TTA_MAX_LOAD", 4))
+        )
         self.class_names = CLASS_NAMES
         self.load_model()
+        if self.cascade_path:
+            self.cascade = load_cascade(self.cascade_path, self.cascade_threshold, "pest")
     
     def load_model(self):
         """
-        Loads the trained Keras model from the specified path.
+        Loads the trained Keras model (or its exported copy) and the inference runner.
         """
+        if self.runner_name in EXPORTED_RUNNERS:
+            self.runner_path = self.runner_path or exported_model_path(self.model_path, self.runner_name)
+            logger.info(f"Attempting to load {self.runner_name} model from: {self.runner_path}")
+            self.runner = create_runner(self.runner_name, path=self.runner_path)
+            logger.info(f"Pest model loaded successfully from {self.runner_path}")
+            return
+        
         logger.info(f"Attempting to load model from: {self.model_path}")
         try:
             if not os.path.exists(self.model_path):
@@ -49,8 +94,9 @@ class PestModel:
                 raise FileNotFoundError(f"Model file not found: {self.model_path}")
             
             self.model = keras_load_model(self.model_path)
+            self.runner = create_runner(self.runner_name, model=self.model, input_shape=(*self.target_size, 3))
             
-            logger.info(f"Pest model loaded successfully from {self.model_path}")
+            logger.info(f"Pest model loaded successfully from {self.model_path} ({self.runner_name})")
             
         except (IOError, ImportError) as e:
             logger.error(f"Error loading model from {self.model_path}. File not found or corrupted.", exc_info=True)
@@ -67,67 +113,135 @@ class PestModel:
         Returns: Preprocessed image as a numpy array.
         """
         try:
-            img = None
-            if isinstance(img_input, bytes):
-                # If input is bytes, decode it with OpenCV
-                nparr = np.frombuffer(img_input, np.uint8)
-                img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-            elif isinstance(img_input, str):
-                # If input is a path, read it with OpenCV
-                img = cv2.imread(img_input)
-            else:
-                raise TypeError(f"Invalid input type: {type(img_input)}. Expected 'str' or 'bytes'.")
-            
-            if img is None:
-                raise ValueError(f"Failed to load or decode image: {img_input}")
-            
-            # preprocessing
-            img_rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-            img_resized = cv2.resize(img_rgb, self.target_size)
-            img_array = np.expand_dims(img_resized, axis=0)
-            img_preprocessed = preprocess_input(img_array)
-            
-            return img_preprocessed
-            
+            with metrics.time("preprocess", component="pest"):
+                return preprocess(img_input, self.input_spec)
+        except Exception as e:
+            logger.error(f"Error preprocessing image: {e}", exc_info=True)
+            raise ValueError(f"Failed to preprocess image: {str(e)}")
+    
+    def preprocess_into(self, img_input: Union[str, bytes], out: np.ndarray) -> np.ndarray:
+        """
+        Preprocesses an image directly into one row of a batch buffer.
+        
+        Args:
+            img_input: Either file path (str) or image bytes.
+            out: float32 array of shape (224, 224, 3).
+        Returns: out.
+        """
+        try:
+            with metrics.time("preprocess", component="pest"):
+                img = decode_image(img_input, draft_size([self.input_spec]))
+                return prepare_into(img, self.input_spec, out)
         except Exception as e:
             logger.error(f"Error preprocessing image: {e}", exc_info=True)
             raise ValueError(f"Failed to preprocess image: {str(e)}")
     
-    def predict(self, img_input: Union[str, bytes]) -> Dict:
+    def preprocess_views(self, img_input: Union[str, bytes], views: int) -> np.ndarray:
+        """
+        Decodes an image once and preprocesses its test-time augmentation views.
+        
+        Args:
+            img_input: Either file path (str) or image bytes.
+            views: Number of crops/flips (see src.tta.VIEWS).
+        Returns: Array of shape (views, 224, 224, 3).
+        """
+        try:
+            with metrics.time("preprocess", component="pest"):
+                img = decode_image(img_input, draft_size([self.input_spec]))
+                return make_views(img, self.input_spec, views)
+        except Exception as e:
+            logger.error(f"Error preprocessing image: {e}", exc_info=True)
+            raise ValueError(f"Failed to preprocess image: {str(e)}")
+    
+    def predict_views(self, views_array: np.ndarray) -> Dict:
+        """
+        Predicts one image from its augmentation views in a single forward pass.
+        Args: views_array: Array of shape (views, 224, 224, 3) from preprocess_views.
+        Returns: A dictionary containing the prediction results from the averaged logits.
+        """
+        if self.runner is None:
+            raise RuntimeError("Model not loaded")
+        
+        metrics.observe(metrics.batch_size, len(views_array), component="pest")
+        with metrics.time("forward", component="pest"):
+            predictions = self.runner.predict(views_array)
+        with metrics.time("postprocess", component="pest"):
+            return self._format_prediction(average_logits(predictions))
+    
+    def predict(self, img_input: Union[str, bytes], tta: Optional[int] = None, load: int = 0) -> Dict:
         """
         Predicts the pest type from a given image (path or bytes).
-        Args: img_input: Either file path (str) or image bytes.
+        Args:
+            img_input: Either file path (str) or image bytes.
+            tta: Test-time augmentation views (defaults to TTA_VIEWS); reduced to fit
+                the latency budget, or to 1 when the model is busy.
+            load: Images waiting elsewhere for this model, e.g. a batch queue.
         Returns: A dictionary containing the prediction results.
         """
         try:
-            if self.model is None:
+            if self.runner is None:
                 logger.error("Prediction failed: Model is not loaded.")
                 raise RuntimeError("Model not loaded")
             
-            img_array = self.preprocess_image(img_input)
-
-            predictions = self.model.predict(img_array, verbose=0) 
-            pred_index = int(np.argmax(predictions[0]))
-            confidence = float(predictions[0][pred_index]) * 100
-            top_3_indices = np.argsort(predictions[0])[-3:][::-1]
-            top_3_predictions = [
-                {
-                    "pest": self.class_names[i],
-                    "confidence": round(float(predictions[0][i]) * 100, 2)
-                }
-                for i in top_3_indices
-            ]
+            requested = self.tta_views if tta is None else tta
+            views, fallback = self.tta.plan(requested, load)
+            if views > 1:
+                with self.tta.track(views):
+                    result = self.predict_views(self.preprocess_views(img_input, views))
+            else:
+                result = self.predict_batch(self.preprocess_image(img_input))[0]
             
-            return {
-                "success": True,
-                "predicted_pest": self.class_names[pred_index],
-                "confidence": round(confidence, 2),
-                "top_3_predictions": top_3_predictions
-            }
+            if requested > 1:
+                result["tta"] = {"requested": requested, "views": views, "fallback": fallback}
+            return result
             
         except Exception as e:
             logger.error(f"Prediction error: {e}", exc_info=True)
             return {
                 "success": False,
                 "error": str(e)
-            }
\ No newline at end of file
+            }
+    
+    def predict_batch(self, img_array: np.ndarray) -> List[Dict]:
+        """
+        Predicts pest types for a batch of preprocessed images in one forward pass.
+        Args: img_array: Array of shape (N, 224, 224, 3) from preprocess_image.
+        Returns: One result dictionary per image, in input order.
+        """
+        if self.runner is None:
+            raise RuntimeError("Model not loaded")
+        
+        metrics.observe(metrics.batch_size, len(img_array), component="pest")
+        with metrics.time("forward", component="pest"):
+            if self.cascade is not None:
+                predictions, stages = self.cascade.predict(img_array, self.runner.predict)
+            else:
+                predictions, stages = self.runner.predict(img_array), None
+        with metrics.time("postprocess", component="pest"):
+            results = [self._format_prediction(probs) for probs in predictions]
+            if stages is not None:
+                for result, stage in zip(results, stages):
+                    result["stage"] = stage
+            return results
+    
+    def _format_prediction(self, probs: np.ndarray) -> Dict:
+        """
+        Builds the result dictionary for a single row of model output.
+        """
+        pred_index = int(np.argmax(probs))
+        confidence = float(probs[pred_index]) * 100
+        top_3_indices = np.argsort(probs)[-3:][::-1]
+        top_3_predictions = [
+            {
+                "pest": self.class_names[i],
+                "confidence": round(float(probs[i]) * 100, 2)
+            }
+            for i in top_3_indices
+        ]
+        
+        return {
+            "success": True,
+            "predicted_pest": self.class_names[pred_index],
+            "confidence": round(confidence, 2),
+            "top_3_predictions": top_3_predictions
+        }
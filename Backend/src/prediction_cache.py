@@ -0,0 +1,255 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+import logging
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class MemoryCacheBackend:
+    """In-process LRU cache with a per-entry time to live"""
+
+    name = "memory"
+
+    def __init__(self, max_entries: int = 2048, ttl_seconds: float = 3600):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Dict]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            stored_at, value = entry
+            if time.time() - stored_at > self.ttl_seconds:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: Dict):
+        with self._lock:
+            self._entries[key] = (time.time(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class DiskCacheBackend:
+    """
+    SQLite-backed LRU cache with a time to live.
+
+    The database file can be shared by several uvicorn workers on the same
+    host; WAL mode lets readers proceed while another worker writes.
+
+    Least recently used rows are trimmed every `trim_every` inserts (1% of
+    max_entries by default) rather than on each one, so the table may exceed
+    max_entries by about that many rows per worker between trims.
+    """
+
+    name = "disk"
+
+    def __init__(
+        self,
+        path: str = "Backend/cache/predictions.sqlite",
+        max_entries: int = 100000,
+        ttl_seconds: float = 86400,
+        trim_every: Optional[int] = None
+    ):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.trim_every = trim_every or max(1, max_entries // 100)
+        self._inserts = 0
+        self._inserts_lock = threading.Lock()
+        self._local = threading.local()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS predictions ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, stored_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_predictions_accessed ON predictions (accessed_at)")
+
+    def _connect(self) -> sqlite3.Connection:
+        """One connection per thread, as sqlite3 connections are not thread-safe"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5.0)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key: str) -> Optional[Dict]:
+        now = time.time()
+        conn = self._connect()
+        row = conn.execute("SELECT value, stored_at FROM predictions WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        value, stored_at = row
+        with conn:
+            if now - stored_at > self.ttl_seconds:
+                conn.execute("DELETE FROM predictions WHERE key = ?", (key,))
+                return None
+            conn.execute("UPDATE predictions SET accessed_at = ? WHERE key = ?", (now, key))
+        return json.loads(value)
+
+    def set(self, key: str, value: Dict):
+        now = time.time()
+        conn = self._connect()
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO predictions (key, value, stored_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value), now, now)
+            )
+        with self._inserts_lock:
+            self._inserts += 1
+            due = self._inserts >= self.trim_every
+            if due:
+                self._inserts = 0
+        if due:
+            self._trim(conn)
+
+    def _trim(self, conn: sqlite3.Connection):
+        """Delete the least recently used rows beyond max_entries"""
+        excess = conn.execute("SELECT COUNT(*) FROM predictions").fetchone()[0] - self.max_entries
+        if excess <= 0:
+            return
+        with conn:
+            conn.execute(
+                "DELETE FROM predictions WHERE key IN ("
+                "SELECT key FROM predictions ORDER BY accessed_at LIMIT ?)",
+                (excess,)
+            )
+
+    def clear(self):
+        conn = self._connect()
+        with conn:
+            conn.execute("DELETE FROM predictions")
+
+    def __len__(self) -> int:
+        return self._connect().execute("SELECT COUNT(*) FROM predictions").fetchone()[0]
+
+
+def model_identity(model) -> str:
+    """
+    Identify a loaded model and its version
+
+    Args: model: DiseaseModel, PestModel or a model server's RemoteModel
+    Returns: Class name and runner plus the served model file's path, size and modification time,
+        and the cascade's fast model and threshold when one is in front
+    """
+    remote = getattr(model, "remote_identity", None)
+    if remote is not None:
+        # A model server's stand-in shares cache entries with the model it fronts
+        return remote
+    runner = getattr(model, "runner_name", "keras")
+    path = getattr(model, "runner_path", None) or getattr(model, "model_path", "")
+    try:
+        stat = os.stat(path)
+        version = f"{stat.st_size}:{int(stat.st_mtime)}"
+    except OSError:
+        version = "unknown"
+    identity = f"{type(model).__name__}:{runner}:{path}:{version}"
+    cascade = getattr(model, "cascade", None)
+    return f"{identity}:{cascade.identity()}" if cascade is not None else identity
+
+
+class PredictionCache:
+    """
+    Content-hash cache of prediction results.
+
+    Keys combine a SHA-256 of the raw upload bytes with the model identity,
+    so replacing a model file never serves results from the old model.
+    """
+
+    def __init__(self, backend=None):
+        self.backend = backend if backend is not None else MemoryCacheBackend()
+        self.hits = 0
+        self.misses = 0
+        # get() runs on several executor threads
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(contents: bytes, model_id: str) -> str:
+        digest = hashlib.sha256(contents).hexdigest()
+        return f"{model_id}|{digest}"
+
+    def get(self, contents: bytes, model_id: str) -> Optional[Dict]:
+        """Return the cached result for these bytes, or None on a miss"""
+        try:
+            result = self.backend.get(self.make_key(contents, model_id))
+        except Exception as e:
+            logger.error(f"Prediction cache lookup failed: {e}")
+            result = None
+
+        with self._lock:
+            if result is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return result
+
+    def set(self, contents: bytes, model_id: str, result: Dict):
+        """Store a result; failed predictions are never cached"""
+        if not result.get("success"):
+            return
+        try:
+            self.backend.set(self.make_key(contents, model_id), result)
+        except Exception as e:
+            logger.error(f"Prediction cache store failed: {e}")
+
+    def stats(self) -> Dict:
+        with self._lock:
+            hits, misses = self.hits, self.misses
+        total = hits + misses
+        try:
+            entries = len(self.backend)
+        except Exception:
+            entries = None
+        return {
+            "backend": self.backend.name,
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": round(hits / total, 4) if total else 0.0,
+            "entries": entries
+        }
+
+
+def create_prediction_cache(backend: str = "memory", path: Optional[str] = None, max_entries: int = 2048, ttl_seconds: float = 3600) -> PredictionCache:
+    """
+    Build a prediction cache from configuration values
+
+    Args:
+        backend: "memory" for an in-process cache, "disk" for a SQLite file shared between workers
+        path: SQLite file path for the disk backend
+        max_entries: Maximum number of cached results
+        ttl_seconds: Time to live of each result
+    Returns: PredictionCache
+    """
+    if backend == "disk":
+        store = DiskCacheBackend(path or "Backend/cache/predictions.sqlite", max_entries=max_entries, ttl_seconds=ttl_seconds)
+    elif backend == "memory":
+        store = MemoryCacheBackend(max_entries=max_entries, ttl_seconds=ttl_seconds)
+    else:
+        raise ValueError(f"Unknown prediction cache backend: {backend}")
+    logger.info(f"Prediction cache initialized (backend={backend}, max_entries={max_entries}, ttl={ttl_seconds}s)")
+    return PredictionCache(store)
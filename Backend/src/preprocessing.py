@@ -0,0 +1,227 @@
+import io
+import os
+import threading
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+import cv2
+import numpy as np
+from PIL import Image, ImageOps
+import logging
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class InputSpec:
+    """
+    How one classifier expects its input image
+
+    Pixels are resized to `size` and mapped to `pixel * scale + offset`.
+    """
+
+    def __init__(self, name: str, size: Tuple[int, int], resize: str, scale: float, offset: float = 0.0):
+        """
+        Args:
+            name: Key used by preprocess_multi
+            size: (width, height) of the model input
+            resize: "pil" (antialiased bicubic, as used in training for the
+                disease model) or "cv2" (bilinear, as used for the pest model)
+            scale: Multiplier applied to 0-255 pixel values
+            offset: Added after scaling
+        """
+        self.name = name
+        self.size = size
+        self.resize = resize
+        self.scale = scale
+        self.offset = offset
+
+    @property
+    def shape(self) -> Tuple[int, int, int]:
+        return (self.size[1], self.size[0], 3)
+
+
+# Matches the original DiseaseModel preprocessing: PIL resize, then / 255
+DISEASE_INPUT = InputSpec("disease", (256, 256), resize="pil", scale=1 / 255.0)
+# Matches the original PestModel preprocessing: cv2 resize, then MobileNet's x / 127.5 - 1
+PEST_INPUT = InputSpec("pest", (224, 224), resize="cv2", scale=1 / 127.5, offset=-1.0)
+
+# JPEGs can be decoded at the smallest DCT scale that keeps at least this many
+# times the model's input resolution, e.g. a 12 MP photo at 1/4 for 256x256
+# with 2. The default 0 decodes at full resolution, as the original pipelines
+# did: check top-1 parity with benchmarks/preprocess_parity.py on real photos
+# before raising it.
+DRAFT_FACTOR = float(os.environ.get("PREPROCESS_DRAFT_FACTOR", 0))
+
+_EXIF_ORIENTATION = 0x0112
+
+_scratch = threading.local()
+
+
+def decode_image(img_input: Union[str, bytes], min_size: Optional[Tuple[int, int]] = None) -> Image.Image:
+    """
+    Decode an image to RGB, upright according to its EXIF orientation
+
+    Args:
+        img_input: Either file path (str) or image bytes
+        min_size: (width, height) the decoded image must still cover; large
+            JPEGs are decoded at reduced resolution (libjpeg DCT scaling) down to it
+    Returns: RGB PIL image
+    """
+    if isinstance(img_input, bytes):
+        img = Image.open(io.BytesIO(img_input))
+    elif isinstance(img_input, str):
+        img = Image.open(img_input)
+    else:
+        raise TypeError(f"Invalid input type: {type(img_input)}. Expected 'str' or 'bytes'.")
+
+    orientation = img.getexif().get(_EXIF_ORIENTATION, 1)
+    if min_size is not None and img.format == "JPEG":
+        # Orientations 5-8 are stored rotated by 90 degrees
+        img.draft("RGB", min_size if orientation < 5 else (min_size[1], min_size[0]))
+    if orientation != 1:
+        # Phone photos are often stored sideways with an EXIF rotation (cv2.imdecode applied it too)
+        img = ImageOps.exif_transpose(img)
+    if img.mode != "RGB":
+        img = img.convert("RGB")
+    return img
+
+
+def draft_size(specs: Sequence[InputSpec], draft_factor: float = DRAFT_FACTOR) -> Optional[Tuple[int, int]]:
+    """decode_image min_size covering every spec at `draft_factor` (None when it is 0: full resolution)"""
+    if not draft_factor:
+        return None
+    return (
+        int(max(spec.size[0] for spec in specs) * draft_factor),
+        int(max(spec.size[1] for spec in specs) * draft_factor)
+    )
+
+
+def _resize_buffer(spec: InputSpec) -> np.ndarray:
+    """Per-thread uint8 buffer reused as the cv2 resize destination"""
+    buffers = getattr(_scratch, "buffers", None)
+    if buffers is None:
+        buffers = _scratch.buffers = {}
+    buffer = buffers.get(spec.shape)
+    if buffer is None:
+        buffer = buffers[spec.shape] = np.empty(spec.shape, dtype=np.uint8)
+    return buffer
+
+
+def prepare_into(img: Image.Image, spec: InputSpec, out: np.ndarray) -> np.ndarray:
+    """
+    Resize and normalise a decoded image straight into `out`
+
+    Args:
+        img: RGB image from decode_image
+        spec: Target model input
+        out: float32 array of shape spec.shape, e.g. one row of a batch
+    Returns: out
+    """
+    if spec.resize == "pil":
+        resized = np.asarray(img.resize(spec.size))
+    else:
+        resized = cv2.resize(np.asarray(img), spec.size, dst=_resize_buffer(spec))
+
+    np.multiply(resized, spec.scale, out=out, casting="unsafe")
+    if spec.offset:
+        out += spec.offset
+    return out
+
+
+def preprocess(img_input: Union[str, bytes], spec: InputSpec, draft_factor: float = DRAFT_FACTOR) -> np.ndarray:
+    """
+    Decode and preprocess one image
+
+    Args:
+        img_input: Either file path (str) or image bytes
+        spec: Target model input
+        draft_factor: See DRAFT_FACTOR; 0 decodes at full resolution
+    Returns: float32 array of shape (1, height, width, 3)
+    """
+    img = decode_image(img_input, draft_size([spec], draft_factor))
+    out = np.empty((1, *spec.shape), dtype=np.float32)
+    prepare_into(img, spec, out[0])
+    return out
+
+
+def preprocess_multi(
+    img_input: Union[str, bytes],
+    specs: Sequence[InputSpec],
+    draft_factor: float = DRAFT_FACTOR
+) -> Dict[str, np.ndarray]:
+    """
+    Decode an image once and produce the input for several models
+
+    Args:
+        img_input: Either file path (str) or image bytes
+        specs: Target model inputs, e.g. (DISEASE_INPUT, PEST_INPUT)
+        draft_factor: See DRAFT_FACTOR; 0 decodes at full resolution
+    Returns: {spec.name: float32 array of shape (1, height, width, 3)}
+    """
+    img = decode_image(img_input, draft_size(specs, draft_factor))
+    outputs = {}
+    for spec in specs:
+        out = np.empty((1, *spec.shape), dtype=np.float32)
+        prepare_into(img, spec, out[0])
+        outputs[spec.name] = out
+    return outputs
+
+
+def preprocess_batch(
+    img_inputs: Sequence[Union[str, bytes]],
+    spec: InputSpec,
+    out: Optional[np.ndarray] = None,
+    draft_factor: float = DRAFT_FACTOR
+) -> Tuple[np.ndarray, List[Optional[Exception]]]:
+    """
+    Decode and preprocess several images into one batch array
+
+    Args:
+        img_inputs: File paths or image bytes
+        spec: Target model input
+        out: Optional float32 array of shape (>= N, height, width, 3) to fill,
+            e.g. from a BufferPool
+        draft_factor: See DRAFT_FACTOR; 0 decodes at full resolution
+    Returns: (batch of shape (N, height, width, 3), per-image error or None).
+        Rows of images that failed to decode are left unspecified.
+    """
+    if out is None:
+        out = np.empty((len(img_inputs), *spec.shape), dtype=np.float32)
+    min_size = draft_size([spec], draft_factor)
+    errors: List[Optional[Exception]] = []
+    for i, img_input in enumerate(img_inputs):
+        try:
+            prepare_into(decode_image(img_input, min_size), spec, out[i])
+            errors.append(None)
+        except Exception as e:
+            logger.error(f"Error preprocessing image {i}: {e}")
+            errors.append(e)
+    return out[:len(img_inputs)], errors
+
+
+class BufferPool:
+    """
+    Reusable float32 batch buffers, so stacking a batch does not allocate a
+    new multi-megabyte array per forward pass.
+
+    A buffer must be released only once nothing reads it any more.
+    """
+
+    def __init__(self, max_buffers: int = 4):
+        self.max_buffers = max_buffers
+        self._free: Dict[Tuple[int, ...], List[np.ndarray]] = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, batch_size: int, shape: Tuple[int, int, int]) -> np.ndarray:
+        """A buffer of at least `batch_size` rows; slice it to the batch size"""
+        with self._lock:
+            free = self._free.get(shape, [])
+            for i, buffer in enumerate(free):
+                if len(buffer) >= batch_size:
+                    return free.pop(i)
+        return np.empty((batch_size, *shape), dtype=np.float32)
+
+    def release(self, buffer: np.ndarray):
+        with self._lock:
+            free = self._free.setdefault(buffer.shape[1:], [])
+            if len(free) < self.max_buffers:
+                free.append(buffer)
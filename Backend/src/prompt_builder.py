@@ -0,0 +1,120 @@
+from typing import Dict, List, Optional
+import logging
+
+from langchain_core.messages import HumanMessage, SystemMessage
+from langchain_core.prompt_values import ChatPromptValue
+
+from src.memory import PromptTokenStats, count_tokens
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+SYSTEM_PROMPT = (
+    "You are Krishi Mitra, an agricultural assistant for farmers. "
+    "Give practical, actionable advice based on the weather and farming best practices. "
+    "Answer in HTML using only <h3>, <h4>, <p>, <ul>, <li>, <strong> and <br>."
+)
+
+NO_WEATHER = "not available"
+
+
+def _number(value) -> str:
+    """Compact number: 27.0 -> "27", 27.50 -> "27.5"; other values unchanged"""
+    if isinstance(value, float):
+        return f"{value:g}"
+    return str(value)
+
+
+class PromptBuilder:
+    """
+    Builds the chat prompt from the weather, history and query sections.
+
+    The instructions are a fixed system message built (and counted) once, so
+    every call sends the same leading bytes and endpoints with prefix caching
+    can reuse them. The sections follow in a user message in order of how
+    often they change: weather (per location), history (per turn), query.
+    """
+
+    def __init__(
+        self,
+        system_prompt: str = SYSTEM_PROMPT,
+        weather_tokens: int = 120,
+        forecast_days: int = 3,
+        stats: Optional[PromptTokenStats] = None
+    ):
+        """
+        Args:
+            system_prompt: Static instructions sent first in every prompt
+            weather_tokens: Token budget of the weather summary; forecast days are dropped to fit it
+            forecast_days: Forecast days (today first) included at most
+            stats: Per-section token counts are recorded here
+        """
+        self.system_message = SystemMessage(content=system_prompt)
+        self.prefix_tokens = count_tokens(system_prompt)
+        self.weather_tokens = weather_tokens
+        self.forecast_days = forecast_days
+        self.stats = stats if stats is not None else PromptTokenStats()
+
+    def weather_summary(self, weather: Optional[Dict]) -> str:
+        """
+        Plain key/value summary of current conditions and the next forecast days
+
+        Args:
+            weather: WeatherClient.get_weather result, or None
+        Returns: Summary of at most `weather_tokens` tokens (current conditions are always kept)
+        """
+        if not weather:
+            return NO_WEATHER
+        lines = [
+            f"location: {weather['location']}, {weather['region']}",
+            f"now: {_number(weather['temperature'])}°C (feels {_number(weather['feels_like'])}°C), "
+            f"{weather['conditions']}, humidity {weather['humidity']}%, "
+            f"wind {_number(weather['wind_speed'])} kph {weather['wind_direction']}, "
+            f"rain {_number(weather['rainfall'])} mm, cloud {weather['cloud_cover']}%, UV {_number(weather['uv_index'])}"
+        ]
+        tokens = count_tokens("\n".join(lines))
+        for line in self._forecast_lines(weather.get("forecast") or []):
+            line_tokens = count_tokens(line)
+            if tokens + line_tokens > self.weather_tokens:
+                break
+            lines.append(line)
+            tokens += line_tokens
+        return "\n".join(lines)
+
+    def _forecast_lines(self, forecast: List[Dict]) -> List[str]:
+        """One line per forecast day, nearest first"""
+        lines = []
+        for day in forecast[:self.forecast_days]:
+            try:
+                values = day["day"]
+                lines.append(
+                    f"{day['date']}: {_number(values['mintemp_c'])}-{_number(values['maxtemp_c'])}°C, "
+                    f"{values['condition']['text']}, rain {_number(values['totalprecip_mm'])} mm "
+                    f"({values['daily_chance_of_rain']}%)"
+                )
+            except (KeyError, TypeError) as e:
+                logger.error(f"Error formatting forecast day: {e}")
+                break
+        return lines
+
+    def build(self, sections: Dict[str, str]) -> ChatPromptValue:
+        """
+        Assemble the prompt and record its token counts per section
+
+        Args:
+            sections: {"weather_context": str, "history": str, "query": str}
+        Returns: System and user messages for the chat model
+        """
+        weather, history, query = sections["weather_context"], sections["history"], sections["query"]
+        parts = [f"Weather:\n{weather}"]
+        if history:
+            parts.append(f"Conversation so far:\n{history}")
+        parts.append(f"Question: {query}")
+        body = "\n\n".join(parts)
+
+        counts = {"weather_context": count_tokens(weather), "history": count_tokens(history), "query": count_tokens(query)}
+        counts["template"] = self.prefix_tokens + count_tokens(body) - sum(counts.values())
+        counts["total"] = sum(counts.values())
+        self.stats.record(counts)
+        logger.info("Prompt tokens: " + ", ".join(f"{name}={count}" for name, count in counts.items()))
+        return ChatPromptValue(messages=[self.system_message, HumanMessage(content=body)])
@@ -0,0 +1,384 @@
+import asyncio
+import json
+import os
+import random
+import time
+from collections import deque
+from concurrent.futures import Executor
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+import numpy as np
+import logging
+
+from src.batching import BatchScheduler
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Recent requests and forward passes kept per version for latency percentiles
+LATENCY_WINDOW = 1000
+DRAIN_POLL_SECONDS = 0.1
+
+
+def version_name(path: str) -> str:
+    """Default version label: file name and modification time, e.g. disease_classifier.h5@20240501T120000"""
+    try:
+        stamp = time.strftime("%Y%m%dT%H%M%S", time.localtime(os.path.getmtime(path)))
+    except OSError:
+        stamp = "unknown"
+    return f"{os.path.basename(path)}@{stamp}"
+
+
+def _percentiles(values) -> Dict:
+    if not values:
+        return {"p50_ms": None, "p95_ms": None, "p99_ms": None}
+    p50, p95, p99 = np.percentile(np.fromiter(values, dtype=np.float64), [50, 95, 99]) * 1000
+    return {"p50_ms": round(float(p50), 2), "p95_ms": round(float(p95), 2), "p99_ms": round(float(p99), 2)}
+
+
+class ModelVersion:
+    """One version of a model: its file, load state and serving latency"""
+
+    def __init__(self, version: str, path: str):
+        self.version = version
+        self.path = path
+        self.model = None
+        # loading -> ready -> active/shadow -> draining -> retired, or failed
+        self.state = "loading"
+        self.error: Optional[str] = None
+        self.load_seconds: Optional[float] = None
+        self.warmup_seconds: Optional[float] = None
+        self.activated_at: Optional[float] = None
+        self.images = 0
+        self.batches = 0
+        self._latencies = deque(maxlen=LATENCY_WINDOW)
+        self._forward = deque(maxlen=LATENCY_WINDOW)
+        self._task: Optional[asyncio.Task] = None
+
+    def record(self, forward_seconds: float, latencies: List[float]):
+        """Record one forward pass and the end-to-end time of the requests in it"""
+        self.batches += 1
+        self.images += len(latencies)
+        self._forward.append(forward_seconds)
+        self._latencies.extend(latencies)
+
+    def stats(self) -> Dict:
+        return {
+            "version": self.version,
+            "path": self.path,
+            "state": self.state,
+            "error": self.error,
+            "load_seconds": self.load_seconds,
+            "warmup_seconds": self.warmup_seconds,
+            "activated_at": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.activated_at)) if self.activated_at else None,
+            "images": self.images,
+            "batches": self.batches,
+            "latency": _percentiles(self._latencies),
+            "forward_latency": _percentiles(self._forward)
+        }
+
+
+class ModelRegistry:
+    """
+    Versions of one image model, with zero-downtime switching between them.
+
+    A new version is loaded and warmed up in a worker thread while the
+    current one keeps serving. Switching replaces the batch scheduler's
+    model between forward passes: requests already submitted finish on the
+    old version, which is released once none are left. A loaded version can
+    instead run as a shadow, seeing a share of live traffic in the
+    background so its predictions can be compared with the active version's
+    before it is promoted.
+
+    The active version's path is saved to `state_path` (when set), so a
+    restarted worker loads the version that was last activated.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        build: Callable[[str], Any],
+        make_scheduler: Callable[[Any, str], BatchScheduler],
+        warmup: Optional[Callable[[Any], None]] = None,
+        on_activate: Optional[Callable[[Any], Awaitable[None]]] = None,
+        state_path: Optional[str] = None,
+        executor: Optional[Executor] = None
+    ):
+        """
+        Args:
+            name: Model name (e.g. "disease"), used for the state file entry and logs
+            build: Loads the model from a file path; runs in a worker thread
+            make_scheduler: Creates a (not yet started) BatchScheduler for a shadow model; it should
+                run on its own executor, not the one serving live traffic
+            warmup: Optional warm-up call on a loaded model; runs in a worker thread
+            on_activate: Optional coroutine called with the model once it serves traffic
+            state_path: JSON file recording the active version of each model; None disables it
+            executor: Executor for loading; None uses the event loop's default
+        """
+        self.name = name
+        self.build = build
+        self.make_scheduler = make_scheduler
+        self.warmup = warmup
+        self.on_activate = on_activate
+        self.state_path = state_path
+        self.executor = executor
+        self.versions: Dict[str, ModelVersion] = {}
+        self.active: Optional[ModelVersion] = None
+        self.scheduler: Optional[BatchScheduler] = None
+        self.shadow: Optional[ModelVersion] = None
+        self.shadow_percent = 0.0
+        self.shadow_scheduler: Optional[BatchScheduler] = None
+        self.comparison = self._new_comparison()
+        self._by_model: Dict[int, ModelVersion] = {}
+        self._shadow_tasks = set()
+
+    @staticmethod
+    def _new_comparison() -> Dict:
+        return {"compared": 0, "agreed": 0, "confidence_delta_sum": 0.0, "shadow_errors": 0, "skipped_busy": 0}
+
+    def saved_path(self) -> Optional[str]:
+        """Path of the version last activated, from the state file, if it still exists"""
+        if not self.state_path or not os.path.exists(self.state_path):
+            return None
+        try:
+            with open(self.state_path) as f:
+                path = json.load(f).get(self.name, {}).get("path")
+        except (OSError, ValueError) as e:
+            logger.error(f"Error reading model registry state {self.state_path}: {e}")
+            return None
+        if path and not os.path.exists(path):
+            logger.warning(f"Saved {self.name} model {path} no longer exists; using the default")
+            return None
+        return path
+
+    def _save(self):
+        if not self.state_path:
+            return
+        try:
+            state = {}
+            if os.path.exists(self.state_path):
+                with open(self.state_path) as f:
+                    state = json.load(f)
+            state[self.name] = {"version": self.active.version, "path": self.active.path}
+            tmp_path = f"{self.state_path}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(state, f, indent=2)
+            os.replace(tmp_path, self.state_path)
+        except (OSError, ValueError) as e:
+            logger.error(f"Error saving model registry state {self.state_path}: {e}")
+
+    def attach(self, model, scheduler: BatchScheduler):
+        """Register the model loaded at startup as the active version and observe its scheduler"""
+        path = model.model_path
+        version = ModelVersion(version_name(path), path)
+        version.model = model
+        version.state = "active"
+        version.activated_at = time.time()
+        self.versions[version.version] = version
+        self._by_model[id(model)] = version
+        self.active = version
+        self.scheduler = scheduler
+        scheduler.on_batch = self._observe
+
+    def _observe(self, model, forward_seconds: float, latencies: List[float]):
+        version = self._by_model.get(id(model))
+        if version is not None:
+            version.record(forward_seconds, latencies)
+
+    def deploy(self, path: str, version: Optional[str] = None, shadow_percent: Optional[float] = None) -> ModelVersion:
+        """
+        Load a new version in the background, then activate it (or run it as a shadow)
+
+        Args:
+            path: Model file
+            version: Version label (default: file name and modification time)
+            shadow_percent: Share of traffic (0-100) to mirror to it instead of activating it
+        Returns: The version, still loading
+        """
+        version = version or version_name(path)
+        existing = self.versions.get(version)
+        if existing is not None and existing.state in ("loading", "active", "shadow"):
+            raise ValueError(f"{self.name} version {version} is already {existing.state}")
+        if existing is not None and existing.path != path:
+            raise ValueError(f"{self.name} version {version} already refers to {existing.path}")
+
+        entry = ModelVersion(version, path)
+        self.versions[version] = entry
+        entry._task = asyncio.ensure_future(self._deploy(entry, shadow_percent))
+        return entry
+
+    async def _deploy(self, entry: ModelVersion, shadow_percent: Optional[float]):
+        if not await self._load(entry):
+            return
+        try:
+            if shadow_percent is None:
+                await self.activate(entry.version)
+            else:
+                await self.start_shadow(entry.version, shadow_percent)
+        except Exception as e:
+            logger.error(f"Error switching {self.name} to {entry.version}: {e}")
+
+    async def _load(self, entry: ModelVersion) -> bool:
+        loop = asyncio.get_running_loop()
+        entry.state = "loading"
+        entry.error = None
+        try:
+            start = time.perf_counter()
+            model = await loop.run_in_executor(self.executor, self.build, entry.path)
+            entry.load_seconds = round(time.perf_counter() - start, 3)
+            if self.warmup is not None:
+                start = time.perf_counter()
+                await loop.run_in_executor(self.executor, self.warmup, model)
+                entry.warmup_seconds = round(time.perf_counter() - start, 3)
+        except Exception as e:
+            entry.state = "failed"
+            entry.error = str(e)
+            logger.error(f"Failed to load {self.name} version {entry.version} from {entry.path}: {e}")
+            return False
+
+        entry.model = model
+        entry.state = "ready"
+        self._by_model[id(model)] = entry
+        logger.info(f"{self.name} version {entry.version} ready (load {entry.load_seconds}s, warm-up {entry.warmup_seconds or 0}s)")
+        return True
+
+    async def activate(self, version: str) -> ModelVersion:
+        """
+        Switch traffic to a version, loading it again first if it was retired
+
+        Returns: The now active version
+        Raises: KeyError for an unknown version, RuntimeError if it cannot be loaded
+        """
+        entry = self.versions[version]
+        if entry is self.active:
+            return entry
+        if entry.state == "loading" and entry._task is not None and entry._task is not asyncio.current_task():
+            await asyncio.shield(entry._task)
+            if entry is self.active:
+                return entry
+        if entry.model is None and not await self._load(entry):
+            raise RuntimeError(f"{self.name} version {version} failed to load: {entry.error}")
+        if entry is self.shadow:
+            await self.stop_shadow()
+
+        previous = self.active
+        # One assignment on the event loop: batches formed from now on use the
+        # new model, requests already submitted keep the old one
+        self.scheduler.model = entry.model
+        self.active = entry
+        entry.state = "active"
+        entry.activated_at = time.time()
+        if self.on_activate is not None:
+            await self.on_activate(entry.model)
+        self._save()
+        logger.info(f"{self.name} switched to version {version}" + (f" from {previous.version}" if previous else ""))
+
+        if previous is not None:
+            previous.state = "draining"
+            asyncio.ensure_future(self._drain(previous))
+        return entry
+
+    async def _drain(self, entry: ModelVersion):
+        """Release a replaced version once no submitted request still uses it"""
+        while entry.model is not None and self.scheduler.outstanding(entry.model):
+            await asyncio.sleep(DRAIN_POLL_SECONDS)
+        if entry is self.active or entry is self.shadow:
+            return
+        model = entry.model
+        self._by_model.pop(id(model), None)
+        entry.model = None
+        entry.state = "retired"
+        # Models held elsewhere (RemoteModel in a model server) are released explicitly
+        close = getattr(model, "close", None)
+        if close is not None:
+            try:
+                await asyncio.get_running_loop().run_in_executor(self.executor, close)
+            except Exception as e:
+                logger.error(f"Error closing {self.name} version {entry.version}: {e}")
+        logger.info(f"{self.name} version {entry.version} drained and released")
+
+    async def start_shadow(self, version: str, percent: float):
+        """Mirror `percent` % of the active version's traffic to a loaded version"""
+        entry = self.versions[version]
+        if entry is self.active:
+            raise ValueError(f"{self.name} version {version} is active")
+        if entry.model is None and not await self._load(entry):
+            raise RuntimeError(f"{self.name} version {version} failed to load: {entry.error}")
+        await self.stop_shadow()
+
+        scheduler = self.make_scheduler(entry.model, f"{self.name}-shadow")
+        scheduler.on_batch = self._observe
+        await scheduler.start()
+        self.shadow, self.shadow_scheduler = entry, scheduler
+        self.shadow_percent = max(0.0, min(100.0, percent))
+        self.comparison = self._new_comparison()
+        entry.state = "shadow"
+        logger.info(f"{self.name} version {version} shadowing {self.shadow_percent:g}% of traffic")
+
+    async def stop_shadow(self):
+        """Stop mirroring traffic; the shadow version stays loaded and can still be activated"""
+        if self.shadow is None:
+            return
+        scheduler, entry = self.shadow_scheduler, self.shadow
+        self.shadow, self.shadow_scheduler, self.shadow_percent = None, None, 0.0
+        if self._shadow_tasks:
+            await asyncio.gather(*self._shadow_tasks, return_exceptions=True)
+        await scheduler.stop()
+        if entry.state == "shadow":
+            entry.state = "ready"
+
+    def mirror(self, contents: bytes, result: Dict):
+        """
+        Send a sampled request to the shadow version in the background
+
+        Args:
+            contents: The uploaded image
+            result: The active version's result for it
+        """
+        scheduler = self.shadow_scheduler
+        if scheduler is None or random.random() * 100 >= self.shadow_percent:
+            return
+        live_waiting = self.scheduler.queue_depth if self.scheduler is not None else 0
+        if live_waiting or scheduler.queue_depth >= 2 * scheduler.max_batch_size:
+            # The shadow must never hold up live traffic: skip it while live
+            # images are waiting for a batch, or when the shadow itself is behind
+            self.comparison["skipped_busy"] += 1
+            return
+        task = asyncio.ensure_future(self._compare(scheduler, contents, result))
+        self._shadow_tasks.add(task)
+        task.add_done_callback(self._shadow_tasks.discard)
+
+    async def _compare(self, scheduler: BatchScheduler, contents: bytes, primary: Dict):
+        try:
+            shadow = await scheduler.submit(contents)
+        except Exception as e:
+            logger.error(f"{self.name} shadow prediction error: {e}")
+            shadow = {"success": False}
+        if not shadow.get("success"):
+            self.comparison["shadow_errors"] += 1
+            return
+        if not primary.get("success"):
+            return
+
+        def label(result):
+            return result.get("predicted_class", result.get("predicted_pest"))
+
+        self.comparison["compared"] += 1
+        self.comparison["agreed"] += int(label(shadow) == label(primary))
+        self.comparison["confidence_delta_sum"] += shadow["confidence"] - primary["confidence"]
+
+    def stats(self) -> Dict:
+        comparison = dict(self.comparison)
+        compared = comparison.pop("compared")
+        delta_sum = comparison.pop("confidence_delta_sum")
+        return {
+            "active": self.active.version if self.active else None,
+            "shadow": {
+                "version": self.shadow.version,
+                "percent": self.shadow_percent,
+                "compared": compared,
+                "agreement": round(comparison.pop("agreed") / compared, 4) if compared else None,
+                "mean_confidence_delta": round(delta_sum / compared, 3) if compared else None,
+                **comparison
+            } if self.shadow else None,
+            "versions": [entry.stats() for entry in self.versions.values()]
+        }
@@ -0,0 +1,240 @@
+import os
+import threading
+from typing import Callable, Iterable, Optional, Tuple
+import numpy as np
+import logging
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+RUNNERS = ("keras", "tf_function", "tflite", "onnx")
+EXPORTED_RUNNERS = ("tflite", "onnx")
+QUANTIZATIONS = ("none", "float16", "dynamic", "int8")
+
+
+def exported_model_path(model_path: str, backend: str, quantization: str = "none") -> str:
+    """
+    Where the exported copy of a Keras model lives
+
+    e.g. Backend/models/disease_classifier.h5 -> Backend/models/disease_classifier.float16.tflite
+    """
+    stem = os.path.splitext(model_path)[0]
+    suffix = "" if quantization == "none" else f".{quantization}"
+    return f"{stem}{suffix}.{backend}"
+
+
+class KerasRunner:
+    """Plain Keras `model.predict` (the original behaviour)"""
+
+    name = "keras"
+
+    def __init__(self, model):
+        self.model = model
+
+    def predict(self, batch: np.ndarray) -> np.ndarray:
+        return np.asarray(self.model.predict(batch, verbose=0))
+
+
+class CompiledRunner:
+    """
+    Keras model called through a `tf.function` with a fixed input signature.
+
+    Skips `model.predict`'s per-call data-adapter and callback setup, which
+    dominates latency for small batches; the graph is traced once since the
+    batch dimension is left dynamic.
+    """
+
+    name = "tf_function"
+
+    def __init__(self, model, input_shape: Tuple[int, int, int], jit_compile: bool = False):
+        import tensorflow as tf
+
+        self.model = model
+        self._fn = tf.function(
+            lambda x: model(x, training=False),
+            input_signature=[tf.TensorSpec((None, *input_shape), tf.float32)],
+            jit_compile=jit_compile
+        )
+
+    def predict(self, batch: np.ndarray) -> np.ndarray:
+        return self._fn(np.asarray(batch, dtype=np.float32)).numpy()
+
+
+class TFLiteRunner:
+    """
+    Exported TFLite model run by the TFLite interpreter.
+
+    Interpreters are not thread-safe, so each worker thread gets its own;
+    the input tensor is resized whenever the batch size changes.
+    """
+
+    name = "tflite"
+
+    def __init__(self, path: str, num_threads: Optional[int] = None):
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"Exported model not found: {path} (run Backend/convert_models.py)")
+        self.path = path
+        self.num_threads = num_threads
+        self._local = threading.local()
+
+    def _interpreter(self):
+        interpreter = getattr(self._local, "interpreter", None)
+        if interpreter is None:
+            try:
+                from tflite_runtime.interpreter import Interpreter
+            except ImportError:
+                import tensorflow as tf
+                Interpreter = tf.lite.Interpreter
+            interpreter = Interpreter(model_path=self.path, num_threads=self.num_threads)
+            interpreter.allocate_tensors()
+            self._local.interpreter = interpreter
+            self._local.batch_size = interpreter.get_input_details()[0]["shape"][0]
+        return interpreter
+
+    def predict(self, batch: np.ndarray) -> np.ndarray:
+        interpreter = self._interpreter()
+        input_detail = interpreter.get_input_details()[0]
+        if self._local.batch_size != len(batch):
+            interpreter.resize_tensor_input(input_detail["index"], [len(batch), *input_detail["shape"][1:]])
+            interpreter.allocate_tensors()
+            self._local.batch_size = len(batch)
+            input_detail = interpreter.get_input_details()[0]
+
+        if input_detail["dtype"] != np.float32:
+            # Fully integer-quantised input: map floats onto the integer scale
+            scale, zero_point = input_detail["quantization"]
+            batch = np.round(batch / scale + zero_point)
+        interpreter.set_tensor(input_detail["index"], np.asarray(batch, dtype=input_detail["dtype"]))
+        interpreter.invoke()
+
+        output_detail = interpreter.get_output_details()[0]
+        output = interpreter.get_tensor(output_detail["index"])
+        if output_detail["dtype"] != np.float32:
+            scale, zero_point = output_detail["quantization"]
+            output = (output.astype(np.float32) - zero_point) * scale
+        return output
+
+
+class ONNXRunner:
+    """Exported ONNX model run by ONNX Runtime on CPU (needs `onnxruntime`)"""
+
+    name = "onnx"
+
+    def __init__(self, path: str, num_threads: Optional[int] = None):
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"Exported model not found: {path} (run Backend/convert_models.py)")
+        try:
+            import onnxruntime as ort
+        except ImportError:
+            raise ImportError("The onnx runner needs onnxruntime: pip install onnxruntime")
+
+        options = ort.SessionOptions()
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        self.path = path
+        self.session = ort.InferenceSession(path, sess_options=options, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+
+    def predict(self, batch: np.ndarray) -> np.ndarray:
+        return self.session.run(None, {self.input_name: np.asarray(batch, dtype=np.float32)})[0]
+
+
+def create_runner(
+    kind: str,
+    model=None,
+    path: Optional[str] = None,
+    input_shape: Optional[Tuple[int, int, int]] = None,
+    num_threads: Optional[int] = None
+):
+    """
+    Build an inference runner
+
+    Args:
+        kind: One of RUNNERS
+        model: Loaded Keras model (keras and tf_function runners)
+        path: Exported model file (tflite and onnx runners)
+        input_shape: (height, width, channels) of one input image (tf_function runner)
+        num_threads: CPU threads for the exported runners; None lets the runtime decide
+    Returns: Runner with a predict(batch) -> probabilities method
+    """
+    if kind == "keras":
+        return KerasRunner(model)
+    if kind == "tf_function":
+        return CompiledRunner(model, input_shape)
+    if kind == "tflite":
+        return TFLiteRunner(path, num_threads=num_threads)
+    if kind == "onnx":
+        return ONNXRunner(path, num_threads=num_threads)
+    raise ValueError(f"Unknown runner: {kind}. Expected one of {RUNNERS}")
+
+
+def export_tflite(
+    model,
+    path: str,
+    quantization: str = "none",
+    representative_data: Optional[Callable[[], Iterable[np.ndarray]]] = None
+):
+    """
+    Convert a Keras model to TFLite
+
+    Args:
+        model: Loaded Keras model
+        path: Output .tflite file
+        quantization: "none", "float16" (weights), "dynamic" (int8 weights) or
+            "int8" (int8 weights and activations, float input/output)
+        representative_data: Yields single preprocessed inputs; required for "int8"
+    """
+    import tensorflow as tf
+
+    if quantization not in QUANTIZATIONS:
+        raise ValueError(f"Unknown quantization: {quantization}. Expected one of {QUANTIZATIONS}")
+
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    if quantization != "none":
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    if quantization == "float16":
+        converter.target_spec.supported_types = [tf.float16]
+    elif quantization == "int8":
+        if representative_data is None:
+            raise ValueError("int8 quantization needs representative data")
+        converter.representative_dataset = lambda: ([sample] for sample in representative_data())
+
+    with open(path, "wb") as f:
+        f.write(converter.convert())
+    logger.info(f"Exported TFLite model ({quantization}) to {path}")
+
+
+def export_onnx(
+    model,
+    path: str,
+    input_shape: Tuple[int, int, int],
+    quantization: str = "none"
+):
+    """
+    Convert a Keras model to ONNX (needs `tf2onnx`; "dynamic"/"int8" also need `onnxruntime`)
+
+    Args:
+        model: Loaded Keras model
+        path: Output .onnx file
+        input_shape: (height, width, channels) of one input image
+        quantization: "none", or "dynamic"/"int8" for int8 weights via ONNX Runtime
+    """
+    import tensorflow as tf
+    try:
+        import tf2onnx
+    except ImportError:
+        raise ImportError("ONNX export needs tf2onnx: pip install tf2onnx")
+
+    if quantization == "float16":
+        raise ValueError("float16 quantization is only supported for TFLite exports")
+
+    fn = tf.function(lambda x: model(x, training=False))
+    signature = [tf.TensorSpec((None, *input_shape), tf.float32, name="input")]
+    float_path = path if quantization == "none" else f"{path}.float.onnx"
+    tf2onnx.convert.from_function(fn, input_signature=signature, output_path=float_path)
+
+    if quantization != "none":
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        quantize_dynamic(float_path, path, weight_type=QuantType.QInt8)
+        os.remove(float_path)
+    logger.info(f"Exported ONNX model ({quantization}) to {path}")
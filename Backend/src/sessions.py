@@ -0,0 +1,203 @@
+import threading
+import time
+import uuid
+from http.cookies import SimpleCookie
+from collections import OrderedDict
+from typing import Callable, Dict, Optional
+import logging
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+DEFAULT_SESSION_ID = "default"
+
+# Cookie remembering the session id generated for a client that sent none
+SESSION_COOKIE = "krishimitra_session"
+SESSION_COOKIE_MAX_AGE = 30 * 24 * 3600
+
+
+def new_session_id() -> str:
+    return uuid.uuid4().hex
+
+
+def session_cookie(session_id: str) -> bytes:
+    """Set-Cookie header value for a generated session id"""
+    return f"{SESSION_COOKIE}={session_id}; Max-Age={SESSION_COOKIE_MAX_AGE}; Path=/; HttpOnly; SameSite=Lax".encode()
+
+
+class ChatSession:
+    """
+    Conversation state for one user.
+
+    Holds only lightweight per-user data (memory, location, weather context);
+    the embedding model and LLM client stay shared on KrishiMitra.
+    """
+
+    def __init__(self, session_id: str, location: str):
+        self.session_id = session_id
+        self.location = location
+        self.weather_context: Optional[str] = None
+        self.weather_context_at = 0.0
+        self.history_memory = None
+        self.created_at = time.time()
+        # When history_memory was last started fresh (see KrishiMitra._session)
+        self.memory_reset_at = self.created_at
+        self.last_access = self.created_at
+        self.lock = threading.Lock()
+
+    def touch(self):
+        self.last_access = time.time()
+
+    def set_weather_context(self, context: str):
+        self.weather_context = context
+        self.weather_context_at = time.time()
+
+    def size_bytes(self) -> int:
+        """Approximate RAM held by this session's memory"""
+        size = len(self.weather_context or "")
+        if self.history_memory is not None:
+            size += self.history_memory.size_bytes()
+        return size
+
+
+class SessionManager:
+    """
+    Bounded store of chat sessions keyed by session id.
+
+    Sessions are evicted least-recently-used first when the session count or
+    the approximate total memory cap is exceeded, and expire after being idle
+    for `idle_ttl` seconds.
+    """
+
+    def __init__(
+        self,
+        factory: Callable[[str], ChatSession],
+        max_sessions: int = 10000,
+        idle_ttl: float = 1800,
+        max_total_bytes: int = 256 * 1024 * 1024,
+        size_fn: Optional[Callable[[ChatSession], int]] = None
+    ):
+        """
+        Args:
+            factory: Creates a new ChatSession for a session id
+            max_sessions: Maximum number of sessions kept in memory
+            idle_ttl: Seconds after which an unused session is dropped
+            max_total_bytes: Approximate cap on memory held by all sessions
+            size_fn: Measures a session's memory (defaults to ChatSession.size_bytes)
+        """
+        self.factory = factory
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+        self.max_total_bytes = max_total_bytes
+        self.size_fn = size_fn or (lambda session: session.size_bytes())
+        self._sessions: "OrderedDict[str, ChatSession]" = OrderedDict()
+        self._sizes: Dict[str, int] = {}
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def get(self, session_id: str) -> ChatSession:
+        """Return the session for an id, creating it if needed"""
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is not None:
+                self._sessions.move_to_end(session_id)
+                session.touch()
+                return session
+
+        # Build outside the lock; creating memory can be slow
+        new_session = self.factory(session_id)
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                session = self._sessions[session_id] = new_session
+                self._sizes[session_id] = 0
+            self._sessions.move_to_end(session_id)
+            session.touch()
+            self._evict()
+            return session
+
+    def update_size(self, session: ChatSession):
+        """Re-measure a session after its memory changed and enforce the caps"""
+        size = self.size_fn(session)
+        with self._lock:
+            if session.session_id not in self._sessions:
+                return
+            self._total_bytes += size - self._sizes.get(session.session_id, 0)
+            self._sizes[session.session_id] = size
+            self._evict()
+
+    def drop(self, session_id: str) -> bool:
+        """Remove a session and release its memory"""
+        with self._lock:
+            return self._remove(session_id)
+
+    def _remove(self, session_id: str) -> bool:
+        session = self._sessions.pop(session_id, None)
+        if session is None:
+            return False
+        self._total_bytes -= self._sizes.pop(session_id, 0)
+        return True
+
+    def _evict(self):
+        """Drop idle sessions, then least-recently-used ones over the caps (lock held)"""
+        now = time.time()
+        for session_id, session in list(self._sessions.items()):
+            if now - session.last_access <= self.idle_ttl:
+                # Ordered by recency, so everything after this is fresher
+                break
+            self._remove(session_id)
+            self.evictions += 1
+
+        while len(self._sessions) > 1 and (
+            len(self._sessions) > self.max_sessions or self._total_bytes > self.max_total_bytes
+        ):
+            session_id = next(iter(self._sessions))
+            self._remove(session_id)
+            self.evictions += 1
+            logger.info(f"Evicted chat session {session_id}")
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "sessions": len(self._sessions),
+                "max_sessions": self.max_sessions,
+                "total_bytes": self._total_bytes,
+                "max_total_bytes": self.max_total_bytes,
+                "idle_ttl": self.idle_ttl,
+                "evictions": self.evictions
+            }
+
+
+class SessionCookieMiddleware:
+    """
+    ASGI middleware giving clients that send no session id their own session.
+
+    The session cookie of the request, if any, is put in the request state
+    (`session_cookie`). An endpoint that generates an id for a client without
+    one stores it as `new_session_id`, and the response sets it as the cookie,
+    so the client's later requests land in the same session.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        state = scope.setdefault("state", {})
+        state["session_cookie"] = None
+        for name, value in scope.get("headers", []):
+            if name == b"cookie":
+                morsel = SimpleCookie(value.decode("latin-1")).get(SESSION_COOKIE)
+                if morsel is not None and morsel.value:
+                    state["session_cookie"] = morsel.value
+
+        async def send_with_cookie(message):
+            if message["type"] == "http.response.start" and state.get("new_session_id"):
+                message = {**message, "headers": [*message.get("headers", []), (b"set-cookie", session_cookie(state["new_session_id"]))]}
+            await send(message)
+
+        await self.app(scope, receive, send_with_cookie)
@@ -0,0 +1,157 @@
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Optional, Tuple
+import numpy as np
+from PIL import Image
+import logging
+
+from src.preprocessing import InputSpec, prepare_into
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Views in the order they are added: the whole photo first (the normal
+# single-crop input), then its mirror image, then crops that enlarge
+# off-centre or small lesions
+VIEWS = ("full", "flip", "center", "top_left", "top_right", "bottom_left", "bottom_right", "center_flip")
+# Side of each crop relative to the photo
+CROP_SCALE = 0.8
+# Every Nth request cut to a single crop by the budget runs two views instead
+PROBE_INTERVAL = 16
+
+
+def _crop_box(view: str, width: int, height: int, scale: float = CROP_SCALE) -> Tuple[int, int, int, int]:
+    crop_width, crop_height = int(width * scale), int(height * scale)
+    left = {"left": 0, "right": width - crop_width}.get(view.split("_")[-1], (width - crop_width) // 2)
+    top = {"top": 0, "bottom": height - crop_height}.get(view.split("_")[0], (height - crop_height) // 2)
+    return (left, top, left + crop_width, top + crop_height)
+
+
+def make_views(img: Image.Image, spec: InputSpec, views: int, out: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Preprocess several crops and flips of one decoded image as a batch
+
+    Args:
+        img: RGB image from decode_image
+        spec: Target model input
+        views: Number of views, taken in VIEWS order (at most len(VIEWS))
+        out: Optional float32 array of shape (>= views, height, width, 3) to fill
+    Returns: float32 array of shape (views, height, width, 3); row 0 is the
+        same input as single-crop preprocessing
+    """
+    views = max(1, min(views, len(VIEWS)))
+    if out is None:
+        out = np.empty((views, *spec.shape), dtype=np.float32)
+
+    for i, view in enumerate(VIEWS[:views]):
+        if view == "full":
+            prepare_into(img, spec, out[i])
+        elif view.endswith("flip"):
+            # Mirror an already prepared row instead of resizing again
+            source = VIEWS.index("center" if view == "center_flip" else "full")
+            out[i] = out[source][:, ::-1]
+        else:
+            prepare_into(img.crop(_crop_box(view, *img.size)), spec, out[i])
+    return out[:views]
+
+
+def average_logits(probs: np.ndarray) -> np.ndarray:
+    """
+    Combine per-view softmax outputs into one distribution
+
+    The classifiers end in a softmax, so log-probabilities stand in for the
+    logits (they differ by a per-view constant); their mean is turned back
+    into probabilities.
+
+    Args: probs: Array of shape (views, classes)
+    Returns: Array of shape (classes,)
+    """
+    logits = np.log(np.clip(probs, 1e-7, 1.0)).mean(axis=0)
+    exp = np.exp(logits - logits.max())
+    return exp / exp.sum()
+
+
+class TTAPolicy:
+    """
+    Decides how many test-time augmentation views a request gets.
+
+    Requests fall back to a single crop when more than `max_load` images are
+    queued or in flight, and the number of views is capped so the measured
+    per-view cost stays within `budget_ms`.
+    """
+
+    def __init__(self, max_views: int = 8, budget_ms: float = 150.0, max_load: int = 4, smoothing: float = 0.2):
+        """
+        Args:
+            max_views: Largest number of views per request (at most len(VIEWS))
+            budget_ms: Target preprocessing plus forward time of one TTA request
+            max_load: Queued or in-flight images above which TTA is skipped
+            smoothing: Weight of the newest sample in the per-view cost average
+        """
+        self.max_views = max(1, min(max_views, len(VIEWS)))
+        self.budget = budget_ms / 1000.0
+        self.max_load = max_load
+        self.smoothing = smoothing
+        self.view_cost: Optional[float] = None
+        self.in_flight = 0
+        self.requests = 0
+        self.fallbacks = {"load": 0, "budget": 0}
+        self._lock = threading.Lock()
+
+    def plan(self, requested: Optional[int], load: int = 0) -> Tuple[int, Optional[str]]:
+        """
+        Number of views to run for a request
+
+        Args:
+            requested: Views asked for; None or <= 1 means single crop
+            load: Images queued elsewhere, e.g. the batch scheduler's queue depth
+        Returns: (views, reason for running fewer than requested or None)
+        """
+        if not requested or requested <= 1:
+            return 1, None
+
+        with self._lock:
+            self.requests += 1
+            if load + self.in_flight > self.max_load:
+                self.fallbacks["load"] += 1
+                return 1, "load"
+
+            views = min(requested, self.max_views)
+            if self.view_cost:
+                affordable = max(1, int(self.budget / self.view_cost))
+                if affordable < views:
+                    self.fallbacks["budget"] += 1
+                    # The cost is only measured on TTA runs, so now and then
+                    # run two views to notice when it has come down again
+                    if affordable == 1 and self.fallbacks["budget"] % PROBE_INTERVAL == 0:
+                        affordable = 2
+                    return affordable, "budget"
+            return views, None
+
+    @contextmanager
+    def track(self, views: int):
+        """Count a TTA request as in flight and record its cost per view"""
+        with self._lock:
+            self.in_flight += 1
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            cost = (time.perf_counter() - start) / views
+            with self._lock:
+                self.in_flight -= 1
+                self.view_cost = cost if self.view_cost is None else (
+                    self.smoothing * cost + (1 - self.smoothing) * self.view_cost
+                )
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "max_views": self.max_views,
+                "budget_ms": round(self.budget * 1000, 1),
+                "max_load": self.max_load,
+                "view_cost_ms": round(self.view_cost * 1000, 2) if self.view_cost else None,
+                "requests": self.requests,
+                "fallbacks": dict(self.fallbacks)
+            }
@@ -0,0 +1,130 @@
+import io
+import os
+import zipfile
+from typing import List, Optional, Tuple
+import logging
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".bmp", ".webp", ".tif", ".tiff"}
+
+
+class UploadLimitError(ValueError):
+    """Raised when an upload exceeds the configured file or size limits"""
+
+
+def is_zip_upload(filename: str, contents: bytes) -> bool:
+    """Check whether an uploaded file is a zip archive"""
+    if filename and filename.lower().endswith(".zip"):
+        return True
+    return contents[:4] == b"PK\x03\x04"
+
+
+async def read_upload(file, max_bytes: int, chunk_size: int = 1024 * 1024) -> bytes:
+    """
+    Read an uploaded file (FastAPI UploadFile) in chunks, refusing it once it exceeds a limit
+
+    Args:
+        file: The uploaded file
+        max_bytes: Maximum size in bytes
+        chunk_size: Bytes read at a time
+    Returns: The file contents
+    Raises: UploadLimitError when the file is larger than max_bytes
+    """
+    error = UploadLimitError(f"{file.filename or 'Upload'} exceeds the limit of {max_bytes} bytes")
+    if file.size is not None and file.size > max_bytes:
+        raise error
+    chunks = []
+    total = 0
+    while True:
+        chunk = await file.read(chunk_size)
+        if not chunk:
+            return b"".join(chunks)
+        total += len(chunk)
+        if total > max_bytes:
+            raise error
+        chunks.append(chunk)
+
+
+async def read_uploads(files, max_file_bytes: int, max_total_bytes: int) -> List[Tuple[str, bytes]]:
+    """
+    Read the files of a batch upload within a per-file and a total size limit
+
+    Files named *.zip are only held to the total limit; the images inside are
+    checked against the per-file limit by expand_uploads.
+
+    Returns: (filename, contents) pairs
+    Raises: UploadLimitError when a file or the batch is too large
+    """
+    uploads = []
+    remaining = max_total_bytes
+    for file in files:
+        limit = remaining if is_zip_upload(file.filename, b"") else min(max_file_bytes, remaining)
+        try:
+            contents = await read_upload(file, limit)
+        except UploadLimitError:
+            if limit == remaining:
+                raise UploadLimitError(f"Batch exceeds the limit of {max_total_bytes} bytes")
+            raise
+        remaining -= len(contents)
+        uploads.append((file.filename, contents))
+    return uploads
+
+
+def expand_uploads(
+    uploads: List[Tuple[str, bytes]],
+    max_files: int = 64,
+    max_total_bytes: int = 200 * 1024 * 1024,
+    max_file_bytes: Optional[int] = None
+) -> List[Tuple[str, bytes]]:
+    """
+    Flatten a list of uploaded files, extracting images from zip archives
+
+    Args:
+        uploads: (filename, contents) pairs as received from the client
+        max_files: Maximum number of images accepted in one batch
+        max_total_bytes: Maximum total size of extracted image data
+        max_file_bytes: Maximum size of one image extracted from an archive (None for no limit)
+    Returns: (filename, contents) pairs, one per image, in upload order
+    """
+    images: List[Tuple[str, bytes]] = []
+    total_bytes = 0
+
+    def add(name: str, data: bytes):
+        nonlocal total_bytes
+        if len(images) >= max_files:
+            raise UploadLimitError(f"Batch exceeds the limit of {max_files} images")
+        total_bytes += len(data)
+        if total_bytes > max_total_bytes:
+            raise UploadLimitError(f"Batch exceeds the limit of {max_total_bytes} bytes")
+        images.append((name, data))
+
+    for filename, contents in uploads:
+        if not is_zip_upload(filename, contents):
+            add(filename, contents)
+            continue
+
+        try:
+            archive = zipfile.ZipFile(io.BytesIO(contents))
+        except zipfile.BadZipFile as e:
+            # Keep the entry so the client gets a per-file error for it
+            logger.warning(f"Invalid zip archive {filename}: {e}")
+            add(filename, contents)
+            continue
+
+        with archive:
+            for info in archive.infolist():
+                if info.is_dir():
+                    continue
+                base = os.path.basename(info.filename)
+                if base.startswith(".") or os.path.splitext(base)[1].lower() not in IMAGE_EXTENSIONS:
+                    continue
+                # Check the declared size before inflating to avoid zip bombs
+                if max_file_bytes is not None and info.file_size > max_file_bytes:
+                    raise UploadLimitError(f"{filename}/{info.filename} exceeds the limit of {max_file_bytes} bytes")
+                if total_bytes + info.file_size > max_total_bytes:
+                    raise UploadLimitError(f"Batch exceeds the limit of {max_total_bytes} bytes")
+                add(f"{filename}/{info.filename}", archive.read(info))
+
+    return images
@@ -0,0 +1,244 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+import requests
+from requests.adapters import HTTPAdapter
+import logging
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# WEATHER_API_URL can point at a local stand-in (see Backend/benchmarks/fakes.py)
+WEATHER_API_URL = os.getenv("WEATHER_API_URL", "http://api.weatherapi.com/v1")
+
+
+def normalize_location(location: str) -> str:
+    """Cache key for a location, so "pune" and "Pune " share one entry"""
+    return " ".join(location.split()).casefold()
+
+
+def _reduce_current(data: Dict) -> Dict:
+    """The current.json fields the chatbot and frontend use"""
+    location, current = data["location"], data["current"]
+    return {
+        "location": location["name"],
+        "region": location["region"],
+        "country": location["country"],
+        "temperature": current["temp_c"],
+        "feels_like": current["feelslike_c"],
+        "conditions": current["condition"]["text"],
+        "humidity": current["humidity"],
+        "wind_speed": current["wind_kph"],
+        "wind_direction": current["wind_dir"],
+        "rainfall": current.get("precip_mm", 0),
+        "cloud_cover": current["cloud"],
+        "uv_index": current["uv"]
+    }
+
+
+def _reduce_forecast(data: Dict) -> List[Dict]:
+    """
+    Daily summaries of forecast.json, without the hourly and astro blocks
+    that make up most of the payload (same keys, so consumers read it as before)
+    """
+    days = []
+    for forecast_day in data["forecast"]["forecastday"]:
+        day = forecast_day["day"]
+        condition = day.get("condition", {})
+        days.append({
+            "date": forecast_day["date"],
+            "day": {
+                "maxtemp_c": day.get("maxtemp_c"),
+                "mintemp_c": day.get("mintemp_c"),
+                "totalprecip_mm": day.get("totalprecip_mm"),
+                "daily_chance_of_rain": day.get("daily_chance_of_rain"),
+                "condition": {"text": condition.get("text"), "icon": condition.get("icon")}
+            }
+        })
+    return days
+
+
+class WeatherClient:
+    """
+    Cached weatherapi.com client.
+
+    Current conditions and the 7-day forecast are cached per location with
+    separate TTLs, reduced to the fields the chatbot uses. Failed fetches are
+    remembered for a short TTL so a bad location or an upstream outage is not
+    retried on every request. Concurrent misses for the same location share a
+    single upstream fetch, and the current/forecast calls run concurrently
+    over a pooled HTTP session.
+    """
+
+    def __init__(
+        self,
+        current_ttl: float = 600,
+        forecast_ttl: float = 3600,
+        failure_ttl: float = 30,
+        timeout: float = 10,
+        max_locations: int = 1024,
+        base_url: str = WEATHER_API_URL
+    ):
+        """
+        Args:
+            current_ttl: Seconds current conditions stay fresh
+            forecast_ttl: Seconds the 7-day forecast stays fresh
+            failure_ttl: Seconds a failed fetch is remembered before retrying upstream
+            timeout: Timeout of each upstream request in seconds
+            max_locations: Maximum number of locations kept per cache
+            base_url: weatherapi.com API root
+        """
+        self.ttls = {"current": current_ttl, "forecast": forecast_ttl}
+        self.failure_ttl = failure_ttl
+        self.timeout = timeout
+        self.max_locations = max_locations
+        self.base_url = base_url.rstrip("/")
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=32)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="weather")
+
+        self._cache: Dict[str, "OrderedDict[str, Tuple[float, object]]"] = {
+            "current": OrderedDict(),
+            "forecast": OrderedDict()
+        }
+        self._failures: "OrderedDict[Tuple[str, str], float]" = OrderedDict()
+        self._in_flight: Dict[Tuple[str, str], Future] = {}
+        self._lock = threading.Lock()
+        self.upstream_calls = 0
+
+    def _failed_recently(self, kind: str, key: str) -> bool:
+        """Whether the last fetch of this kind for the location failed within failure_ttl"""
+        with self._lock:
+            failed_at = self._failures.get((kind, key))
+            if failed_at is None:
+                return False
+            if time.time() - failed_at > self.failure_ttl:
+                del self._failures[(kind, key)]
+                return False
+            return True
+
+    def _remember_failure(self, kind: str, key: str):
+        with self._lock:
+            self._failures[(kind, key)] = time.time()
+            self._failures.move_to_end((kind, key))
+            while len(self._failures) > self.max_locations:
+                self._failures.popitem(last=False)
+
+    def _cached(self, kind: str, key: str):
+        """Return a fresh cache entry or None"""
+        with self._lock:
+            entry = self._cache[kind].get(key)
+            if entry is None:
+                return None
+            fetched_at, data = entry
+            if time.time() - fetched_at > self.ttls[kind]:
+                del self._cache[kind][key]
+                return None
+            self._cache[kind].move_to_end(key)
+            return data
+
+    def _fetch(self, kind: str, location: str, api_key: str):
+        """Fetch one upstream document and reduce it; returns None on a non-200 response"""
+        if kind == "current":
+            url = f"{self.base_url}/current.json"
+            params = {"key": api_key, "q": location, "aqi": "no"}
+        else:
+            url = f"{self.base_url}/forecast.json"
+            params = {"key": api_key, "q": location, "days": 7, "aqi": "no", "alerts": "no"}
+
+        self.upstream_calls += 1
+        response = self.session.get(url, params=params, timeout=self.timeout)
+        if response.status_code != 200:
+            logger.warning(f"Weather API returned status {response.status_code}")
+            return None
+        data = response.json()
+        return _reduce_current(data) if kind == "current" else _reduce_forecast(data)
+
+    def _get(self, kind: str, location: str, api_key: str):
+        """Cached, coalesced fetch of one reduced document kind for a location"""
+        key = normalize_location(location)
+        data = self._cached(kind, key)
+        if data is not None:
+            return data
+        if self._failed_recently(kind, key):
+            return None
+
+        with self._lock:
+            future = self._in_flight.get((kind, key))
+            owner = future is None
+            if owner:
+                future = self._in_flight[(kind, key)] = Future()
+
+        if not owner:
+            return future.result()
+
+        try:
+            data = self._fetch(kind, location, api_key)
+            if data is not None:
+                with self._lock:
+                    cache = self._cache[kind]
+                    cache[key] = (time.time(), data)
+                    cache.move_to_end(key)
+                    while len(cache) > self.max_locations:
+                        cache.popitem(last=False)
+            else:
+                self._remember_failure(kind, key)
+            future.set_result(data)
+            return data
+        except Exception as e:
+            self._remember_failure(kind, key)
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._in_flight.pop((kind, key), None)
+
+    def get_weather(self, location: str) -> Optional[Dict]:
+        """
+        Weather summary for a location
+
+        Args: location: City or place name understood by weatherapi.com
+        Returns: Dictionary with current conditions and the 7-day forecast, or None
+        """
+        api_key = os.getenv("WEATHER_API_KEY")
+        if not api_key:
+            logger.warning("Weather API key not found")
+            return None
+
+        try:
+            current_future = self._executor.submit(self._get, "current", location, api_key)
+            forecast_future = self._executor.submit(self._get, "forecast", location, api_key)
+            current_data = current_future.result()
+            forecast_data = forecast_future.result()
+
+            if current_data is None or forecast_data is None:
+                return None
+
+            return {**current_data, "forecast": forecast_data}
+        except requests.exceptions.RequestException as e:
+            logger.error(f"Error fetching weather data: {e}")
+            return None
+        except Exception as e:
+            logger.error(f"Unexpected error in weather data fetch: {e}")
+            return None
+
+    def stats(self) -> Dict:
+        """Cache sizes and number of upstream requests made"""
+        with self._lock:
+            return {
+                "current_entries": len(self._cache["current"]),
+                "forecast_entries": len(self._cache["forecast"]),
+                "failure_entries": len(self._failures),
+                "upstream_calls": self.upstream_calls
+            }
+
+    def close(self):
+        """Release pooled connections and worker threads"""
+        self._executor.shutdown(wait=False)
+        self.session.close()
@@ -2,6 +2,13 @@ document.addEventListener('DOMContentLoaded', () => {
     // API Configuration
     const API_BASE_URL = 'http://localhost:8000';
 
+    // Chat session id, so location and chat memory are per user
+    let SESSION_ID = localStorage.getItem('sessionId');
+    if (!SESSION_ID) {
+        SESSION_ID = (window.crypto && crypto.randomUUID) ? crypto.randomUUID() : `${Date.now()}-${Math.random().toString(36).slice(2)}`;
+        localStorage.setItem('sessionId', SESSION_ID);
+    }
+
     // Navbar Functionality
     const navbar = document.querySelector('.navbar');
     window.addEventListener('scroll', () => {
@@ -34,7 +41,7 @@ document.addEventListener('DOMContentLoaded', () => {
     const fetchWeather = async (location = null) => {
         try {
             const url = location ? `${API_BASE_URL}/weather/${location}` : `${API_BASE_URL}/weather/`;
-            const response = await fetch(url);
+            const response = await fetch(url, { headers: { 'X-Session-ID': SESSION_ID } });
             
             if (!response.ok) {
                 throw new Error('Weather data not available.');
@@ -103,7 +110,7 @@ document.addEventListener('DOMContentLoaded', () => {
             // Update location on backend
             await fetch(`${API_BASE_URL}/set-location/`, {
                 method: 'PUT',
-                headers: { 'Content-Type': 'application/json' },
+                headers: { 'Content-Type': 'application/json', 'X-Session-ID': SESSION_ID },
                 body: JSON.stringify({ location: location })
             });
             // Fetch new weather data
@@ -266,6 +273,7 @@ document.addEventListener('DOMContentLoaded', () => {
         messageDiv.innerHTML = isUser ? `<p>${message}</p>` : message;
         chatbotMessages.appendChild(messageDiv);
         chatbotMessages.scrollTop = chatbotMessages.scrollHeight;
+        return messageDiv;
     };
 
     const addTypingIndicator = () => {
@@ -282,6 +290,49 @@ document.addEventListener('DOMContentLoaded', () => {
         if (typingIndicator) typingIndicator.remove();
     };
 
+    const fetchReply = async (message) => {
+        const response = await fetch(`${API_BASE_URL}/chatbot/?query=${encodeURIComponent(message)}`, {
+            headers: { 'X-Session-ID': SESSION_ID }
+        });
+        const data = await response.json();
+        removeTypingIndicator();
+        if (data.response) {
+            addMessage(data.response);
+        } else {
+            addMessage('<p>Sorry, I couldn\'t process your request.</p>');
+        }
+    };
+
+    // Render the answer token by token as the server streams it
+    const streamReply = (message) => new Promise((resolve, reject) => {
+        const url = `${API_BASE_URL}/chatbot/stream/?query=${encodeURIComponent(message)}&session_id=${encodeURIComponent(SESSION_ID)}`;
+        const source = new EventSource(url);
+        let html = '';
+        let bubble = null;
+
+        source.addEventListener('token', (event) => {
+            html += JSON.parse(event.data).text;
+            if (!bubble) {
+                removeTypingIndicator();
+                bubble = addMessage('');
+            }
+            bubble.innerHTML = html;
+            chatbotMessages.scrollTop = chatbotMessages.scrollHeight;
+        });
+        source.addEventListener('done', () => {
+            source.close();
+            resolve();
+        });
+        source.onerror = () => {
+            source.close();
+            if (bubble) {
+                resolve();
+            } else {
+                fetchReply(message).then(resolve, reject);
+            }
+        };
+    });
+
     const sendMessage = async () => {
         const message = chatInput.value.trim();
         if (!message) return;
@@ -292,13 +343,10 @@ document.addEventListener('DOMContentLoaded', () => {
         addTypingIndicator();
 
         try {
-            const response = await fetch(`${API_BASE_URL}/chatbot/?query=${encodeURIComponent(message)}`);
-            const data = await response.json();
-            removeTypingIndicator();
-            if (data.response) {
-                addMessage(data.response);
+            if (window.EventSource) {
+                await streamReply(message);
             } else {
-                addMessage('<p>Sorry, I couldn\'t process your request.</p>');
+                await fetchReply(message);
             }
         } catch (error) {
             console.error('Chatbot error:', error);
@@ -311,7 +359,10 @@ document.addEventListener('DOMContentLoaded', () => {
 
     const clearChat = async () => {
         try {
-            await fetch(`${API_BASE_URL}/clear-memory/`, { method: 'POST' });
+            await fetch(`${API_BASE_URL}/clear-memory/`, {
+                method: 'POST',
+                headers: { 'X-Session-ID': SESSION_ID }
+            });
         } catch (error) {
             console.error("Failed to clear backend memory:", error);
         }